@@ -25,4 +25,45 @@ CREATE INDEX IF NOT EXISTS idx_publisher ON books(publisher);
 CREATE INDEX IF NOT EXISTS idx_main_category ON books(main_category);
 CREATE INDEX IF NOT EXISTS idx_rating ON books(average_rating DESC); -- Sắp xếp giảm dần
 CREATE INDEX IF NOT EXISTS idx_price ON books(price);
-CREATE INDEX IF NOT EXISTS idx_pub_year ON books(publication_year);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_pub_year ON books(publication_year);
+
+-- Ánh xạ sách -> label trong FAISS index (IndexIDMap2), dùng cho cập nhật tăng dần
+DROP TABLE IF EXISTS book_vectors;
+
+CREATE TABLE book_vectors (
+    unique_id TEXT PRIMARY KEY,
+    label INTEGER NOT NULL,             -- vị trí trong unique_ids / embeddings.npy
+    doc_hash TEXT                       -- sha1 của rag_document_text, NULL = chưa biết
+);
+
+-- Full-text search (BM25) trên các cột "định danh" của sách: tên sách, tác giả, NXB, thể loại, ISBN.
+-- External content table: chỉ lưu index, nội dung đọc từ books qua rowid.
+-- Giữ đồng bộ với sql_database.FTS_SCHEMA (dùng để nâng cấp DB cũ).
+DROP TABLE IF EXISTS books_fts;
+
+CREATE VIRTUAL TABLE books_fts USING fts5(
+    title, author_name, publisher, categories, isbn_13,
+    content='books', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES (new.rowid, new.title, new.author_name, new.publisher, new.categories, new.isbn_13);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES ('delete', old.rowid, old.title, old.author_name, old.publisher, old.categories, old.isbn_13);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES ('delete', old.rowid, old.title, old.author_name, old.publisher, old.categories, old.isbn_13);
+    INSERT INTO books_fts(rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES (new.rowid, new.title, new.author_name, new.publisher, new.categories, new.isbn_13);
+END;
+
+-- Bảng tổng hợp theo thể loại / tác giả (category_stats, category_top_rated, author_stats, author_top_rated)
+-- cùng index và trigger cập nhật tăng dần được tạo bởi sql_database.ensure_summary_tables
+-- (src/cli.py build-index tính lại toàn bộ sau khi nạp dữ liệu).
@@ -3,14 +3,15 @@ from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_openai_tools_agent, AgentExecutor
-from langchain_community.utilities import SQLDatabase
-from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
 
 # Imports từ Project 
-from config import SQL_DB_PATH, LLM_MODEL
+from config import LLM_MODEL, SQL_TOOL_MAX_ROWS
+from sql_database import summary_tables_description
 from retriever.smart_retriever import SmartRetriever
 from agent.tools import (
     SmartRAGTool,
+    EntityLookupTool,
+    GuardedSQLTool,
     SavePreferenceTool,
     GetPersonalizedRecommendationTool
 )
@@ -22,12 +23,14 @@ AGENT_PROMPT = ChatPromptTemplate.from_messages(
             "Bạn là 'BookInsight', một trợ lý AI thông thái và cá nhân hóa. "
             "Bạn phải luôn suy nghĩ TỪNG BƯỚC MỘT.\n"
             
-            "Bạn có 4 công cụ:\n"
+            "Bạn có 5 công cụ:\n"
             "1. 'smart_book_retriever' (RAG Tool): Dùng cho câu hỏi MỞ (tóm tắt, nội dung, tiểu sử, gợi ý theo chủ đề).\n"
             "2. 'sql_tool' (SQL Tool): Dùng cho câu hỏi CỤ THỂ (giá, rating, đếm, so sánh, max/min).\n"
             "3. 'save_user_preference' (Save Tool): CHỈ dùng tool này khi người dùng BÀY TỎ SỞ THÍCH (ví dụ: 'tôi thích...', 'tác giả yêu thích của tôi là...').\n"
             "4. 'get_personalized_recommendation' (Rec Tool): CHỈ dùng tool này khi người dùng hỏi GỢI Ý CHUNG CHUNG (ví dụ: 'gợi ý sách cho tôi', 'tìm sách hay đi').\n"
             "**KHÔNG** dùng tool này khi người dùng chỉ đang LƯU SỞ THÍCH.\n"
+            "5. 'book_entity_lookup' (Entity Tool): Dùng khi cần tìm sách / tác giả THEO TÊN (ví dụ: 'tác giả của cuốn đó là ai', 'các sách khác của tác giả đó'). "
+            "Nhanh hơn RAG Tool và SQL LIKE; dùng unique_id trả về cho các bước tiếp theo.\n"
             
             "QUY TẮC QUAN TRỌNG NHẤT:\n"
             "Nếu một câu hỏi phức tạp (ví dụ: 'tóm tắt cuốn sách đắt nhất...'), "
@@ -50,23 +53,28 @@ def create_book_agent_executor():
     
     print("[AgentFactory] Đang khởi tạo RAG, SQL...")
     smart_rag_engine = SmartRetriever(device='cpu') # RAG
-    db = SQLDatabase.from_uri(f"sqlite:///{SQL_DB_PATH}") # SQL
     
-    print("[AgentFactory] Đang khởi tạo 4 Tools...")
+    print("[AgentFactory] Đang khởi tạo 5 Tools...")
     rag_tool = SmartRAGTool(rag_engine=smart_rag_engine)
+    entity_tool = EntityLookupTool(rag_engine=smart_rag_engine)
     
-    sql_tool = QuerySQLDatabaseTool(db=db, llm=llm)
+    # SQL: chạy qua sql_guard.py trên connection chỉ đọc, có giới hạn thời gian / số dòng
+    sql_tool = GuardedSQLTool()
     sql_tool.description = ( 
         "Rất hữu ích khi bạn cần trả lời các câu hỏi về dữ liệu CÓ CẤU TRÚC (structured data) "
         "như giá (price), xếp hạng (rating), số trang (page_count), năm xuất bản (publication_year), "
         "hoặc để đếm (count), tính trung bình (average), tìm giá trị lớn nhất (max)/nhỏ nhất (min). "
+        "Với câu hỏi theo THỂ LOẠI (main_category) hoặc TÁC GIẢ (author_name) như số sách, giá thấp nhất/cao nhất, "
+        "rating trung bình, sách rating cao nhất: ƯU TIÊN đọc các bảng tổng hợp (luôn được cập nhật) thay vì "
+        f"GROUP BY / ORDER BY trên toàn bảng books: {summary_tables_description()}. "
+        f"Kết quả trả về tối đa {SQL_TOOL_MAX_ROWS} dòng, luôn dùng WHERE / LIMIT cụ thể. "
         "KHÔNG dùng tool này để hỏi về mô tả sách, nội dung, hay tiểu sử tác giả."
     )
     
     save_pref_tool = SavePreferenceTool()
     get_rec_tool = GetPersonalizedRecommendationTool(rag_tool=rag_tool) # Tool gọi tool
     
-    tools = [rag_tool, sql_tool, save_pref_tool, get_rec_tool]
+    tools = [rag_tool, sql_tool, save_pref_tool, get_rec_tool, entity_tool]
     
     # khởi tạo memory
     memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
@@ -0,0 +1,46 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.tracing import current_span_id, current_trace
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Ghi một span cho mỗi lần Agent gọi LLM hoặc gọi tool (kể cả sql_tool của LangChain)
+    vào trace của request hiện tại (utils/tracing.py). Không có trace thì không làm gì.
+    """
+
+    def __init__(self):
+        self._open_spans = {}
+
+    def _begin(self, run_id, name, **attrs):
+        trace = current_trace()
+        if trace is None:
+            return
+        self._open_spans[run_id] = (trace, trace.begin(name, parent_id=current_span_id(), **attrs))
+
+    def _end(self, run_id, **attrs):
+        entry = self._open_spans.pop(run_id, None)
+        if entry is not None:
+            trace, record = entry
+            trace.end(record, **attrs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._begin(run_id, "agent_llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._begin(run_id, "agent_llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error))
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._begin(run_id, f"tool:{(serialized or {}).get('name', 'unknown')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error))
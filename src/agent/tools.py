@@ -1,15 +1,23 @@
 import json
 import sqlite3
-from typing import Type, Any
+from typing import Type, Any, Optional
 from pydantic import BaseModel, Field, PrivateAttr
 from langchain_core.tools import BaseTool
 
-from config import SQL_DB_PATH
+from config import SQL_RESULT_CACHE_SIZE, SQL_RESULT_CACHE_TTL_S, SQL_TOOL_TIMEOUT_S
 from retriever.smart_retriever import SmartRetriever
+from sql_database import get_pool
+from sql_guard import SQLResultCache, UnsafeQueryError, run_guarded_query
 
 # SmartRAGTool
 class SmartRAGInput(BaseModel):
     query: str = Field(description="Một câu hỏi hoặc chủ đề để tìm kiếm sách.")
+    category: Optional[str] = Field(default=None, description="Lọc theo thể loại chính (main_category), ví dụ 'Fantasy'.")
+    min_price: Optional[float] = Field(default=None, description="Giá thấp nhất (USD).")
+    max_price: Optional[float] = Field(default=None, description="Giá cao nhất (USD).")
+    min_rating: Optional[float] = Field(default=None, description="Điểm đánh giá trung bình tối thiểu (0-5).")
+    min_year: Optional[int] = Field(default=None, description="Năm xuất bản từ năm này trở về sau.")
+    max_year: Optional[int] = Field(default=None, description="Năm xuất bản đến năm này.")
 
 class SmartRAGTool(BaseTool):
     """
@@ -19,7 +27,9 @@ class SmartRAGTool(BaseTool):
     name: str = "smart_book_retriever" 
     description: str = (
         "Rất hữu ích khi cần trả lời câu hỏi về nội dung sách, mô tả sách, "
-        "tiểu sử tác giả, gợi ý sách theo chủ đề."
+        "tiểu sử tác giả, gợi ý sách theo chủ đề. "
+        "Có thể kèm bộ lọc category / min_price / max_price / min_rating / min_year / max_year "
+        "khi người dùng yêu cầu điều kiện cụ thể (ví dụ: 'sách fantasy dưới 10$ rating trên 4')."
     )
     args_schema: Type[BaseModel] = SmartRAGInput
 
@@ -29,14 +39,118 @@ class SmartRAGTool(BaseTool):
         super().__init__(**data)
         self._rag_engine = rag_engine
 
-    def _run(self, query: str) -> str:
+    def _run(self, query: str, category: Optional[str] = None,
+             min_price: Optional[float] = None, max_price: Optional[float] = None,
+             min_rating: Optional[float] = None,
+             min_year: Optional[int] = None, max_year: Optional[int] = None) -> str:
+        filters = {
+            "category": category,
+            "price": {"min": min_price, "max": max_price},
+            "rating": {"min": min_rating},
+            "year": {"min": min_year, "max": max_year},
+        }
         print(f"\n[SmartRAGTool] đang chạy với câu hỏi: {query}")
         try:
-            results = self._rag_engine.retrieve(query, top_k=3)
+            results = self._rag_engine.retrieve(query, top_k=3, filters=filters)
+            if not results:
+                return "Không tìm thấy sách nào thỏa các điều kiện lọc."
             return json.dumps(results, indent=2, ensure_ascii=False)
         except Exception as e:
             return f"Lỗi khi chạy SmartRAGTool: {e}"
 
+    async def _arun(self, query: str, **filters) -> str:
+        return self._run(query, **filters)
+
+# EntityLookupTool
+class EntityLookupInput(BaseModel):
+    name: str = Field(description="Tên sách hoặc tên tác giả cần tìm (có thể viết thiếu / sai chính tả).")
+    kind: Optional[str] = Field(default=None, description="'title' (tên sách), 'author' (tác giả) hoặc bỏ trống để tìm cả hai.")
+
+class EntityLookupTool(BaseTool):
+    """
+    Đổi TÊN sách / TÊN tác giả thành sách cụ thể (unique_id, tác giả, năm, rating)
+    qua EntityIndex trong RAM, không cần RAG-Fusion hay câu SQL LIKE.
+    """
+    name: str = "book_entity_lookup"
+    description: str = (
+        "Rất hữu ích khi cần tìm một cuốn sách hoặc tác giả THEO TÊN: tác giả của một cuốn sách, "
+        "các sách khác của một tác giả, unique_id của sách để dùng tiếp trong SQL. "
+        "Chấp nhận tên viết thiếu hoặc sai chính tả. Trả về kết quả ngay, nhanh hơn RAG và SQL LIKE."
+    )
+    args_schema: Type[BaseModel] = EntityLookupInput
+
+    _rag_engine: SmartRetriever = PrivateAttr()
+
+    def __init__(self, rag_engine: SmartRetriever, **data):
+        super().__init__(**data)
+        self._rag_engine = rag_engine
+
+    def _run(self, name: str, kind: Optional[str] = None) -> str:
+        print(f"\n[EntityLookupTool] Đang tìm: {name} ({kind or 'title + author'})")
+        try:
+            matches = self._rag_engine.resolve_entity(name, kind=kind)
+        except Exception as e:
+            return f"Lỗi khi chạy EntityLookupTool: {e}"
+        if not matches:
+            return f"Không tìm thấy sách hay tác giả nào có tên gần với '{name}'."
+        return json.dumps(matches, indent=2, ensure_ascii=False)
+
+    async def _arun(self, name: str, kind: Optional[str] = None) -> str:
+        return self._run(name, kind)
+
+# GuardedSQLTool
+class GuardedSQLInput(BaseModel):
+    query: str = Field(description="Một câu SQL SELECT (SQLite) hợp lệ.")
+
+class GuardedSQLTool(BaseTool):
+    """
+    Thay cho QuerySQLDatabaseTool: chạy câu SQL do LLM sinh ra qua sql_guard.py
+    (kiểm tra EXPLAIN QUERY PLAN, luôn có LIMIT, giới hạn thời gian / số dòng / số byte).
+    Kết quả được cache (SQLResultCache) và tự xóa khi SavePreferenceTool / CatalogUpdater
+    ghi vào bảng mà câu lệnh đã đọc.
+    """
+    name: str = "sql_db_query"
+    description: str = (
+        "Chạy một câu SQL SELECT trên database sách (SQLite, chỉ đọc) và trả về kết quả. "
+        "Nếu câu lệnh bị từ chối hoặc lỗi, hãy sửa lại câu SQL và thử lần nữa."
+    )
+    args_schema: Type[BaseModel] = GuardedSQLInput
+
+    _cache: SQLResultCache = PrivateAttr()
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._cache = SQLResultCache(max_size=SQL_RESULT_CACHE_SIZE, ttl_s=SQL_RESULT_CACHE_TTL_S)
+        get_pool().add_write_listener(self._cache.invalidate)
+
+    def stats(self):
+        """Số hit / miss / entry bị xóa và hit rate của cache kết quả SQL."""
+        return self._cache.stats()
+
+    def _run(self, query: str) -> str:
+        print(f"\n[GuardedSQLTool] Đang chạy: {query}")
+        try:
+            result = run_guarded_query(query, cache=self._cache)
+        except UnsafeQueryError as e:
+            return f"Error: câu truy vấn bị từ chối. {e}"
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                return (f"Error: câu truy vấn chạy quá {SQL_TOOL_TIMEOUT_S}s và đã bị dừng. "
+                        "Hãy thêm điều kiện WHERE cụ thể hơn hoặc dùng các bảng tổng hợp.")
+            return f"Error: {e}"
+        except sqlite3.Error as e:
+            return f"Error: {e}"
+
+        if result["cached"]:
+            print("[GuardedSQLTool] Dùng lại kết quả đã cache.")
+        if not result["rows"]:
+            return "Không có dòng nào."
+        output = f"Cột: {result['columns']}\n{result['rows']}"
+        if result["truncated"]:
+            output += (f"\n(Kết quả đã bị cắt còn {len(result['rows'])} dòng. "
+                       "Hãy dùng LIMIT / WHERE / GROUP BY để thu hẹp kết quả.)")
+        return output
+
     async def _arun(self, query: str) -> str:
         return self._run(query)
 
@@ -62,11 +176,8 @@ class SavePreferenceTool(BaseTool):
         user_id = 1 #mặc định cho user_id = 1
         try:
             insert_sql = "INSERT OR IGNORE INTO user_preferences (user_id, preference_type, preference_value) VALUES (?, ?, ?)"
-            conn = sqlite3.connect(SQL_DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(insert_sql, (user_id, preference_type, preference_value))
-            conn.commit()
-            conn.close()
+            with get_pool().writer() as conn:
+                conn.execute(insert_sql, (user_id, preference_type, preference_value))
             return f"Đã lưu thành công sở thích :{preference_type} = {preference_value}."
         except Exception as e:
             return f"Lỗi khi lưu sở thích: {e}"
@@ -101,11 +212,10 @@ class GetPersonalizedRecommendationTool(BaseTool):
         user_id = 1
         preferences = []
         try:
-            conn = sqlite3.connect(SQL_DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT preference_type, preference_value FROM user_preferences WHERE user_id = ?", (user_id,))
-            rows = cursor.fetchall()
-            conn.close()
+            conn = get_pool().reader()
+            rows = conn.execute(
+                "SELECT preference_type, preference_value FROM user_preferences WHERE user_id = ?", (user_id,)
+            ).fetchall()
             
             if not rows:
                 return "Tôi chưa biết sở thích của bạn. Hãy nói cho tôi biết bạn thích tác giả hoặc thể loại nào!"
@@ -3,7 +3,7 @@ import os
 from fastapi import FastAPI
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
-from typing import Any
+from typing import Any, Dict, Optional
 
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -13,6 +13,9 @@ if SRC_PATH not in sys.path:
 
 # import Agent
 from agent.agent import create_book_agent_executor
+from agent.callbacks import TracingCallbackHandler
+from config import TRACE_LOG
+from utils.tracing import start_trace
 
 
 # Tạo một biến toàn cục để giữ Agent, dùng một dictđể dễ truyền qua lại
@@ -44,11 +47,13 @@ class ChatRequest(BaseModel):
     """Mẫu JSON mà client (frontend) sẽ gửi đến"""
     user_id: str = "default_user" # Tạm thời dùng 1 user
     question: str
+    trace: bool = False # True = trả kèm thời gian từng giai đoạn (LLM, expansion, encode, FAISS, SQL, tool)
 
 class ChatResponse(BaseModel):
     """Mẫu JSON mà server sẽ trả về"""
     user_id: str
     answer: str
+    trace: Optional[Dict[str, Any]] = None
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
@@ -63,11 +68,23 @@ async def chat_endpoint(request: ChatRequest):
     if not agent_executor:
         return {"answer": "Lỗi: Agent chưa được khởi tạo."}
 
-    response = agent_executor.invoke({"input": request.question})
+    trace_data = None
+    if request.trace or TRACE_LOG:
+        with start_trace("chat") as trace:
+            response = agent_executor.invoke(
+                {"input": request.question},
+                config={"callbacks": [TracingCallbackHandler()]},
+            )
+        trace_data = trace.to_dict()
+        if TRACE_LOG:
+            print(f"[Trace] {trace.to_json()}")
+    else:
+        response = agent_executor.invoke({"input": request.question})
     
     return ChatResponse(
         user_id=request.user_id,
-        answer=response['output']
+        answer=response['output'],
+        trace=trace_data if request.trace else None,
     )
 
 @app.get("/")
@@ -0,0 +1,279 @@
+"""
+catalog.py
+==========
+Cập nhật catalogue sách tăng dần, không cần chạy lại notebook:
+    - upsert_books(books): chỉ embed sách mới / có nội dung thay đổi,
+      ghi bảng books + book_vectors trong cùng một transaction với thay đổi index
+    - delete_books(unique_ids): xóa khỏi SQL, đánh dấu tombstone trong index
+    - thread chạy nền compact tombstone và lưu index ra đĩa
+"""
+
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+
+import config
+from documents import RAG_TEXT_FIELDS, build_rag_chunks, build_rag_document, document_hash
+from sql_database import BOOK_COLUMNS, SQL_CHUNK_SIZE, bulk_summary_update, get_pool
+
+
+class CatalogUpdater:
+    def __init__(self, vector_store, db_path=None):
+        print("[CatalogUpdater] Đang khởi tạo...")
+        self.vector_store = vector_store
+        # Ghi qua connection ghi duy nhất của pool (dùng chung với các module khác), đọc qua reader
+        self.pool = get_pool(db_path)
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._stop_event = threading.Event()
+        self._maintenance_thread = None
+
+        self.vector_store.ensure_id_map()
+        self._ensure_vector_table()
+        self._load_tombstones()
+        print("[CatalogUpdater] Sẵn sàng.")
+
+    # -------------------------------------------------------------------------
+    # PUBLIC API
+    # -------------------------------------------------------------------------
+    def upsert_books(self, books, flush=True):
+        """
+        Thêm mới hoặc cập nhật sách. Mỗi book là dict gồm các cột của bảng books
+        (unique_id bắt buộc) và các trường văn bản description / features / author_about.
+        Chỉ những sách có document thay đổi mới được embed lại.
+        Cập nhật một phần sách đã có: dict không có trường văn bản nào (RAG_TEXT_FIELDS), vd.
+        {"unique_id": x, "price": 9.99}, chỉ ghi SQL, không embed lại. Đã có trường văn bản thì phải có đủ
+        author_about / description / features (không lưu trong SQL); title thiếu được lấy từ bảng books.
+        Trả về dict thống kê {"written": ..., "embedded": ...}.
+        """
+        books = [dict(b) for b in books]
+        if not books:
+            return {"written": 0, "embedded": 0}
+        if any(not b.get('unique_id') for b in books):
+            raise ValueError("Mỗi sách phải có 'unique_id'.")
+
+        unique_ids = [str(b['unique_id']) for b in books]
+        has_text = [any(f in b for f in RAG_TEXT_FIELDS) for b in books]
+
+        with self._write_lock:
+            existing = self._fetch_vector_rows(unique_ids)
+            text_books = self._merge_text_fields(books, unique_ids, has_text, existing)
+            documents = [build_rag_document(b) for b in text_books]
+            hashes = [document_hash(d) for d in documents]
+            # Sách mới luôn được embed; sách đã có chỉ khi được truyền văn bản và document đổi
+            changed = [
+                i for i, uid in enumerate(unique_ids)
+                if uid not in existing or (has_text[i] and existing[uid][1] != hashes[i])
+            ]
+            print(f"[CatalogUpdater] Upsert {len(books)} sách, cần embed {len(changed)} sách.")
+
+            vectors = self.vector_store.embed_documents([documents[i] for i in changed]) if changed else None
+            chunk_lists, chunk_vectors = None, None
+            if changed and self.vector_store.chunks is not None:
+                chunk_lists = [build_rag_chunks(text_books[i], config.CHUNK_WORDS, config.CHUNK_OVERLAP) for i in changed]
+                chunk_vectors = self.vector_store.embed_documents([c for chunks in chunk_lists for c in chunks])
+            changed_ids = [unique_ids[i] for i in changed]
+            old_labels = [existing[uid][0] for uid in changed_ids if uid in existing]
+
+            new_labels = None
+            try:
+                with self.pool.writer() as conn:
+                    with self._summary_batch(conn, unique_ids):
+                        self._write_book_rows(conn, books)
+                    if changed:
+                        new_labels = self.vector_store.add_vectors(changed_ids, vectors)
+                        if chunk_lists is not None:
+                            self.vector_store.add_chunks(new_labels, [len(c) for c in chunk_lists], chunk_vectors)
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO book_vectors (unique_id, label, doc_hash) VALUES (?, ?, ?)",
+                            [(uid, int(label), hashes[i]) for uid, label, i in zip(changed_ids, new_labels, changed)],
+                        )
+                        if old_labels:
+                            self.vector_store.remove_labels(old_labels)
+                # Thuộc tính (giá, rating, ...) có thể đổi dù vector không đổi -> làm mới các bộ lọc
+                self.vector_store.catalog_version += 1
+            except Exception:
+                self._revert_index(new_labels, old_labels)
+                raise
+
+            self._dirty = self._dirty or bool(changed)
+            if flush:
+                self.flush()
+        return {"written": len(books), "embedded": len(changed)}
+
+    def delete_books(self, unique_ids, flush=True):
+        """Xóa sách khỏi bảng books và index. Trả về số sách đã xóa."""
+        unique_ids = [str(u) for u in unique_ids]
+        if not unique_ids:
+            return 0
+
+        with self._write_lock:
+            existing = self._fetch_vector_rows(unique_ids)
+            labels = [label for label, _ in existing.values()]
+            try:
+                with self.pool.writer() as conn:
+                    with self._summary_batch(conn, unique_ids):
+                        for start in range(0, len(unique_ids), SQL_CHUNK_SIZE):
+                            chunk = unique_ids[start:start + SQL_CHUNK_SIZE]
+                            placeholders = ', '.join('?' for _ in chunk)
+                            conn.execute(f"DELETE FROM books WHERE unique_id IN ({placeholders})", chunk)
+                            conn.execute(f"DELETE FROM book_vectors WHERE unique_id IN ({placeholders})", chunk)
+                    if labels:
+                        self.vector_store.remove_labels(labels)
+            except Exception:
+                self._revert_index(None, labels)
+                raise
+
+            print(f"[CatalogUpdater] Đã xóa {len(existing)} sách.")
+            self._dirty = self._dirty or bool(labels)
+            if flush:
+                self.flush()
+        return len(existing)
+
+    def flush(self):
+        """Lưu index + id map ra đĩa nếu có thay đổi chưa lưu."""
+        if self._dirty:
+            self.vector_store.save()
+            self._dirty = False
+
+    def compact(self, min_tombstones=0):
+        """Compact các vector đã xóa nếu số lượng đạt ngưỡng."""
+        if len(self.vector_store.tombstones) < max(min_tombstones, 1):
+            return 0
+        removed = self.vector_store.compact()
+        if removed:
+            self._dirty = True
+        return removed
+
+    def start_background_maintenance(self, interval_s=None):
+        """Chạy thread nền: compact tombstone khi vượt ngưỡng và lưu index định kỳ."""
+        if self._maintenance_thread is not None:
+            return
+        interval_s = interval_s or config.CATALOG_MAINTENANCE_INTERVAL_S
+
+        def loop():
+            while not self._stop_event.wait(interval_s):
+                try:
+                    self.compact(min_tombstones=config.TOMBSTONE_COMPACT_MIN)
+                    with self._write_lock:
+                        self.flush()
+                except Exception as e:
+                    print(f"[CatalogUpdater] Lỗi khi bảo trì index: {e}")
+
+        self._maintenance_thread = threading.Thread(target=loop, name="catalog-maintenance", daemon=True)
+        self._maintenance_thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._maintenance_thread is not None:
+            self._maintenance_thread.join(timeout=5)
+        with self._write_lock:
+            self.flush()
+
+    # -------------------------------------------------------------------------
+    # INTERNAL
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _summary_batch(conn, unique_ids):
+        """
+        Batch lớn: trigger bảng tổng hợp chạy lại GROUP BY cho MỖI dòng, nên tắt trigger và tính lại
+        các key bị ảnh hưởng một lần (giống build-index). Batch nhỏ để trigger cập nhật như thường.
+        """
+        if len(unique_ids) >= config.SUMMARY_BULK_THRESHOLD:
+            return bulk_summary_update(conn, unique_ids)
+        return nullcontext()
+
+    def _ensure_vector_table(self):
+        with self.pool.writer() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS book_vectors "
+                "(unique_id TEXT PRIMARY KEY, label INTEGER NOT NULL, doc_hash TEXT)"
+            )
+            (count,) = conn.execute("SELECT COUNT(*) FROM book_vectors").fetchone()
+            if count == 0:
+                # Lần đầu: label = vị trí trong unique_ids.pkl do notebook tạo ra
+                all_ids = self.vector_store.ids_for_positions(range(len(self.vector_store.unique_ids_list)))
+                print(f"[CatalogUpdater] Khởi tạo bảng book_vectors từ id map ({len(all_ids)} sách)...")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO book_vectors (unique_id, label, doc_hash) VALUES (?, ?, NULL)",
+                    ((uid, label) for label, uid in enumerate(all_ids)),
+                )
+
+    def _load_tombstones(self):
+        """Label có trong index nhưng không còn sách nào trỏ tới = đã bị xóa / thay thế."""
+        live = np.fromiter((r[0] for r in self.pool.reader().execute("SELECT label FROM book_vectors")), dtype='int64')
+        dead = np.setdiff1d(np.arange(len(self.vector_store.unique_ids_list), dtype='int64'), live)
+        if len(dead):
+            self.vector_store.remove_labels(dead)
+
+    def _merge_text_fields(self, books, unique_ids, has_text, existing):
+        """
+        Bản sao của books dùng để dựng document. Sách đã có trong index mà chỉ được truyền một phần
+        trường văn bản: title thiếu lấy từ bảng books; author_about / description / features không
+        lưu trong SQL nên không thể bổ sung -> ValueError (tránh embed lại từ document rỗng).
+        """
+        text_books = list(books)
+        partial = [i for i, uid in enumerate(unique_ids)
+                   if has_text[i] and uid in existing and any(f not in books[i] for f in RAG_TEXT_FIELDS)]
+        missing_text = sorted({
+            unique_ids[i] for i in partial
+            if any(f not in books[i] for f in RAG_TEXT_FIELDS if f != 'title')
+        })
+        if missing_text:
+            raise ValueError(
+                f"Cập nhật văn bản của sách đã có phải gồm đủ {[f for f in RAG_TEXT_FIELDS if f != 'title']} "
+                f"(không lưu trong SQL), thiếu ở: {missing_text[:10]}"
+            )
+
+        need_title = [unique_ids[i] for i in partial]
+        titles = {}
+        conn = self.pool.reader()
+        for start in range(0, len(need_title), SQL_CHUNK_SIZE):
+            chunk = need_title[start:start + SQL_CHUNK_SIZE]
+            placeholders = ', '.join('?' for _ in chunk)
+            titles.update(conn.execute(
+                f"SELECT unique_id, title FROM books WHERE unique_id IN ({placeholders})", chunk
+            ).fetchall())
+        for i in partial:
+            text_books[i] = dict(books[i], title=titles.get(unique_ids[i]))
+        return text_books
+
+    def _fetch_vector_rows(self, unique_ids):
+        conn = self.pool.reader()
+        rows = {}
+        for start in range(0, len(unique_ids), SQL_CHUNK_SIZE):
+            chunk = unique_ids[start:start + SQL_CHUNK_SIZE]
+            placeholders = ', '.join('?' for _ in chunk)
+            for uid, label, doc_hash in conn.execute(
+                f"SELECT unique_id, label, doc_hash FROM book_vectors WHERE unique_id IN ({placeholders})", chunk
+            ):
+                rows[uid] = (label, doc_hash)
+        return rows
+
+    def _write_book_rows(self, conn, books):
+        """UPSERT các cột có mặt trong từng dict, không ghi đè các cột không được truyền."""
+        groups = {}
+        for book in books:
+            columns = tuple(c for c in BOOK_COLUMNS if c in book)
+            groups.setdefault(columns, []).append(tuple(book[c] for c in columns))
+
+        for columns, rows in groups.items():
+            updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != 'unique_id')
+            conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+            conn.executemany(
+                f"INSERT INTO books ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+                f"ON CONFLICT(unique_id) {conflict}",
+                rows,
+            )
+
+    def _revert_index(self, new_labels, old_labels):
+        """Hoàn tác thay đổi trên index khi transaction SQL thất bại."""
+        vs = self.vector_store
+        with vs.lock.write():
+            tombstones = vs.tombstones
+            if old_labels:
+                tombstones = np.setdiff1d(tombstones, np.asarray(old_labels, dtype='int64'))
+            if new_labels is not None and len(new_labels):
+                tombstones = np.union1d(tombstones, new_labels)
+            vs.set_tombstones(tombstones)
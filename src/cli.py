@@ -0,0 +1,64 @@
+"""
+cli.py
+======
+Entry point dòng lệnh "bookinsight" cho các tác vụ dữ liệu offline.
+
+    python src/cli.py build-index --workers 4 --shard-rows 20000
+    python src/cli.py build-index --resume
+    python src/cli.py build-index --chunks
+    python src/cli.py migrate-vectorstore
+"""
+
+import argparse
+import os
+import sys
+
+SRC_PATH = os.path.abspath(os.path.dirname(__file__))
+if SRC_PATH not in sys.path:
+    sys.path.append(SRC_PATH)
+
+import config
+
+
+def cmd_build_index(args):
+    from index_builder import IndexBuilder
+    IndexBuilder(
+        parquet_path=args.parquet,
+        shard_rows=args.shard_rows,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        resume=args.resume,
+        index_type=args.index_type,
+        chunks=args.chunks,
+    ).run()
+
+
+def cmd_migrate_vectorstore(args):
+    from utils.migrate_vectorstore import migrate
+    migrate(config.FAISS_INDEX_PATH, config.META_PATH, config.UNIQUE_IDS_NPY_PATH)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bookinsight", description="Công cụ dữ liệu của BookInsight.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build-index", help="Build SQLite + FAISS index từ file parquet sạch.")
+    build.add_argument("--parquet", default=config.CLEAN_PARQUET_PATH)
+    build.add_argument("--shard-rows", type=int, default=20000, help="Số dòng mỗi shard (đơn vị checkpoint).")
+    build.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số process encode song song.")
+    build.add_argument("--batch-size", type=int, default=64)
+    build.add_argument("--index-type", default=None, help="Ghi đè config.INDEX_TYPE.")
+    build.add_argument("--resume", action="store_true", help="Bỏ qua các shard đã checkpoint.")
+    build.add_argument("--chunks", action="store_true",
+                       help="Build thêm index mức chunk (nhiều vector / sách) tại config.CHUNK_DIR.")
+    build.set_defaults(func=cmd_build_index)
+
+    migrate = subparsers.add_parser("migrate-vectorstore", help="Chuyển id map sang unique_ids.npy (mmap).")
+    migrate.set_defaults(func=cmd_migrate_vectorstore)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,120 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 SQL_DB_PATH = os.path.join(DATA_DIR, "database", "books.db")
+SCHEMA_PATH = os.path.join(DATA_DIR, "schema.sql")
+# Kết nối SQLite (sql_database.ConnectionPool): mỗi thread một connection chỉ đọc + một connection ghi, chế độ WAL
+SQL_MMAP_SIZE = 256 * 1024 * 1024       # PRAGMA mmap_size (bytes)
+SQL_CACHE_SIZE_KB = 32 * 1024           # PRAGMA cache_size cho mỗi connection (KiB)
+SQL_BUSY_TIMEOUT_S = 5.0
+# SQL tool của agent (sql_guard.py): giới hạn cho câu SQL do LLM sinh ra
+SQL_TOOL_TIMEOUT_S = 2.0
+SQL_TOOL_MAX_ROWS = 50
+SQL_TOOL_MAX_BYTES = 8000
+SQL_TOOL_MAX_STRING = 300               # cắt chuỗi dài (categories, URL ảnh, ...) trong kết quả
+# Cache kết quả của SQL tool (sql_guard.SQLResultCache): LRU theo số câu lệnh, bị xóa theo bảng
+# khi ConnectionPool.writer() ghi, xóa toàn bộ khi process khác ghi (PRAGMA data_version); TTL dự phòng
+SQL_RESULT_CACHE_SIZE = 256
+SQL_RESULT_CACHE_TTL_S = 600
+CLEAN_PARQUET_PATH = os.path.join(DATA_DIR, "demo_100k_samples", "amazon_books_clean_100k_samples.parquet")
 
 VS_DIR = os.path.join(DATA_DIR, "vectorstores")
 FAISS_INDEX_PATH = os.path.join(VS_DIR, "index.faiss")
 EMBEDDINGS_PATH = os.path.join(VS_DIR, "embeddings.npy")
 META_PATH = os.path.join(VS_DIR, "unique_ids.pkl")
+# Bản id map dạng mảng numpy độ rộng cố định (dùng cho chế độ mmap, tạo bằng migrate_vectorstore.py)
+UNIQUE_IDS_NPY_PATH = os.path.join(VS_DIR, "unique_ids.npy")
+# "heap": đọc toàn bộ index + unique_ids.pkl vào RAM của từng process
+# "mmap": memory-map index.faiss và unique_ids.npy, các worker dùng chung page cache
+VS_LOAD_MODE = "heap"
+# Thư mục checkpoint của lệnh build-index (mỗi shard một file embeddings)
+BUILD_CHECKPOINT_DIR = os.path.join(VS_DIR, "build")
+CHUNK_DIR = os.path.join(VS_DIR, "chunks")        # index.faiss + book_offsets.npy của index mức chunk
 
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+CLIP_MODEL = "clip-ViT-B-16"
+# Backend encode câu truy vấn: "torch" (SentenceTransformer) hoặc "onnx" (ONNX Runtime)
+ENCODER_BACKEND = "torch"
+ONNX_QUANTIZE = True        # dùng bản quantize động int8 của model ONNX
+ONNX_CACHE_DIR = os.path.join(DATA_DIR, "models", "onnx")
 LLM_MODEL = "gpt-3.5-turbo"
+# Endpoint tương thích OpenAI (None = api.openai.com), ví dụ server giả lập: python src/utils/fake_llm.py
+LLM_BASE_URL = os.environ.get("OPENAI_BASE_URL")
 RRF_K = 60
+FUSION_METHOD = "rrf"           # "rrf" | "combsum" | "combmnz" (xem retriever/fusion.py)
+ORIGINAL_QUERY_WEIGHT = 1.0     # trọng số danh sách của câu hỏi gốc so với các câu mở rộng (1.0)
+# Mở rộng câu hỏi chạy song song với lượt tìm kiếm đầu tiên; quá hạn thì chỉ dùng câu hỏi gốc
+EXPANSION_DEADLINE_S = 2.0
+EXPANSION_WORKERS = 4
+# Mở rộng thích ứng: chỉ gọi LLM khi lượt tìm kiếm đầu (câu hỏi gốc, vài ms) chưa đủ tin cậy;
+# câu hỏi đủ tin cậy không tốn lượt gọi OpenAI nào. Tắt đi thì LLM được gửi trước lượt tìm kiếm đầu.
+# Tin cậy = top-1 cosine >= MIN_TOP_SIM và (top1 - top2 >= MIN_MARGIN hoặc z-score của top-1 >= MIN_ZSCORE)
+ADAPTIVE_EXPANSION = True
+CONFIDENCE_MIN_TOP_SIM = 0.80
+CONFIDENCE_MIN_MARGIN = 0.05
+CONFIDENCE_MIN_ZSCORE = 3.0
+# Hybrid lexical + dense: ứng viên BM25 từ bảng FTS5 books_fts được hợp nhất cùng các danh sách vector.
+# Câu hỏi trùng khớp tên sách / ISBN được trả lời không cần LLM và với độ sâu tìm kiếm vector nhỏ hơn.
+LEXICAL_SEARCH = True
+LEXICAL_DEPTH = 20
+LEXICAL_WEIGHT = 1.0
+
+# Loại FAISS index: "flat" (brute-force), "ivf", "hnsw", "ivfpq",
+# hoặc index nén "sq8" (1 byte/chiều, ~4x) / "pq" (PQ_M bytes/vector, ~16x với PQ_M=96)
+INDEX_TYPE = "flat"
+# Tham số lúc build index
+IVF_NLIST = 1024            # số cluster của IVF (~ 4 * sqrt(N))
+IVFPQ_M = 48                # số sub-quantizer của PQ (phải chia hết dimension 384)
+IVFPQ_NBITS = 8             # số bit cho mỗi mã PQ
+HNSW_M = 32                 # số láng giềng mỗi node trong đồ thị HNSW
+HNSW_EF_CONSTRUCTION = 200
+PQ_M = 96                   # số byte mỗi vector của index "pq" (384 chiều float32 = 1536 bytes)
+PQ_NBITS = 8
+# Tham số mặc định lúc truy vấn (có thể override qua BookVectorStore.search)
+IVF_NPROBE = 16
+HNSW_EF_SEARCH = 64
+# Với index nén (sq8 / pq / ivfpq): lấy k * RERANK_FACTOR ứng viên rồi tính lại
+# khoảng cách chính xác trên embeddings.npy (memory-map, không nạp vào RAM)
+EXACT_RERANK = True
+RERANK_FACTOR = 4
+# Tìm kiếm có bộ lọc thuộc tính: tập sách hợp lệ nhỏ hơn ngưỡng này thì tính chính xác
+# trên embeddings của đúng tập đó, lớn hơn thì dùng IDSelector của FAISS
+FILTER_BRUTE_FORCE_MAX = 20000
+FILTER_MAX_EF_SEARCH = 1024
+FILTER_MASK_CACHE_SIZE = 256    # số bitmap (cột, giá trị) được cache trong RAM
+# Chi tiết sách của kết quả RAG lấy từ metadata dạng cột trong RAM (retriever/metadata_store.py)
+# thay vì truy vấn SQL mỗi lần; False = luôn đọc từ SQLite
+METADATA_IN_MEMORY = True
+# Tra cứu tên sách / tác giả trong RAM (retriever/entity_index.py)
+ENTITY_MIN_SIMILARITY = 0.5     # điểm Dice trigram tối thiểu của khớp gần đúng
+ENTITY_MAX_BOOKS = 20           # số sách trả về tối đa cho mỗi entity
+
+# Index mức chunk: nhiều vector / sách (đoạn description, features, author_about)
+USE_CHUNK_INDEX = True          # dùng CHUNK_DIR nếu đã build bằng "build-index --chunks"
+CHUNK_WORDS = 200               # số từ mỗi chunk
+CHUNK_OVERLAP = 40              # số từ gối đầu giữa 2 chunk liên tiếp
+CHUNK_AGGREGATION = "max"       # "max" | "sum": cách gộp điểm các chunk của cùng một sách
+CHUNK_OVERSAMPLE = 4            # lấy k * factor chunk trước khi gộp thành k sách
+
+# Tracing: in trace (JSON) của mọi request /chat ra log; client vẫn có thể yêu cầu trace qua "trace": true
+TRACE_LOG = False
+
+# Cache embedding của câu truy vấn (LRU trong RAM + SQLite trên đĩa, None = chỉ dùng RAM)
+EMBEDDING_CACHE_SIZE = 10000
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "cache", "query_embeddings.sqlite")
+
+# Cache kết quả mở rộng câu hỏi của LLM (0 = tắt)
+EXPANSION_CACHE_SIZE = 5000
+EXPANSION_CACHE_PATH = os.path.join(DATA_DIR, "cache", "query_expansions.sqlite")
+EXPANSION_CACHE_TTL_S = 7 * 24 * 3600
+
+# Cache kết quả theo ngữ nghĩa: câu hỏi có cosine >= ngưỡng với một câu hỏi gần đây dùng lại kết quả (0 = tắt)
+SEMANTIC_CACHE_SIZE = 2000
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_TTL_S = 3600
+
+# Cập nhật catalogue tăng dần (catalog.CatalogUpdater)
+TOMBSTONE_COMPACT_MIN = 1000            # compact khi số vector đã xóa vượt ngưỡng này
+CATALOG_MAINTENANCE_INTERVAL_S = 300    # chu kỳ của thread compact / lưu index chạy nền
+# Upsert / delete từ ngưỡng này (số sách) tắt trigger bảng tổng hợp trong transaction và chỉ tính lại
+# các thể loại / tác giả bị ảnh hưởng một lần (sql_database.bulk_summary_update)
+SUMMARY_BULK_THRESHOLD = 100
@@ -0,0 +1,70 @@
+"""
+documents.py
+============
+Tạo văn bản "rag_document_text" dùng để embed cho mỗi cuốn sách
+(cùng định dạng với notebook 2_build_database.ipynb).
+    - build_rag_document(book)  : một cuốn sách (dict)
+    - build_rag_documents(df)   : cả DataFrame, dùng phép cộng chuỗi vector hóa thay cho df.apply
+    - build_rag_chunks(book)    : chia một cuốn sách thành nhiều chunk cho index mức chunk
+"""
+
+import hashlib
+
+RAG_TEXT_FIELDS = ("title", "author_about", "description", "features")
+
+# (nhãn trong chunk, cột) theo thứ tự chunk được tạo
+CHUNK_FIELDS = (("Description", "description"), ("Features", "features"), ("Author Bio", "author_about"))
+
+
+def _text(value):
+    # Giống str(row[...] or '') trong notebook: None / NaN / chuỗi rỗng -> ''
+    if value is None or value != value:
+        return ''
+    return str(value or '')
+
+
+def build_rag_document(book):
+    """Ghép các trường văn bản của một cuốn sách (dict) thành document để embed."""
+    return (
+        f"Title: {_text(book.get('title'))}\n"
+        f"Author Bio: {_text(book.get('author_about'))}\n"
+        f"Description: {_text(book.get('description'))}\n"
+        f"Features: {_text(book.get('features'))}"
+    )
+
+
+def build_rag_chunks(book, chunk_words, overlap):
+    """
+    Chia từng trường văn bản thành các cửa sổ chunk_words từ (gối đầu overlap từ),
+    mỗi chunk đều mang theo tiêu đề sách. Sách không có nội dung -> một chunk chỉ có tiêu đề.
+    """
+    title = _text(book.get('title'))
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for label, field in CHUNK_FIELDS:
+        words = _text(book.get(field)).split()
+        for start in range(0, len(words), step):
+            chunks.append(f"Title: {title}\n{label}: {' '.join(words[start:start + chunk_words])}")
+            if start + chunk_words >= len(words):
+                break
+    return chunks or [f"Title: {title}"]
+
+
+def document_hash(document):
+    """Hash nội dung document, dùng để biết sách nào thực sự cần embed lại."""
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+
+def build_rag_documents(df):
+    """Phiên bản vector hóa của build_rag_document cho một pandas DataFrame. Trả về Series."""
+    def column(name):
+        if name not in df.columns:
+            return ''
+        return df[name].fillna('').astype(str)
+
+    return (
+        "Title: " + column('title')
+        + "\nAuthor Bio: " + column('author_about')
+        + "\nDescription: " + column('description')
+        + "\nFeatures: " + column('features')
+    )
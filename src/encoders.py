@@ -0,0 +1,211 @@
+"""
+encoders.py
+===========
+Backend encode câu truy vấn có thể thay thế cho nhau:
+    - "torch": SentenceTransformer gốc (PyTorch)
+    - "onnx" : text tower export sang ONNX Runtime, tùy chọn quantize động int8
+
+Model ONNX được export MỘT lần vào cache_dir/<tên model>/ gồm model.onnx,
+model.int8.onnx, tokenizer/ và encoder.json. Sau đó chỉ đọc file local,
+không cần mạng hay HuggingFace Hub.
+"""
+
+import json
+import os
+
+import numpy as np
+
+ENCODER_BACKENDS = ("torch", "onnx")
+
+
+def load_encoder(model_name, backend="torch", device="cpu", cache_dir=None, quantize=True):
+    """Trả về một object có hàm .encode(texts, ...) giống SentenceTransformer."""
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device=device)
+    if backend == "onnx":
+        return OnnxTextEncoder(model_name, cache_dir, quantize=quantize)
+    raise ValueError(f"ENCODER_BACKEND không hợp lệ: '{backend}'. Chọn một trong {ENCODER_BACKENDS}")
+
+
+def encoder_cache_key(model_name, backend="torch", quantize=True, encoder=None):
+    """
+    Tên dùng làm key cho EmbeddingCache: embedding của mỗi backend được cache riêng.
+    encoder: encoder đã tải (nếu có); với ONNX, key theo độ chính xác thực sự của model
+    đã nạp (int8 có thể đã fallback sang fp32), không theo cấu hình.
+    """
+    if backend == "torch":
+        return model_name
+    quantize = getattr(encoder, "quantized", quantize)
+    return f"{model_name}|onnx{'-int8' if quantize else ''}"
+
+
+def model_cache_dir(cache_dir, model_name):
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+class OnnxTextEncoder:
+    """Encoder chạy bằng ONNX Runtime trên CPU, API encode() tương thích SentenceTransformer."""
+
+    def __init__(self, model_name, cache_dir, quantize=True):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        model_dir = model_cache_dir(cache_dir, model_name)
+        if not os.path.exists(os.path.join(model_dir, "encoder.json")):
+            export_onnx(model_name, cache_dir, quantize=quantize)
+
+        with open(os.path.join(model_dir, "encoder.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        if quantize and not self.meta.get("quantized") and not self.meta.get("quantize_failed"):
+            # Bản export cũ chỉ có fp32 (vd. export với --no-quantize): quantize bổ sung một lần
+            result = quantize_onnx(model_dir)
+            self.meta["quantized"] = result is True
+            self.meta["quantize_failed"] = result is False
+            _write_meta(model_dir, self.meta)
+        # Độ chính xác thực sự của model được nạp: quantize int8 lỗi -> fp32
+        self.quantized = bool(quantize and self.meta.get("quantized"))
+        if quantize and not self.quantized:
+            print(f"[Encoder] CẢNH BÁO: không có bản int8 của {model_name}, dùng model ONNX fp32.")
+        self.precision = "int8" if self.quantized else "fp32"
+
+        onnx_file = "model.int8.onnx" if self.quantized else "model.onnx"
+        print(f"[Encoder] Đang tải ONNX model: {os.path.join(model_dir, onnx_file)}")
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.join(model_dir, "tokenizer"), local_files_only=True)
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, onnx_file), providers=["CPUExecutionProvider"]
+        )
+        self.max_length = self.meta["max_length"]
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            batch = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np",
+            )
+            (embeddings,) = self.session.run(None, {
+                "input_ids": batch["input_ids"].astype("int64"),
+                "attention_mask": batch["attention_mask"].astype("int64"),
+            })
+            outputs.append(embeddings)
+
+        embeddings = np.concatenate(outputs, axis=0).astype("float32")
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name, cache_dir, quantize=True, opset=17):
+    """
+    Export text tower của một SentenceTransformer (BGE: transformer + pooling,
+    CLIP: get_text_features) sang ONNX, rồi quantize động int8 trọng số.
+    Bước này cần torch + sentence-transformers và model trong HF cache (hoặc mạng).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = model_cache_dir(cache_dir, model_name)
+    os.makedirs(model_dir, exist_ok=True)
+    print(f"[Encoder] Đang export {model_name} sang ONNX tại: {model_dir}")
+
+    class TransformerPoolingWrapper(torch.nn.Module):
+        def __init__(self, auto_model, pooling_mode):
+            super().__init__()
+            self.auto_model = auto_model
+            self.pooling_mode = pooling_mode
+
+        def forward(self, input_ids, attention_mask):
+            hidden = self.auto_model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            if self.pooling_mode == "cls":
+                return hidden[:, 0]
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            return (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+    class ClipTextWrapper(torch.nn.Module):
+        def __init__(self, clip_model):
+            super().__init__()
+            self.clip_model = clip_model
+
+        def forward(self, input_ids, attention_mask):
+            return self.clip_model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    first = st_model[0]
+
+    if hasattr(first, "auto_model"):
+        pooling_mode = st_model[1].get_pooling_mode_str() if len(st_model) > 1 else "mean"
+        wrapper = TransformerPoolingWrapper(first.auto_model, pooling_mode)
+        tokenizer = first.tokenizer
+        max_length = st_model.max_seq_length
+    elif hasattr(first, "processor"):
+        # sentence_transformers.models.CLIPModel: chỉ export nhánh text
+        wrapper = ClipTextWrapper(first.model)
+        tokenizer = first.processor.tokenizer
+        max_length = first.model.config.text_config.max_position_embeddings
+        pooling_mode = "clip_text_projection"
+    else:
+        raise ValueError(f"Không hỗ trợ export model '{model_name}' sang ONNX.")
+
+    wrapper.eval()
+    tokenizer.save_pretrained(os.path.join(model_dir, "tokenizer"))
+    dummy = tokenizer(["export sample"], padding=True, return_tensors="pt")
+    onnx_path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["embeddings"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "embeddings": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+
+    result = quantize_onnx(model_dir) if quantize else None
+    _write_meta(model_dir, {
+        "model_name": model_name,
+        "pooling": pooling_mode,
+        "max_length": int(max_length),
+        "quantized": result is True,
+        "quantize_failed": result is False,
+    })
+    print(f"[Encoder] Export hoàn tất: {model_name}")
+    return model_dir
+
+
+def quantize_onnx(model_dir):
+    """
+    Quantize động int8 trọng số của model.onnx -> model.int8.onnx.
+    Trả về True nếu thành công, False nếu quantize lỗi, None nếu thiếu thư viện (onnxruntime.quantization
+    cần gói onnx): khi đó không ghi nhận lỗi vĩnh viễn, lần nạp sau (đã cài onnx) sẽ quantize lại.
+    """
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(
+            os.path.join(model_dir, "model.onnx"), os.path.join(model_dir, "model.int8.onnx"),
+            weight_type=QuantType.QInt8,
+        )
+        return True
+    except ImportError as e:
+        print(f"[Encoder] CẢNH BÁO: không quantize int8 được, thiếu thư viện ({e}); "
+              f"cài onnx (requirements.txt) để dùng bản int8, tạm dùng fp32.")
+        return None
+    except Exception as e:
+        print(f"[Encoder] CẢNH BÁO: quantize int8 thất bại ({e}), chỉ dùng được bản fp32.")
+        return False
+
+
+def _write_meta(model_dir, meta):
+    with open(os.path.join(model_dir, "encoder.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
@@ -0,0 +1,283 @@
+"""
+index_builder.py
+================
+Build toàn bộ dữ liệu phục vụ (thay cho notebook 2_build_database / 4_vectorstore_index):
+    1. Đọc parquet theo từng batch (stream, không nạp cả file vào pandas)
+    2. Tạo rag_document_text bằng phép cộng chuỗi vector hóa
+    3. Encode theo batch trên một process pool
+    4. Checkpoint sau mỗi shard (embeddings + ids + dòng SQL đã commit) -> chạy lại với --resume
+    5. Cuối cùng ghi index.faiss, embeddings.npy, unique_ids.pkl/.npy và bảng book_vectors
+    6. (--chunks) thêm index mức chunk trong config.CHUNK_DIR: nhiều vector / sách + book_offsets.npy
+
+Gọi qua CLI:  python src/cli.py build-index --workers 4
+"""
+
+import json
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+import pyarrow.parquet as pq
+
+import config
+from documents import RAG_TEXT_FIELDS, build_rag_chunks, build_rag_documents, document_hash
+from encoders import load_encoder
+from sql_database import BOOK_COLUMNS, connect_writer, drop_summary_triggers, ensure_summary_tables
+from vectorstore import append_npy_rows, build_faiss_index, ids_to_array
+
+TEXT_COLUMNS = ['description', 'features', 'author_about']
+
+_worker_encoder = None
+
+
+def _init_encoder_worker(threads_per_worker):
+    """Mỗi process con tải encoder một lần; giới hạn số thread để các worker không tranh CPU."""
+    global _worker_encoder
+    if threads_per_worker:
+        try:
+            import torch
+            torch.set_num_threads(threads_per_worker)
+        except ImportError:
+            pass
+    _worker_encoder = load_encoder(
+        config.EMBEDDING_MODEL, config.ENCODER_BACKEND,
+        cache_dir=config.ONNX_CACHE_DIR, quantize=config.ONNX_QUANTIZE,
+    )
+
+
+def _encode_documents(documents, batch_size):
+    vectors = _worker_encoder.encode(documents, batch_size=batch_size, normalize_embeddings=True)
+    return np.ascontiguousarray(vectors, dtype='float32')
+
+
+class IndexBuilder:
+    def __init__(self, parquet_path=None, shard_rows=20000, workers=1, batch_size=64,
+                 resume=False, index_type=None, chunks=False):
+        self.parquet_path = parquet_path or config.CLEAN_PARQUET_PATH
+        self.shard_rows = shard_rows
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.resume = resume
+        self.index_type = index_type or config.INDEX_TYPE
+        self.chunks = chunks
+        self.checkpoint_dir = config.BUILD_CHECKPOINT_DIR
+        self.state_path = os.path.join(self.checkpoint_dir, "state.json")
+
+    # -------------------------------------------------------------------------
+    # CHECKPOINT
+    # -------------------------------------------------------------------------
+    def _load_state(self):
+        if self.resume and os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if (state.get("parquet_path") == self.parquet_path and state.get("shard_rows") == self.shard_rows
+                    and state.get("chunks", False) == self.chunks):
+                print(f"[IndexBuilder] Tiếp tục từ checkpoint: {len(state['completed_shards'])} shard đã xong.")
+                return state
+            print("[IndexBuilder] Checkpoint không khớp tham số hiện tại -> build lại từ đầu.")
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        return {"parquet_path": self.parquet_path, "shard_rows": self.shard_rows,
+                "chunks": self.chunks, "completed_shards": []}
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _shard_path(self, shard_id, kind):
+        return os.path.join(self.checkpoint_dir, f"shard_{shard_id:05d}_{kind}.npy")
+
+    # -------------------------------------------------------------------------
+    # BUILD
+    # -------------------------------------------------------------------------
+    def run(self):
+        t_start = time.perf_counter()
+        state = self._load_state()
+        completed = set(state["completed_shards"])
+
+        parquet = pq.ParquetFile(self.parquet_path)
+        available = set(parquet.schema_arrow.names)
+        sql_columns = [c for c in BOOK_COLUMNS if c in available]
+        read_columns = sql_columns + [c for c in TEXT_COLUMNS if c in available]
+        total_rows = parquet.metadata.num_rows
+        print(f"[IndexBuilder] {self.parquet_path}: {total_rows} dòng, "
+              f"{parquet.num_row_groups} row group(s), shard {self.shard_rows} dòng, {self.workers} worker(s).")
+
+        conn = self._open_database(fresh=not completed)
+        pool = None
+        if self.workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            pool = ProcessPoolExecutor(self.workers, initializer=_init_encoder_worker, initargs=(threads,))
+        else:
+            _init_encoder_worker(0)
+
+        rows_done = 0
+        try:
+            batches = parquet.iter_batches(batch_size=self.shard_rows, columns=read_columns)
+            for shard_id, batch in enumerate(batches):
+                if shard_id in completed:
+                    rows_done += batch.num_rows
+                    continue
+                t0 = time.perf_counter()
+                self._process_shard(shard_id, batch.to_pandas(), sql_columns, conn, pool)
+                state["completed_shards"].append(shard_id)
+                self._save_state(state)
+
+                rows_done += batch.num_rows
+                elapsed = time.perf_counter() - t0
+                print(f"[IndexBuilder] Shard {shard_id}: {batch.num_rows} dòng, "
+                      f"{batch.num_rows / elapsed:.0f} rows/s ({rows_done}/{total_rows}).")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self._finalize(sorted(state["completed_shards"]), conn)
+        print("[IndexBuilder] Đang tính bảng tổng hợp theo thể loại / tác giả...")
+        ensure_summary_tables(conn, rebuild=True)
+        conn.close()
+
+        total_s = time.perf_counter() - t_start
+        print(f"[IndexBuilder] Hoàn tất {rows_done} dòng trong {total_s:.1f}s "
+              f"({rows_done / max(total_s, 1e-9):.0f} rows/s).")
+
+    def _open_database(self, fresh):
+        os.makedirs(os.path.dirname(config.SQL_DB_PATH), exist_ok=True)
+        # Cùng cấu hình với connection ghi của ConnectionPool (WAL, recursive_triggers cho books_fts)
+        conn = connect_writer(config.SQL_DB_PATH)
+        if fresh:
+            print(f"[IndexBuilder] Đang thực thi schema.sql tại {config.SQL_DB_PATH}...")
+            with open(config.SCHEMA_PATH, 'r', encoding='utf-8') as f:
+                conn.executescript(f.read())
+        # Bảng tổng hợp được tính lại một lần ở cuối, không để trigger chạy cho từng dòng
+        drop_summary_triggers(conn)
+        return conn
+
+    def _process_shard(self, shard_id, df, sql_columns, conn, pool):
+        df = df.drop_duplicates('unique_id', keep='last').reset_index(drop=True)
+        df['unique_id'] = df['unique_id'].astype(str)
+        documents = build_rag_documents(df).tolist()
+        vectors = self._encode(documents, pool)
+
+        if self.chunks:
+            books = df[[c for c in RAG_TEXT_FIELDS if c in df.columns]].to_dict('records')
+            book_chunks = [build_rag_chunks(b, config.CHUNK_WORDS, config.CHUNK_OVERLAP) for b in books]
+            chunk_vectors = self._encode([c for chunks in book_chunks for c in chunks], pool)
+            np.save(self._shard_path(shard_id, "chunk_embeddings"), chunk_vectors)
+            np.save(self._shard_path(shard_id, "chunk_counts"),
+                    np.array([len(chunks) for chunks in book_chunks], dtype='int64'))
+
+        # Checkpoint: file embeddings + ids của shard, rồi mới commit SQL
+        np.save(self._shard_path(shard_id, "embeddings"), vectors)
+        np.save(self._shard_path(shard_id, "ids"), ids_to_array(df['unique_id']))
+        np.save(self._shard_path(shard_id, "hashes"),
+                np.array([document_hash(d) for d in documents], dtype='S40'))
+
+        rows = df[sql_columns].astype(object).where(df[sql_columns].notna(), None).itertuples(index=False, name=None)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO books ({', '.join(sql_columns)}) "
+            f"VALUES ({', '.join('?' for _ in sql_columns)})",
+            rows,
+        )
+        conn.commit()
+
+    def _encode(self, documents, pool):
+        if pool is None:
+            return _encode_documents(documents, self.batch_size)
+        # Chia thành các phần bằng nhau cho từng worker, giữ nguyên thứ tự
+        step = max(self.batch_size, -(-len(documents) // (self.workers * 4)))
+        parts = [documents[i:i + step] for i in range(0, len(documents), step)]
+        return np.vstack(list(pool.map(_encode_documents, parts, [self.batch_size] * len(parts))))
+
+    def _finalize(self, shard_ids, conn):
+        """Ghép các shard thành embeddings.npy, id map và FAISS index cuối cùng."""
+        print(f"[IndexBuilder] Đang ghép {len(shard_ids)} shard...")
+        os.makedirs(config.VS_DIR, exist_ok=True)
+        tmp_embeddings = config.EMBEDDINGS_PATH + ".build.npy"
+        if os.path.exists(tmp_embeddings):
+            os.remove(tmp_embeddings)
+
+        shard_uids = [[u.decode('ascii') if isinstance(u, bytes) else str(u)
+                       for u in np.load(self._shard_path(shard_id, "ids"))] for shard_id in shard_ids]
+        keeps = self._last_occurrence(shard_uids)
+
+        all_ids, all_hashes = [], []
+        for shard_id, uids, keep in zip(shard_ids, shard_uids, keeps):
+            append_npy_rows(tmp_embeddings, np.load(self._shard_path(shard_id, "embeddings"))[keep])
+            all_ids.extend(uid for uid, kept in zip(uids, keep) if kept)
+            hashes = np.load(self._shard_path(shard_id, "hashes"))[keep]
+            all_hashes.extend(h.decode('ascii') for h in hashes)
+
+        embeddings = np.load(tmp_embeddings, mmap_mode='r')
+        print(f"[IndexBuilder] Đang build FAISS index '{self.index_type}' cho {len(embeddings)} vectors...")
+        index = build_faiss_index(embeddings, self.index_type)
+        faiss.write_index(index, config.FAISS_INDEX_PATH)
+        del embeddings
+        os.replace(tmp_embeddings, config.EMBEDDINGS_PATH)
+
+        with open(config.META_PATH, 'wb') as f:
+            pickle.dump(all_ids, f)
+        np.save(config.UNIQUE_IDS_NPY_PATH, ids_to_array(all_ids))
+
+        conn.execute("DELETE FROM book_vectors")
+        conn.executemany(
+            "INSERT INTO book_vectors (unique_id, label, doc_hash) VALUES (?, ?, ?)",
+            ((uid, label, doc_hash) for label, (uid, doc_hash) in enumerate(zip(all_ids, all_hashes))),
+        )
+        conn.commit()
+        print(f"[IndexBuilder] Đã ghi {config.FAISS_INDEX_PATH}, {config.EMBEDDINGS_PATH}, {config.META_PATH}.")
+
+        if self.chunks:
+            self._finalize_chunks(shard_ids, keeps)
+
+    @staticmethod
+    def _last_occurrence(shard_uids):
+        """
+        Sách trùng id giữa các shard: chỉ giữ bản xuất hiện sau cùng (giống INSERT OR REPLACE
+        vào bảng books), để bản cũ không còn vector nào trong index. Trả về mask bool cho mỗi shard.
+        """
+        last = {}
+        for shard, uids in enumerate(shard_uids):
+            for row, uid in enumerate(uids):
+                last[uid] = (shard, row)
+        keeps = [np.zeros(len(uids), dtype=bool) for uids in shard_uids]
+        for shard, row in last.values():
+            keeps[shard][row] = True
+        n_dropped = sum(len(uids) for uids in shard_uids) - len(last)
+        if n_dropped:
+            print(f"[IndexBuilder] Bỏ {n_dropped} bản trùng unique_id giữa các shard (giữ bản sau cùng).")
+        return keeps
+
+    def _finalize_chunks(self, shard_ids, keeps):
+        """Ghép chunk của các shard; label sách = thứ tự dòng, giống id map ở trên."""
+        os.makedirs(config.CHUNK_DIR, exist_ok=True)
+        chunk_embeddings_path = os.path.join(config.CHUNK_DIR, "embeddings.npy")
+        tmp_embeddings = chunk_embeddings_path + ".build.npy"
+        if os.path.exists(tmp_embeddings):
+            os.remove(tmp_embeddings)
+
+        counts = []
+        for shard_id, keep in zip(shard_ids, keeps):
+            shard_counts = np.load(self._shard_path(shard_id, "chunk_counts"))
+            chunk_keep = np.repeat(keep, shard_counts)
+            append_npy_rows(tmp_embeddings, np.load(self._shard_path(shard_id, "chunk_embeddings"))[chunk_keep])
+            counts.append(shard_counts[keep])
+        book_offsets = np.concatenate([[0], np.cumsum(np.concatenate(counts))]).astype('int64')
+
+        embeddings = np.load(tmp_embeddings, mmap_mode='r')
+        print(f"[IndexBuilder] Đang build index chunk '{self.index_type}' cho {len(embeddings)} chunks "
+              f"({len(book_offsets) - 1} sách)...")
+        index = build_faiss_index(embeddings, self.index_type)
+        faiss.write_index(index, os.path.join(config.CHUNK_DIR, "index.faiss"))
+        del embeddings
+        os.replace(tmp_embeddings, chunk_embeddings_path)
+        np.save(os.path.join(config.CHUNK_DIR, "book_offsets.npy"), book_offsets)
+        dead_path = os.path.join(config.CHUNK_DIR, "dead_books.npy")
+        if os.path.exists(dead_path):
+            os.remove(dead_path)
+        print(f"[IndexBuilder] Đã ghi index chunk tại {config.CHUNK_DIR}.")
@@ -4,6 +4,8 @@ from typing import List, Dict, Literal, Optional
 import numpy as np
 import pandas as pd
 
+from src.retriever.metadata_store import BookMetadataStore
+
 
 """
 base_retriever.py
@@ -24,6 +26,8 @@ class FaissStore:
         self.modality = modality
         self.index = None
         self.metadata = None
+        # Columnar copy of a DataFrame metadata, position-aligned with the index
+        self.columnar = None
 
     # -------------------------------------------------------------------------
     # LOAD
@@ -81,6 +85,9 @@ class FaissStore:
         else:
             raise ValueError("Unsupported metadata file type (use .pkl or .parquet).")
 
+        if isinstance(self.metadata, pd.DataFrame):
+            self.columnar = BookMetadataStore.from_dataframe(self.metadata)
+
         # --- Validation ---
         n_index = self.index.ntotal
         n_meta = len(self.metadata) if hasattr(self.metadata, "__len__") else 0
@@ -105,25 +112,22 @@ class FaissStore:
 
         # --- Search in FAISS ---
         D, I = self.index.search(vec, k)
-        results = []
-        for rank, (idx, dist) in enumerate(zip(I[0], D[0])):
-            if idx == -1:
-                continue
-
-            meta_row = {}
-            if isinstance(self.metadata, pd.DataFrame):
-                meta_row = self.metadata.iloc[idx].to_dict()
-            elif isinstance(self.metadata, list) and len(self.metadata) > idx:
-                meta_row = self.metadata[idx]
-
-            results.append({
-                "id": int(idx),
-                "score": float(dist),
-                "rank": rank + 1,
-                "metadata": meta_row,
-            })
-
-        return results
+        ranks = np.flatnonzero(I[0] != -1)
+        ids, dists = I[0][ranks], D[0][ranks]
+
+        # --- Metadata: one gather per column instead of one iloc per hit ---
+        metas = [{} for _ in ids]
+        if self.columnar is not None:
+            in_range = np.flatnonzero(ids < len(self.columnar))
+            for j, meta in zip(in_range.tolist(), self.columnar.rows(ids[in_range])):
+                metas[j] = meta
+        elif isinstance(self.metadata, list):
+            metas = [self.metadata[idx] if len(self.metadata) > idx else {} for idx in ids.tolist()]
+
+        return [
+            {"id": int(idx), "score": float(dist), "rank": int(rank) + 1, "metadata": meta}
+            for idx, dist, rank, meta in zip(ids.tolist(), dists.tolist(), ranks.tolist(), metas)
+        ]
 
     # -------------------------------------------------------------------------
     # INFO
@@ -160,7 +164,8 @@ class CompositeStore:
         for store in self.stores:
             part = store.search(vec, k)
             all_results.extend(part)
-        all_results = sorted(all_results, key=lambda x: x["score"], reverse=True)[:k]
+        # score is an L2 distance: smaller is closer
+        all_results = sorted(all_results, key=lambda x: x["score"])[:k]
         return all_results
 
     def info(self):
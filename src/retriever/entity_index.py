@@ -0,0 +1,177 @@
+"""
+entity_index.py
+===============
+Đổi TÊN sách / TÊN tác giả thành sách cụ thể (unique_id) ngay trong RAM, không gọi
+OpenAI, FAISS hay một câu SQL LIKE: dùng cho câu hỏi tiếp nối như "tác giả của cuốn đó
+là ai", "các sách khác của tác giả đó".
+    - khớp chính xác: dict tên đã chuẩn hóa (normalize_title) -> entity
+    - khớp gần đúng: chỉ mục trigram (posting list numpy), điểm Dice trên tập trigram,
+      chịu được lỗi chính tả, thiếu từ, thiếu tên đệm ("tolkien" -> "J.R.R. Tolkien")
+
+Dựng từ bảng chuỗi đã intern của CatalogMetadata (mỗi tên khác nhau chỉ xử lý một lần),
+dựng lại khi metadata được nạp lại (vector_store.catalog_version thay đổi).
+"""
+
+import threading
+
+import numpy as np
+
+import config
+from sql_database import normalize_title
+
+# Loại entity -> cột của bảng books
+ENTITY_COLUMNS = {
+    'title': 'title',
+    'author': 'author_name',
+}
+# Trigram có trong hơn tỉ lệ này số entity (" th", "the", ...) không dùng để sinh ứng viên,
+# chỉ được cộng điểm cho các ứng viên đã có (tránh đếm trên toàn bộ entity mỗi lần tra)
+COMMON_TRIGRAM_FRACTION = 0.02
+# Cột trả về cho mỗi sách của một entity
+ENTITY_BOOK_COLUMNS = ['unique_id', 'title', 'author_name', 'publication_year', 'average_rating']
+
+
+def trigrams(text):
+    """Tập trigram của chuỗi đã chuẩn hóa (thêm khoảng trắng hai đầu để đầu / cuối từ có trọng số)."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _EntityTable:
+    """Các entity của một cột: tên chuẩn hóa, vị trí FAISS của sách, posting list trigram."""
+
+    def __init__(self, strings, codes):
+        # Gộp các chuỗi trùng nhau sau khi chuẩn hóa ("The Hobbit" / "the hobbit.")
+        self.exact = {}
+        self.names = []
+        entity_of_string = np.full(len(strings) + 1, -1, dtype='int64')
+        for code, value in enumerate(strings.tolist()):
+            key = normalize_title(str(value))
+            if not key:
+                continue
+            entity = self.exact.setdefault(key, len(self.names))
+            if entity == len(self.names):
+                self.names.append(str(value))
+            entity_of_string[code + 1] = entity
+
+        # Vị trí FAISS của từng entity: sắp xếp các hàng theo entity, mỗi entity là một đoạn liên tiếp
+        entity_of_row = entity_of_string[codes + 1]
+        rows = np.flatnonzero(entity_of_row >= 0)
+        order = np.argsort(entity_of_row[rows], kind='stable')
+        self.positions = rows[order]
+        self.offsets = np.searchsorted(entity_of_row[rows][order], np.arange(len(self.names) + 1))
+
+        postings = {}
+        self.n_trigrams = np.zeros(len(self.names), dtype='float32')
+        for key, entity in self.exact.items():
+            grams = trigrams(key)
+            self.n_trigrams[entity] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(entity)
+        self.postings = {gram: np.array(ids, dtype='int32') for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def books(self, entity):
+        return self.positions[self.offsets[entity]:self.offsets[entity + 1]]
+
+    def match_exact(self, key):
+        return self.exact.get(key)
+
+    def match_fuzzy(self, key, limit, min_similarity):
+        """list (entity, điểm Dice) tốt nhất cho tên đã chuẩn hóa key, điểm giảm dần."""
+        grams = trigrams(key)
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not lists:
+            return []
+        max_common = max(64, COMMON_TRIGRAM_FRACTION * len(self.names))
+        rare = [postings for postings in lists if len(postings) <= max_common]
+        if rare:
+            # Ứng viên = entity chung ít nhất một trigram hiếm; trigram phổ biến chỉ cộng điểm
+            candidates, shared = np.unique(np.concatenate(rare), return_counts=True)
+            for postings in lists:
+                if len(postings) > max_common:
+                    # Posting list tăng dần theo entity -> tra bằng searchsorted
+                    found = np.minimum(np.searchsorted(postings, candidates), len(postings) - 1)
+                    shared += postings[found] == candidates
+        else:
+            shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+            candidates = np.flatnonzero(shared)
+            shared = shared[candidates]
+
+        # Dice: 2 |A ∩ B| / (|A| + |B|)
+        scores = 2.0 * shared / (len(grams) + self.n_trigrams[candidates])
+        keep = scores >= min_similarity
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+
+class EntityIndex:
+    def __init__(self, metadata, min_similarity=None, max_books=None):
+        """metadata: CatalogMetadata (dùng chung với SmartRetriever)."""
+        self.metadata = metadata
+        self.min_similarity = config.ENTITY_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self.max_books = max_books or config.ENTITY_MAX_BOOKS
+        self._lock = threading.Lock()
+        self._store = None
+        self._tables = {}
+
+    def lookup(self, name, kind=None, limit=5):
+        """
+        Tìm các sách / tác giả có tên khớp với name.
+        kind: 'title', 'author' hoặc None (cả hai). Trả về list dict, điểm giảm dần:
+            {"type", "name", "score", "exact", "num_books", "books": [{unique_id, title, ...}]}
+        Có trùng khớp chính xác (sau chuẩn hóa, score = 1.0) thì chỉ trả về các khớp đó
+        (một lần tra dict); khớp trigram gần đúng chỉ chạy khi không có.
+        """
+        if kind is not None and kind not in ENTITY_COLUMNS:
+            raise ValueError(f"Loại entity không hợp lệ: '{kind}' (chỉ có {list(ENTITY_COLUMNS)}).")
+        key = normalize_title(name)
+        if not key:
+            return []
+        store, tables = self._refresh()
+
+        entity_types = [kind] if kind else list(ENTITY_COLUMNS)
+        matches = []
+        for entity_type in entity_types:
+            entity = tables[entity_type].match_exact(key)
+            if entity is not None:
+                matches.append((1.0, True, entity_type, entity))
+        if not matches:
+            for entity_type in entity_types:
+                for entity, score in tables[entity_type].match_fuzzy(key, limit, self.min_similarity):
+                    matches.append((score, False, entity_type, entity))
+            matches.sort(key=lambda m: m[0], reverse=True)
+
+        results = []
+        for score, exact, entity_type, entity in matches[:limit]:
+            table = tables[entity_type]
+            positions = table.books(entity)
+            results.append({
+                "type": entity_type,
+                "name": table.names[entity],
+                "score": round(score, 4),
+                "exact": exact,
+                "num_books": len(positions),
+                "books": store.rows(positions[:self.max_books], ENTITY_BOOK_COLUMNS),
+            })
+        return results
+
+    def _refresh(self):
+        with self._lock:
+            store = self.metadata.get()
+            if store is not self._store:
+                tables = {}
+                for entity_type, column in ENTITY_COLUMNS.items():
+                    strings, codes = store.strings(column)
+                    tables[entity_type] = _EntityTable(strings, codes)
+                print(f"[EntityIndex] Đã dựng chỉ mục: "
+                      + ", ".join(f"{len(t)} {entity_type}" for entity_type, t in tables.items()))
+                self._tables = tables
+                self._store = store
+            return self._store, self._tables
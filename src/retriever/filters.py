@@ -0,0 +1,150 @@
+"""
+filters.py
+==========
+Bộ lọc thuộc tính cho tìm kiếm vector (category, giá, rating, năm xuất bản, ...).
+
+Các cột được lọc lấy từ metadata dạng cột (retriever/metadata_store.py), đã nạp
+vào mảng numpy theo label của FAISS index. Mỗi điều kiện (cột, giá trị) được tính
+thành một bitmap bool và cache lại, nên truy vấn có lọc chỉ tốn vài phép AND trên mảng.
+Bitmap được tính lại khi metadata được nạp lại (vector_store.catalog_version thay đổi).
+
+Ví dụ filters:
+    {"category": "Fantasy", "price": {"max": 10}, "rating": {"min": 4}}
+    {"publication_year": (2000, 2010), "author": ["J.R.R. Tolkien", "C.S. Lewis"]}
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+
+RANGE_COLUMNS = ('price', 'average_rating', 'publication_year')
+EQUALITY_COLUMNS = ('main_category', 'author_name', 'publisher')
+SUBSTRING_COLUMNS = ('categories',)
+
+FILTER_ALIASES = {
+    'category': 'main_category',
+    'rating': 'average_rating',
+    'year': 'publication_year',
+    'author': 'author_name',
+}
+
+
+def normalize_filters(filters):
+    """Đổi alias sang tên cột và bỏ các điều kiện rỗng (None)."""
+    normalized = {}
+    for key, value in (filters or {}).items():
+        column = FILTER_ALIASES.get(key, key)
+        if column not in RANGE_COLUMNS + EQUALITY_COLUMNS + SUBSTRING_COLUMNS:
+            raise ValueError(f"Không hỗ trợ lọc theo cột '{key}'.")
+        if value is None or (isinstance(value, dict) and all(v is None for v in value.values())):
+            continue
+        normalized[column] = value
+    return normalized
+
+
+def _range_bounds(value):
+    """{"min": a, "max": b} / (a, b) / giá trị đơn -> (low, high), None = không giới hạn."""
+    if isinstance(value, dict):
+        return value.get('min'), value.get('max')
+    if isinstance(value, (list, tuple)):
+        low, high = value
+        return low, high
+    return value, value
+
+
+class AttributeFilterIndex:
+    def __init__(self, metadata, cache_size=None):
+        """metadata: CatalogMetadata (dùng chung với SmartRetriever)."""
+        self.metadata = metadata
+        self.cache_size = cache_size or config.FILTER_MASK_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._masks = OrderedDict()
+        self._store = None
+        self._n_labels = 0
+        self._numeric = {}
+        self._codes = {}
+        self._vocab = {}
+        self._text = {}
+
+    def mask(self, filters):
+        """
+        Trả về mảng bool theo label (True = sách thỏa TẤT CẢ điều kiện),
+        hoặc None nếu filters rỗng (không lọc).
+        """
+        filters = normalize_filters(filters)
+        if not filters:
+            return None
+
+        with self._lock:
+            self._refresh()
+            result = None
+            for column, value in filters.items():
+                column_mask = self._column_mask(column, value)
+                result = column_mask.copy() if result is None else np.logical_and(result, column_mask, out=result)
+            return result
+
+    def count(self, filters):
+        """Số sách thỏa filters (dùng để ước lượng độ chọn lọc / debug)."""
+        mask = self.mask(filters)
+        return self._n_labels if mask is None else int(mask.sum())
+
+    # -------------------------------------------------------------------------
+    # INTERNAL
+    # -------------------------------------------------------------------------
+    def _refresh(self):
+        store = self.metadata.get()
+        if store is self._store:
+            return
+
+        for column in RANGE_COLUMNS:
+            self._numeric[column] = store.numeric(column)
+        for column in EQUALITY_COLUMNS:
+            # So khớp không phân biệt hoa thường: gộp các chuỗi trùng sau khi chuẩn hóa
+            strings, codes = store.strings(column)
+            keys = np.array([str(v).strip().lower() for v in strings] + [''], dtype=str)
+            vocab, remap = np.unique(keys, return_inverse=True)
+            # Mã -1 (thiếu) trỏ vào chuỗi rỗng thêm ở cuối, không bao giờ khớp
+            self._codes[column] = remap.reshape(-1)[codes]
+            self._vocab[column] = {key: code for code, key in enumerate(vocab.tolist()) if key}
+        for column in SUBSTRING_COLUMNS:
+            strings, codes = store.strings(column)
+            lowered = np.array([''] + [str(v).lower() for v in strings], dtype=str)
+            self._text[column] = lowered[codes + 1]
+
+        self._masks.clear()
+        self._n_labels = len(store)
+        self._store = store
+
+    def _column_mask(self, column, value):
+        key = (column, repr(value))
+        mask = self._masks.get(key)
+        if mask is not None:
+            self._masks.move_to_end(key)
+            return mask
+
+        if column in RANGE_COLUMNS:
+            low, high = _range_bounds(value)
+            data = self._numeric[column]
+            mask = ~np.isnan(data)
+            if low is not None:
+                mask &= data >= float(low)
+            if high is not None:
+                mask &= data <= float(high)
+        else:
+            wanted = value if isinstance(value, (list, tuple, set)) else [value]
+            wanted = [str(v).strip().lower() for v in wanted]
+            if column in EQUALITY_COLUMNS:
+                codes = [self._vocab[column][w] for w in wanted if w in self._vocab[column]]
+                mask = np.isin(self._codes[column], codes)
+            else:
+                mask = np.zeros(self._n_labels, dtype=bool)
+                for w in wanted:
+                    mask |= np.char.find(self._text[column], w) >= 0
+
+        self._masks[key] = mask
+        if len(self._masks) > self.cache_size:
+            self._masks.popitem(last=False)
+        return mask
@@ -0,0 +1,82 @@
+"""
+fusion.py
+=========
+Hợp nhất nhiều danh sách xếp hạng (RAG-Fusion, text + image) bằng numpy,
+dùng chung cho SmartRetriever và TextImageRetriever.
+
+Đầu vào là ma trận id shape (n_lists, depth), mỗi hàng là một danh sách đã xếp hạng
+(cột 0 = hạng 1), ô trống = -1. Điểm của mỗi (danh sách, hạng) được cộng dồn vào
+từng id bằng scatter-add (np.bincount), top-k lấy bằng argpartition.
+    - rrf    : sum_l  w_l / (k + rank)
+    - combsum: sum_l  w_l * score_l (score được min-max normalize trong từng danh sách)
+    - combmnz: combsum * số danh sách chứa id đó
+"""
+
+import numpy as np
+
+FUSION_METHODS = ("rrf", "combsum", "combmnz")
+
+
+def pad_rank_lists(rank_lists, fill=-1, dtype='int64'):
+    """Ghép các danh sách dài ngắn khác nhau thành ma trận (n_lists, max_depth), ô trống = fill."""
+    depth = max((len(r) for r in rank_lists), default=0)
+    matrix = np.full((len(rank_lists), depth), fill, dtype=dtype)
+    for i, ranked in enumerate(rank_lists):
+        matrix[i, :len(ranked)] = ranked
+    return matrix
+
+
+def minmax_normalize(scores, valid):
+    """Chuẩn hóa min-max theo từng hàng, chỉ tính trên các ô valid (ô còn lại = 0)."""
+    scores = np.asarray(scores, dtype='float64')
+    low = np.where(valid, scores, np.inf).min(axis=1, keepdims=True)
+    high = np.where(valid, scores, -np.inf).max(axis=1, keepdims=True)
+    # Hàng không có ô valid nào cho ra nan / inf, sẽ bị np.where bên dưới loại bỏ
+    with np.errstate(invalid='ignore'):
+        normalized = (scores - low) / (high - low + 1e-8)
+    return np.where(valid, normalized, 0.0)
+
+
+def fuse_rank_lists(ids, scores=None, weights=None, method="rrf", k=60, top_k=None):
+    """
+    Hợp nhất các danh sách xếp hạng.
+    ids    : mảng int (n_lists, depth), -1 = ô trống
+    scores : mảng float cùng shape, càng lớn càng tốt (bắt buộc với combsum / combmnz)
+    weights: trọng số cho từng danh sách (mặc định 1.0)
+    k      : hằng số RRF
+    top_k  : chỉ giữ top_k id (None = tất cả)
+    Trả về (fused_ids, fused_scores, hit_counts) sắp xếp giảm dần theo điểm.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Fusion method không hợp lệ: '{method}'. Chọn một trong {FUSION_METHODS}")
+    ids = np.asarray(ids)
+    if ids.ndim != 2:
+        raise ValueError("ids phải là ma trận (n_lists, depth).")
+    n_lists, depth = ids.shape
+    weights = np.ones(n_lists) if weights is None else np.asarray(weights, dtype='float64')
+
+    valid = ids >= 0
+    if not valid.any():
+        return np.empty(0, dtype=ids.dtype), np.empty(0), np.empty(0, dtype='int64')
+
+    if method == "rrf":
+        contributions = weights[:, None] / (k + np.arange(1, depth + 1, dtype='float64'))[None, :]
+    else:
+        if scores is None:
+            raise ValueError(f"Fusion method '{method}' cần scores.")
+        contributions = weights[:, None] * minmax_normalize(np.asarray(scores), valid)
+
+    items, inverse = np.unique(ids[valid], return_inverse=True)
+    fused = np.bincount(inverse, weights=np.broadcast_to(contributions, ids.shape)[valid], minlength=len(items))
+    counts = np.bincount(inverse, minlength=len(items))
+    if method == "combmnz":
+        fused = fused * counts
+
+    n_keep = len(items) if top_k is None else min(top_k, len(items))
+    if n_keep < len(items):
+        top = np.argpartition(-fused, n_keep - 1)[:n_keep]
+    else:
+        top = np.arange(len(items))
+    # Điểm bằng nhau: id nào xuất hiện ở nhiều danh sách hơn đứng trước
+    order = top[np.lexsort((-counts[top], -fused[top]))]
+    return items[order], fused[order], counts[order]
@@ -0,0 +1,186 @@
+"""
+metadata_store.py
+=================
+Metadata của sách dạng cột, nạp MỘT lần vào bộ nhớ và căn theo vị trí FAISS
+(hàng i = vector / label i). Lấy thông tin cho kết quả tìm kiếm chỉ còn vài phép
+gather trên mảng numpy, thay vì một truy vấn SQL hay một dict cho mỗi hit:
+    - cột số (price, average_rating, publication_year, ...): float64, NaN = thiếu
+    - cột chuỗi (title, author_name, main_category, ...): mã int32 trỏ vào bảng chuỗi
+      đã intern (mỗi giá trị khác nhau chỉ lưu một lần), -1 = thiếu
+    - cột khác (list, dict, ...): mảng object
+
+Dùng chung cho SmartRetriever (nạp từ bảng books, xem CatalogMetadata) và
+FaissStore (nạp từ DataFrame metadata của index text / image).
+"""
+
+import threading
+
+import numpy as np
+
+
+def _is_missing(value):
+    # None, NaN của pandas / numpy
+    return value is None or (isinstance(value, float) and value != value)
+
+
+class BookMetadataStore:
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.columns = []
+        # Hàng có dữ liệu (False = vị trí FAISS không còn sách tương ứng)
+        self.present = np.ones(n_rows, dtype=bool)
+        self._numeric = {}
+        self._integer = set()
+        self._codes = {}
+        self._tables = {}
+        self._objects = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    # -------------------------------------------------------------------------
+    # BUILD
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_rows(cls, columns, rows, positions, n_rows, numeric=(), integer=()):
+        """
+        rows: list tuple (theo thứ tự columns) của các hàng nằm ở vị trí positions.
+        Vị trí không có hàng nào có present = False và mọi cột = thiếu.
+        numeric / integer: các cột lưu dạng số (integer được trả về dạng int).
+        """
+        store = cls(n_rows)
+        positions = np.asarray(positions, dtype='int64')
+        store.present = np.zeros(n_rows, dtype=bool)
+        store.present[positions] = True
+
+        values = list(zip(*rows)) if len(rows) else [()] * len(columns)
+        for column, column_values in zip(columns, values):
+            aligned = np.full(n_rows, None, dtype=object)
+            aligned[positions] = np.array(column_values, dtype=object)
+            if column in numeric or column in integer:
+                store.add_numeric(column, aligned, integer=column in integer)
+            else:
+                store.add_strings(column, aligned)
+        return store
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Mỗi hàng của DataFrame là một vị trí FAISS (theo thứ tự hàng)."""
+        store = cls(len(df))
+        for column in df.columns:
+            series = df[column]
+            kind = series.dtype.kind
+            if kind in 'fiu':
+                store.add_numeric(str(column), series.to_numpy(dtype='float64', na_value=np.nan),
+                                  integer=kind in 'iu')
+            else:
+                store.add_strings(str(column), series.to_numpy(dtype=object))
+        return store
+
+    def add_numeric(self, name, values, integer=False):
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = np.array([np.nan if _is_missing(v) else float(v) for v in values], dtype='float64')
+        self._numeric[name] = values.astype('float64', copy=False)
+        if integer:
+            self._integer.add(name)
+        self.columns.append(name)
+
+    def add_strings(self, name, values):
+        """Intern chuỗi: mỗi giá trị khác nhau lưu một lần, cột chỉ giữ mã int32."""
+        table = {}
+        try:
+            codes = np.fromiter(
+                (-1 if _is_missing(v) else table.setdefault(v, len(table)) for v in values),
+                dtype='int32', count=len(values),
+            )
+        except TypeError:
+            # Giá trị không hash được (list, dict): giữ nguyên dạng object
+            self._objects[name] = np.asarray(values, dtype=object)
+            self.columns.append(name)
+            return
+        strings = np.empty(len(table), dtype=object)
+        strings[:] = list(table)
+        self._codes[name] = codes
+        self._tables[name] = strings
+        self.columns.append(name)
+
+    # -------------------------------------------------------------------------
+    # ĐỌC
+    # -------------------------------------------------------------------------
+    def numeric(self, name):
+        """Mảng float64 của cột số (NaN = thiếu), căn theo vị trí."""
+        return self._numeric[name]
+
+    def strings(self, name):
+        """(bảng chuỗi đã intern, mã int32 theo vị trí, -1 = thiếu) của cột chuỗi."""
+        return self._tables[name], self._codes[name]
+
+    def gather(self, positions, columns=None):
+        """Lấy các cột tại positions: dict column -> mảng (chuỗi thiếu = None, số thiếu = NaN)."""
+        positions = np.asarray(positions, dtype='int64')
+        gathered = {}
+        for name in columns or self.columns:
+            if name in self._numeric:
+                gathered[name] = self._numeric[name][positions]
+            elif name in self._codes:
+                codes = self._codes[name][positions]
+                # Chỉ chạm vào các ô được lấy (không sao chép cả bảng chuỗi), mã -1 -> None
+                table = self._tables[name]
+                values = table[np.maximum(codes, 0)] if len(table) else np.empty(len(codes), dtype=object)
+                values[codes < 0] = None
+                gathered[name] = values
+            else:
+                gathered[name] = self._objects[name][positions]
+        return gathered
+
+    def rows(self, positions, columns=None):
+        """List dict (một dict cho mỗi vị trí), giá trị thiếu = None, giống kết quả đọc từ SQL."""
+        columns = list(columns or self.columns)
+        gathered = self.gather(positions, columns)
+        values = []
+        for name in columns:
+            column = gathered[name]
+            if name in self._numeric:
+                as_type = int if name in self._integer else float
+                values.append([None if v != v else as_type(v) for v in column.tolist()])
+            else:
+                values.append(column.tolist())
+        return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+class CatalogMetadata:
+    """
+    BookMetadataStore của catalogue hiện tại (bảng books, căn theo label của vector_store),
+    nạp lại khi vector_store.catalog_version thay đổi (upsert / delete qua CatalogUpdater).
+    """
+
+    def __init__(self, sql_db, vector_store, columns, numeric=(), integer=()):
+        self.sql_db = sql_db
+        self.vector_store = vector_store
+        self.columns = list(columns)
+        self.numeric = tuple(numeric)
+        self.integer = tuple(integer)
+        self._lock = threading.Lock()
+        self._store = None
+        self._loaded_version = None
+
+    def get(self):
+        with self._lock:
+            version = self.vector_store.catalog_version
+            n_labels = len(self.vector_store.unique_ids_list)
+            if self._store is None or self._loaded_version != version or len(self._store) != n_labels:
+                self._store = self._load(n_labels)
+                self._loaded_version = version
+            return self._store
+
+    def _load(self, n_labels):
+        rows = self.sql_db.conn.execute(f"SELECT {', '.join(self.columns)} FROM books").fetchall()
+        print(f"[CatalogMetadata] Đang nạp metadata của {len(rows)} sách vào bộ nhớ...")
+        key_index = self.columns.index('unique_id')
+        labels = self.vector_store.labels_for_ids([row[key_index] for row in rows])
+        found = np.flatnonzero(labels >= 0)
+        rows = [tuple(rows[i]) for i in found]
+        return BookMetadataStore.from_rows(
+            self.columns, rows, labels[found], n_labels, numeric=self.numeric, integer=self.integer
+        )
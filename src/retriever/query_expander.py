@@ -1,22 +1,48 @@
 from openai import OpenAI
+import ast
 import os
-from config import LLM_MODEL
+from config import (
+    LLM_MODEL, LLM_BASE_URL, EXPANSION_CACHE_SIZE, EXPANSION_CACHE_PATH, EXPANSION_CACHE_TTL_S,
+)
+from utils.cache import ExpansionCache
+from utils.tracing import span
 
 class OpenAIQueryExpander:
-    def __init__(self, api_key=None):
-        if api_key is None:
-            api_key = os.environ.get("OPENAI_API_KEY")
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY không được tìm thấy")
+    def __init__(self, api_key=None, client=None, cache=None):
+        """
+        client: object có API giống OpenAI (client.chat.completions.create), ví dụ
+                utils.fake_llm.FakeChatClient trong test / benchmark. None = tạo OpenAI client.
+        cache : ExpansionCache dùng chung, None = tạo theo config (EXPANSION_CACHE_SIZE = 0 để tắt).
+        """
+        if client is None:
+            if api_key is None:
+                api_key = os.environ.get("OPENAI_API_KEY")
+                if not api_key:
+                    raise ValueError("OPENAI_API_KEY không được tìm thấy")
+            client = OpenAI(api_key=api_key, base_url=LLM_BASE_URL)
 
-        self.client = OpenAI(api_key=api_key)
+        self.client = client
         self.model = LLM_MODEL
+        if cache is None and EXPANSION_CACHE_SIZE:
+            cache = ExpansionCache(EXPANSION_CACHE_SIZE, EXPANSION_CACHE_PATH, ttl_s=EXPANSION_CACHE_TTL_S)
+        self.cache = cache
+        self.llm_calls = 0
         print(f"[QueryExpander] Đã khởi tạo với model: {self.model}")
 
-    def expand_query(self, query, num_queries=4):
+    def expand_query(self, query, num_queries=4, timeout=None):
         """
         Dùng LLM (GPT) để tạo ra các biến thể của câu hỏi.
+        Câu hỏi đã từng mở rộng được lấy từ cache, không gọi LLM.
+        timeout: giới hạn thời gian (giây) cho request OpenAI, None = mặc định của client.
         """
+        if self.cache is not None:
+            with span("expansion_cache"):
+                cached = self.cache.get(self.model, num_queries, query)
+            if cached is not None:
+                all_queries = [query] + cached
+                print(f"-> [QueryExpander] Lấy từ cache: {all_queries}")
+                return all_queries
+
         print(f"[QueryExpander] Đang mở rộng câu hỏi: '{query}'...")
         prompt = f"""
         You are a helpful assistant. Your task is to generate {num_queries} different search queries 
@@ -30,17 +56,23 @@ class OpenAIQueryExpander:
         """
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            self.llm_calls += 1
+            with span("expansion_llm", model=self.model):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    timeout=timeout,
+                )
             generated_queries_str = response.choices[0].message.content
-            generated_queries = eval(generated_queries_str)
+            # literal_eval: chỉ chấp nhận list literal, không thực thi code do LLM trả về
+            generated_queries = [str(q) for q in ast.literal_eval(generated_queries_str.strip())]
             all_queries = [query] + generated_queries
 
+            if self.cache is not None:
+                self.cache.put(self.model, num_queries, query, generated_queries)
             print(f"-> [QueryExpander] Các câu hỏi đã mở rộng: {all_queries}")
             return all_queries
 
         except Exception as e:
             print(f"[QueryExpander] Lỗi khi gọi OpenAI: {e}")
-            return [query]
\ No newline at end of file
+            return [query]
@@ -1,4 +1,5 @@
 from sentence_transformers import CrossEncoder
+from utils.tracing import span
 
 class Reranker:
     """
@@ -31,7 +32,8 @@ class Reranker:
             print("Không có tài liệu hợp lệ để rerank.")
             return docs
 
-        scores = self.model.predict(pairs)
+        with span("rerank", n_docs=len(pairs)):
+            scores = self.model.predict(pairs)
         for doc, score in zip(valid_docs, scores):
             doc["rerank_score"] = float(score)
 
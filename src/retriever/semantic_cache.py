@@ -0,0 +1,112 @@
+"""
+semantic_cache.py
+=================
+Cache kết quả cuối cùng của SmartRetriever theo NGỮ NGHĨA câu hỏi:
+embedding của các câu hỏi gần đây nằm trong một FAISS index nhỏ (inner product
+trên vector đã chuẩn hóa = cosine). Câu hỏi diễn đạt lại ("what is The Hobbit about" /
+"summary of the hobbit") có cosine vượt ngưỡng sẽ dùng lại danh sách sách đã tính,
+bỏ qua toàn bộ expand -> search -> fusion -> SQL.
+
+    - LRU theo số entry + TTL theo thời gian
+    - entry chỉ dùng lại được khi cùng tham số (top_k, filters)
+    - toàn bộ cache bị xóa khi catalogue thay đổi (vector_store.catalog_version)
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+# Số láng giềng xét mỗi lần lookup (các entry gần nhau có thể khác tham số)
+LOOKUP_NEIGHBOURS = 4
+
+
+class SemanticResultCache:
+    def __init__(self, dim, max_size=2000, threshold=0.95, ttl_s=None):
+        self.dim = dim
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self._entries = OrderedDict()    # entry_id -> (params_key, value, created)
+        self._next_id = 0
+        self._catalog_version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_vector, params_key, catalog_version):
+        """Trả về bản sao kết quả đã cache của câu hỏi gần nghĩa nhất, None nếu không có."""
+        with self._lock:
+            self._check_version(catalog_version)
+            if self._index.ntotal == 0:
+                self.misses += 1
+                return None
+
+            query = np.ascontiguousarray(query_vector, dtype='float32').reshape(1, -1)
+            similarities, entry_ids = self._index.search(query, min(LOOKUP_NEIGHBOURS, self._index.ntotal))
+            now = time.time()
+            expired = []
+            hit = None
+            for similarity, entry_id in zip(similarities[0], entry_ids[0]):
+                if entry_id < 0 or similarity < self.threshold:
+                    break
+                entry_params, value, created = self._entries[int(entry_id)]
+                if self.ttl_s is not None and now - created > self.ttl_s:
+                    expired.append(int(entry_id))
+                    continue
+                if entry_params == params_key:
+                    hit = int(entry_id)
+                    break
+
+            if expired:
+                self._remove(expired)
+            if hit is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(hit)
+            return copy.deepcopy(self._entries[hit][1])
+
+    def put(self, query_vector, params_key, catalog_version, value):
+        with self._lock:
+            self._check_version(catalog_version)
+            entry_id = self._next_id
+            self._next_id += 1
+            query = np.ascontiguousarray(query_vector, dtype='float32').reshape(1, -1)
+            self._index.add_with_ids(query, np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = (params_key, copy.deepcopy(value), time.time())
+            if len(self._entries) > self.max_size:
+                self._remove(list(self._entries)[:len(self._entries) - self.max_size])
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _check_version(self, catalog_version):
+        # Sách được thêm / xóa / sửa -> mọi kết quả đã cache có thể sai
+        if catalog_version != self._catalog_version:
+            self._clear()
+            self._catalog_version = catalog_version
+
+    def _clear(self):
+        self._index.reset()
+        self._entries.clear()
+
+    def _remove(self, entry_ids):
+        self._index.remove_ids(np.asarray(entry_ids, dtype='int64'))
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
@@ -1,75 +1,379 @@
-from config import RRF_K
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from config import (
+    EXPANSION_DEADLINE_S, EXPANSION_WORKERS, FUSION_METHOD, ORIGINAL_QUERY_WEIGHT, RRF_K,
+    SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_S,
+    ADAPTIVE_EXPANSION, CONFIDENCE_MIN_TOP_SIM, CONFIDENCE_MIN_MARGIN, CONFIDENCE_MIN_ZSCORE,
+    LEXICAL_SEARCH, LEXICAL_DEPTH, LEXICAL_WEIGHT, METADATA_IN_MEMORY,
+)
 from vectorstore import BookVectorStore
-from sql_database import SQLDatabase
+from sql_database import (
+    BOOK_COLUMNS, INTEGER_COLUMNS, NUMERIC_COLUMNS, SQLDatabase, book_columns, normalize_title,
+)
 from retriever.query_expander import OpenAIQueryExpander
+from retriever.entity_index import EntityIndex
+from retriever.filters import AttributeFilterIndex, normalize_filters
+from retriever.fusion import fuse_rank_lists, pad_rank_lists
+from retriever.metadata_store import CatalogMetadata
+from retriever.semantic_cache import SemanticResultCache
+from utils.tracing import span, wrap_context
 
 print("t")
+
+
+def first_pass_confidence(distances):
+    """
+    Độ tin cậy của lượt tìm kiếm đầu, tính từ khoảng cách L2 giữa các vector đã chuẩn hóa
+    (similarity = 1 - d / 2): similarity top-1, khoảng cách top-1 / top-2,
+    và z-score của top-1 so với phần còn lại của danh sách.
+    """
+    sims = 1.0 - np.asarray(distances, dtype='float64') / 2.0
+    if len(sims) == 0:
+        return {"top_sim": 0.0, "margin": 0.0, "zscore": 0.0}
+    rest = sims[1:]
+    margin = sims[0] - rest[0] if len(rest) else sims[0]
+    zscore = (sims[0] - rest.mean()) / (rest.std() + 1e-6) if len(rest) >= 2 else 0.0
+    return {"top_sim": float(sims[0]), "margin": float(margin), "zscore": float(zscore)}
+
+
+def is_confident(confidence):
+    return confidence["top_sim"] >= CONFIDENCE_MIN_TOP_SIM and (
+        confidence["margin"] >= CONFIDENCE_MIN_MARGIN or confidence["zscore"] >= CONFIDENCE_MIN_ZSCORE
+    )
+
+
+def is_exact_match(query, row):
+    """Câu hỏi chính là tên sách, hoặc là ISBN của sách (bỏ qua dấu gạch ngang / khoảng trắng)."""
+    normalized = normalize_title(query)
+    if normalized and normalized == normalize_title(row.get('title')):
+        return True
+    digits = re.sub(r"\D", "", query)
+    return len(digits) >= 10 and digits == re.sub(r"\D", "", row.get('isbn_13') or "")
+
+
 class SmartRetriever:
     """
     Class "điều phối" (orchestrator) chính, kết hợp tất cả các thành phần:
     1. Query Expander (OpenAI)
     2. Vector Store (FAISS + BGE)
-    3. RRF (Logic hợp nhất)
-    4. SQL Database (Lấy chi tiết)
+    3. RRF (Logic hợp nhất), cùng danh sách BM25 từ full-text index (FTS5)
+    4. SQL Database (Lấy chi tiết, qua metadata dạng cột trong RAM)
     """
     def __init__(self, device='cpu'):
         print("[SmartRetriever] Đang khởi tạo các thành phần...")
         self.vector_store = BookVectorStore(device=device)
         self.sql_db = SQLDatabase()
         self.query_expander = OpenAIQueryExpander()
+        # Metadata dạng cột theo label FAISS: dùng cho bộ lọc thuộc tính và chi tiết sách của kết quả
+        self.metadata = CatalogMetadata(
+            self.sql_db, self.vector_store, BOOK_COLUMNS, numeric=NUMERIC_COLUMNS, integer=INTEGER_COLUMNS
+        )
+        self.filter_index = AttributeFilterIndex(self.metadata)
+        self.entity_index = EntityIndex(self.metadata)
         self.rrf_k = RRF_K
+        # Gọi OpenAI (I/O) ở thread riêng để không chặn lượt tìm kiếm câu hỏi gốc
+        self._expansion_pool = ThreadPoolExecutor(EXPANSION_WORKERS, thread_name_prefix="query-expansion")
+        # Bộ đếm: số truy vấn, cache hit, số lần gọi / bỏ qua / quá hạn mở rộng câu hỏi
+        self.counters = Counter()
+        self._counters_lock = threading.Lock()
+        self.result_cache = None
+        if SEMANTIC_CACHE_SIZE:
+            self.result_cache = SemanticResultCache(
+                self.vector_store.index.d, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_S
+            )
         print("[SmartRetriever] Khởi tạo hoàn tất.")
 
-    def _reciprocal_rank_fusion(self, search_results_list, k=60):
+    def _fuse(self, rank_lists, weights, top_k):
         """
-        Logic RRF (lấy từ notebook cell 10).
-        Đây là một phương thức "private".
+        Hợp nhất các danh sách (positions, scores) bằng retriever/fusion.py, score càng lớn càng tốt.
+        Trả về list (position, score) đã sắp xếp.
         """
-        scores = {}
-        for results in search_results_list:
-            for rank, pos in enumerate(results):
-                doc_score = 1.0 / (k + (rank + 1))
-                if pos not in scores:
-                    scores[pos] = 0.0
-                scores[pos] += doc_score
+        ids = pad_rank_lists([positions for positions, _ in rank_lists])
+        scores = pad_rank_lists([scores for _, scores in rank_lists], fill=0.0, dtype='float32')
+        positions, fused_scores, _ = fuse_rank_lists(
+            ids, scores, weights=weights, method=FUSION_METHOD, k=self.rrf_k, top_k=top_k
+        )
+        return list(zip(positions.tolist(), fused_scores.tolist()))
 
-        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    def _lexical_candidates(self, query, id_filter):
+        """
+        Ứng viên BM25 từ bảng books_fts, đổi sang label FAISS và lọc theo id_filter.
+        Trả về (positions, scores, exact_positions); sách trùng khớp chính xác tên / ISBN
+        (exact_positions) được đưa lên đầu.
+        """
+        rows = self.sql_db.search_lexical(query, limit=LEXICAL_DEPTH)
+        if not rows:
+            empty = np.empty(0, dtype='int64')
+            return empty, np.empty(0, dtype='float32'), empty
+
+        positions = self.vector_store.labels_for_ids([row['unique_id'] for row in rows])
+        # bm25() của FTS5 càng âm càng khớp -> đổi dấu
+        scores = -np.array([row['score'] for row in rows], dtype='float32')
+        exact = np.array([is_exact_match(query, row) for row in rows], dtype=bool)
 
-    def retrieve(self, query, top_k=5):
+        keep = positions >= 0
+        if id_filter is not None:
+            keep[keep] = id_filter[positions[keep]]
+        order = np.argsort(~exact[keep], kind='stable')
+        return positions[keep][order], scores[keep][order], positions[keep & exact]
+
+    @staticmethod
+    def _pin_exact(fused, exact_positions, top_k):
+        """
+        Đưa sách trùng khớp chính xác tên / ISBN lên đầu kết quả đã hợp nhất, với điểm không thấp hơn
+        điểm cao nhất: khi fusion, sách chỉ có trong danh sách BM25 thua mọi sách có trong cả hai danh sách.
+        """
+        exact_positions = [int(pos) for pos in exact_positions]
+        top_score = fused[0][1] if fused else 1.0
+        scores = dict(fused)
+        pinned = [(pos, max(scores.get(pos, top_score), top_score)) for pos in exact_positions]
+        pinned_set = set(exact_positions)
+        return (pinned + [(pos, score) for pos, score in fused if pos not in pinned_set])[:top_k]
+
+    def retrieve(self, query, top_k=5, filters=None, expansion_deadline_s=None):
         """
         Phương thức "công khai" (public) để thực hiện toàn bộ pipeline.
+        filters: điều kiện thuộc tính, ví dụ {"category": "Fantasy", "price": {"max": 10}, "rating": {"min": 4}}
+        (xem retriever/filters.py). Chỉ những sách thỏa điều kiện mới được chấm điểm trong FAISS.
+        expansion_deadline_s: thời gian tối đa chờ OpenAI mở rộng câu hỏi (mặc định EXPANSION_DEADLINE_S).
+        Câu hỏi gốc được tìm kiếm ngay trong lúc chờ, nên độ trễ ~ max(LLM, search).
+        Câu hỏi gần nghĩa với một câu hỏi gần đây (cùng top_k, filters) được trả lời từ cache.
+        Với ADAPTIVE_EXPANSION, LLM chỉ được gọi sau lượt tìm kiếm đầu và chỉ cho câu hỏi mà kết quả
+        của câu hỏi gốc chưa đủ tin cậy.
+        Ứng viên BM25 (tên sách, tác giả, NXB, thể loại, ISBN) được hợp nhất cùng các danh sách vector;
+        câu hỏi trùng khớp chính xác tên sách / ISBN không gọi LLM và chỉ tìm top_k láng giềng.
+        """
+        with span("retrieve", top_k=top_k, filtered=bool(filters)):
+            return self._retrieve_batch([query], top_k, filters, expansion_deadline_s)[0]
+
+    def retrieve_many(self, queries, top_k=5, filters=None, batch_size=64, expansion_deadline_s=None,
+                      columns=None):
         """
-        print(f"\n[SmartRetriever] Bắt đầu truy vấn cho: '{query}'")
-        
+        Phiên bản batch của retrieve() cho các job offline (đánh giá, tính trước gợi ý, làm nóng cache).
+        queries là list hoặc iterator bất kỳ. Mỗi batch batch_size câu hỏi được encode và tìm kiếm FAISS
+        cùng lúc, các lượt gọi LLM mở rộng câu hỏi chạy song song, chi tiết sách lấy bằng một SELECT ... IN.
+        Generator: yield list sách của từng câu hỏi theo đúng thứ tự đầu vào, bộ nhớ chỉ giữ một batch.
+        expansion_deadline_s: hạn chờ cho MỖI lượt gọi LLM (mặc định EXPANSION_DEADLINE_S).
+        columns: chỉ lấy các cột này của bảng books (mặc định tất cả, xem SQLDatabase.get_details_by_ids).
+        """
+        queries = iter(queries)
+        while True:
+            batch = list(itertools.islice(queries, batch_size))
+            if not batch:
+                return
+            with span("retrieve_batch", size=len(batch), top_k=top_k, filtered=bool(filters)):
+                results = self._retrieve_batch(batch, top_k, filters, expansion_deadline_s, columns)
+            yield from results
+
+    def _submit_expansion(self, query, deadline_s):
+        # wrap_context: span "expansion" chạy trong thread pool vẫn thuộc trace của request
+        return self._expansion_pool.submit(
+            wrap_context(self.query_expander.expand_query), query, timeout=deadline_s
+        )
+
+    def _retrieve_batch(self, queries, top_k, filters, expansion_deadline_s, columns=None):
+        """Pipeline cho một batch câu hỏi; retrieve() là trường hợp batch 1 câu."""
+        if len(queries) == 1:
+            print(f"\n[SmartRetriever] Bắt đầu truy vấn cho: '{queries[0]}'")
+        else:
+            print(f"\n[SmartRetriever] Bắt đầu batch {len(queries)} truy vấn...")
+
         SEARCH_DEPTH_K = 20
+        self._count("queries", len(queries))
+
+        results = [None] * len(queries)
+        catalog_version = self.vector_store.catalog_version
+        query_vectors = self.vector_store.encode_queries(queries)
+        params_key = json.dumps([top_k, normalize_filters(filters), columns], sort_keys=True, default=str)
+        if self.result_cache is not None:
+            with span("semantic_cache") as record:
+                for i, vector in enumerate(query_vectors):
+                    results[i] = self.result_cache.get(vector, params_key, catalog_version)
+                n_hits = sum(r is not None for r in results)
+                if record is not None:
+                    record["attrs"]["hits"] = n_hits
+            if n_hits:
+                print(f"[SmartRetriever] Dùng kết quả từ semantic cache cho {n_hits} câu hỏi.")
+                self._count("cache_hits", n_hits)
+
+        pending = [i for i, r in enumerate(results) if r is None]
+        if not pending:
+            return results
+
+        with span("filter_mask"):
+            id_filter = self.filter_index.mask(filters)
+        if id_filter is not None:
+            n_eligible = int(id_filter.sum())
+            print(f"[SmartRetriever] Bộ lọc {filters}: {n_eligible} sách thỏa điều kiện.")
+            if n_eligible == 0:
+                return [r if r is not None else [] for r in results]
+
+        lexical = {}
+        exact = {}      # câu hỏi -> vị trí các sách trùng khớp chính xác tên / ISBN
+        if LEXICAL_SEARCH:
+            for i in pending:
+                positions, scores, exact_positions = self._lexical_candidates(queries[i], id_filter)
+                lexical[i] = (positions, scores)
+                if len(exact_positions):
+                    exact[i] = exact_positions
+        if exact:
+            print(f"[SmartRetriever] {len(exact)} câu hỏi trùng khớp tên sách / ISBN -> bỏ qua mở rộng câu hỏi.")
+            self._count("expansion_skipped_exact", len(exact))
+
+        deadline_s = EXPANSION_DEADLINE_S if expansion_deadline_s is None else expansion_deadline_s
+        to_expand = [i for i in pending if i not in exact]
+        expansions = {}
+        t_start = time.perf_counter()
+        if not ADAPTIVE_EXPANSION:
+            # Mọi câu hỏi đều được mở rộng: gửi LLM trước lượt tìm kiếm đầu để độ trễ ~ max(LLM, search)
+            expansions = {i: self._submit_expansion(queries[i], deadline_s) for i in to_expand}
+
+        print("[SmartRetriever] Đang tìm kiếm câu hỏi gốc...")
+        # Câu hỏi trùng khớp chính xác chỉ cần top_k láng giềng để bổ sung cho kết quả BM25
+        search_depth = top_k if len(exact) == len(pending) else SEARCH_DEPTH_K
+        D, I = self.vector_store.search_vectors(query_vectors[pending], k=search_depth, id_filter=id_filter)
+        first_pass = dict(zip(pending, self.vector_store.format_results(D, I)))
+
+        if ADAPTIVE_EXPANSION:
+            # Lượt tìm kiếm đầu chỉ mất vài ms: chỉ gọi LLM cho các câu hỏi chưa đủ tin cậy
+            uncertain = [i for i in to_expand if not is_confident(first_pass_confidence(first_pass[i][2]))]
+            n_confident = len(to_expand) - len(uncertain)
+            if n_confident:
+                print(f"[SmartRetriever] {n_confident} câu hỏi có kết quả đầu đủ tin cậy -> bỏ qua mở rộng câu hỏi.")
+                self._count("expansion_skipped", n_confident)
+            t_start = time.perf_counter()
+            expansions = {i: self._submit_expansion(queries[i], deadline_s) for i in uncertain}
+
+        expanded_queries = {}
+        expanded_results = {}
+        if expansions:
+            self._count("expansion_called", len(expansions))
+            # Mỗi lượt gọi có deadline_s; pool chỉ chạy EXPANSION_WORKERS lượt cùng lúc
+            waves = -(-len(expansions) // EXPANSION_WORKERS)
+            deadline = t_start + deadline_s * waves
+            query_of = {future: i for i, future in expansions.items()}
+            not_done = set(query_of)
+            with span("expansion_wait", n_calls=len(expansions)):
+                # Câu hỏi mở rộng của các lượt gọi đã xong được tìm kiếm ngay,
+                # trong khi các lượt gọi chậm hơn vẫn chạy
+                while not_done:
+                    done, not_done = wait(
+                        not_done, timeout=max(0.0, deadline - time.perf_counter()), return_when=FIRST_COMPLETED
+                    )
+                    if not done:
+                        break
+                    arrived = []
+                    for future in done:
+                        i = query_of[future]
+                        expanded_queries[i] = [q for q in future.result() if q != queries[i]]
+                        arrived += [(i, q) for q in expanded_queries[i]]
+                    if arrived:
+                        print(f"[SmartRetriever] Đang tìm kiếm {len(arrived)} câu hỏi mở rộng trong một batch...")
+                        batch_results = self.vector_store.search_many(
+                            [q for _, q in arrived], k=SEARCH_DEPTH_K, id_filter=id_filter
+                        )
+                        for (i, _), result in zip(arrived, batch_results):
+                            expanded_results.setdefault(i, []).append(result)
+            for future in not_done:
+                future.cancel()
+            n_timed_out = len(not_done)
+            if n_timed_out:
+                print(f"[SmartRetriever] {n_timed_out} lượt mở rộng câu hỏi quá {deadline_s}s -> chỉ dùng câu hỏi gốc.")
+                self._count("expansion_timed_out", n_timed_out)
+
+        print(f"[SmartRetriever] Đang hợp nhất kết quả với {FUSION_METHOD.upper()}...")
+        fused = {}
+        with span("fusion", n_queries=len(pending)):
+            for i in pending:
+                _, positions, distances = first_pass[i]
+                if i in exact:
+                    positions, distances = positions[:top_k], distances[:top_k]
+                # Khoảng cách L2 càng nhỏ càng tốt -> đổi dấu cho combsum / combmnz
+                rank_lists = [(positions, -distances)]
+                rank_lists += [(p, -d) for _, p, d in expanded_results.get(i, [])]
+                weights = [ORIGINAL_QUERY_WEIGHT] + [1.0] * (len(rank_lists) - 1)
+                lexical_positions, lexical_scores = lexical.get(i, (None, None))
+                if lexical_positions is not None and len(lexical_positions):
+                    rank_lists.append((lexical_positions, lexical_scores))
+                    weights.append(LEXICAL_WEIGHT)
+                fused[i] = self._fuse(rank_lists, weights, top_k)
+                if i in exact:
+                    fused[i] = self._pin_exact(fused[i], exact[i], top_k)
+
+        # Lấy chi tiết một lần cho toàn bộ sách của batch
+        details = self._book_details(sorted({pos for i in pending for pos, _ in fused[i]}), columns)
+
+        for i in pending:
+            books = []
+            for pos, score in fused[i]:
+                book = details.get(pos)
+                if book is not None:
+                    books.append(dict(book, rrf_score=score))  # Gắn điểm RRF
+            results[i] = books
+            # Kết quả thiếu câu hỏi mở rộng (quá hạn) không được cache, lần sau sẽ tính lại đầy đủ
+            if self.result_cache is not None and (i not in expansions or i in expanded_queries):
+                self.result_cache.put(query_vectors[i], params_key, catalog_version, books)
 
-        all_queries = self.query_expander.expand_query(query)
-        
-        all_search_results = []
-        print("[SmartRetriever] Đang thực hiện tìm kiếm song song...")
-        for q in all_queries:
-            
-            _, positions, _ = self.vector_store.search(q, k=SEARCH_DEPTH_K)
-            all_search_results.append(positions)
-            
-        print("[SmartRetriever] Đang hợp nhất kết quả với RRF...")
-        fused_results_with_scores = self._reciprocal_rank_fusion(all_search_results, self.rrf_k)
-        
-        final_results = fused_results_with_scores[:top_k]
-        final_positions = [pos for pos, score in final_results]
-        
-        final_unique_ids = [self.vector_store.unique_ids_list[i] for i in final_positions]
-        
-        book_details_list = self.sql_db.get_details_by_ids(final_unique_ids)
-        
-        final_books_with_scores = []
-        for i, book in enumerate(book_details_list):
-            book['rrf_score'] = final_results[i][1] # Gắn điểm RRF
-            final_books_with_scores.append(book)
-            
         print("[SmartRetriever] Truy vấn RAG-Fusion hoàn tất.")
-        return final_books_with_scores
+        return results
+
+    def _book_details(self, positions, columns=None):
+        """
+        Chi tiết sách theo vị trí FAISS -> dict position -> book.
+        METADATA_IN_MEMORY: gather trên metadata dạng cột; ngược lại một SELECT ... IN.
+        """
+        if not positions:
+            return {}
+        if METADATA_IN_MEMORY:
+            store = self.metadata.get()
+            positions = np.asarray(positions, dtype='int64')
+            positions = positions[store.present[positions]]
+            with span("metadata_gather", n_books=len(positions)):
+                return dict(zip(positions.tolist(), store.rows(positions, book_columns(columns))))
+
+        unique_ids = self.vector_store.ids_for_positions(positions)
+        position_for_id = dict(zip(unique_ids, positions))
+        return {
+            position_for_id[book['unique_id']]: book
+            for book in self.sql_db.get_details_by_ids(unique_ids, columns)
+        }
+
+    def resolve_entity(self, name, kind=None, limit=5):
+        """
+        Đổi tên sách / tác giả thành sách cụ thể qua EntityIndex (khớp chính xác + trigram),
+        không gọi OpenAI hay FAISS. kind: 'title', 'author' hoặc None (cả hai).
+        """
+        self._count("entity_lookups")
+        with span("entity_lookup", kind=kind) as record:
+            matches = self.entity_index.lookup(name, kind=kind, limit=limit)
+            if record is not None:
+                record["attrs"]["matches"] = len(matches)
+        return matches
+
+    def _count(self, name, n=1):
+        with self._counters_lock:
+            self.counters[name] += n
+
+    def stats(self):
+        """Bộ đếm truy vấn / mở rộng câu hỏi, kèm tỉ lệ bỏ qua LLM."""
+        with self._counters_lock:
+            stats = dict(self.counters)
+        skipped = stats.get("expansion_skipped", 0) + stats.get("expansion_skipped_exact", 0)
+        searched = stats.get("expansion_called", 0) + skipped
+        stats["expansion_skip_rate"] = skipped / searched if searched else 0.0
+        if self.result_cache is not None:
+            stats["semantic_cache"] = self.result_cache.stats()
+        return stats
 
     def close(self):
-        """Đóng kết nối SQL khi hoàn tất."""
+        """Dừng thread pool mở rộng câu hỏi; pool SQL dùng chung của process không bị đóng."""
+        self._expansion_pool.shutdown(wait=False)
         self.sql_db.close()
\ No newline at end of file
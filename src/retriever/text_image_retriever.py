@@ -13,8 +13,14 @@ and provides a clean API for multimodal retrieval.
 
 from typing import List, Dict, Literal, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from src.retriever.base_retriever import FaissStore
+from src.config import (
+    EMBEDDING_MODEL, CLIP_MODEL, ENCODER_BACKEND, ONNX_CACHE_DIR, ONNX_QUANTIZE,
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH, RRF_K,
+)
+from src.retriever.fusion import fuse_rank_lists, pad_rank_lists
+from src.encoders import encoder_cache_key, load_encoder
+from src.utils.cache import EmbeddingCache
 
 
 class TextImageRetriever:
@@ -28,11 +34,13 @@ class TextImageRetriever:
     image_store : FaissStore
         FAISS store containing image embeddings.
     text_encoder : Optional[object]
-        SentenceTransformer or similar model for text embedding.
+        SentenceTransformer or ONNX encoder (config.ENCODER_BACKEND) for text embedding.
     image_text_encoder : Optional[object]
         CLIP text encoder for text→image retrieval.
-    fusion_method : Literal["rrf", "weighted"]
+    fusion_method : Literal["rrf", "weighted", "combsum", "combmnz"]
         How to combine text and image results.
+    embedding_cache : EmbeddingCache
+        LRU (+ optional on-disk) cache of query embeddings, keyed by model name.
 
     Methods
     -------
@@ -52,13 +60,15 @@ class TextImageRetriever:
         text_meta_path: str,
         image_index_path: str,
         image_meta_path: str,
-        fusion_method: Literal["rrf", "weighted"] = "rrf",
+        fusion_method: Literal["rrf", "weighted", "combsum", "combmnz"] = "rrf",
+        embedding_cache: Optional[EmbeddingCache] = None,
     ):
         self.text_store = FaissStore(text_index_path, text_meta_path, modality="text")
         self.image_store = FaissStore(image_index_path, image_meta_path, modality="image")
         self.text_encoder = None
         self.image_text_encoder = None
         self.fusion_method = fusion_method
+        self.embedding_cache = embedding_cache or EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH)
 
 
     def load_stores(self):
@@ -74,22 +84,34 @@ class TextImageRetriever:
         Encode text query using BGE-small-en-v1.5 (for text FAISS index).
         """
         if self.text_encoder is None:
-            print("Loading BGE encoder (BAAI/bge-small-en-v1.5)...")
-            self.text_encoder = SentenceTransformer("BAAI/bge-small-en-v1.5", device="cpu")
+            print(f"Loading BGE encoder ({EMBEDDING_MODEL}, backend={ENCODER_BACKEND})...")
+            self.text_encoder = load_encoder(
+                EMBEDDING_MODEL, ENCODER_BACKEND, device="cpu", cache_dir=ONNX_CACHE_DIR, quantize=ONNX_QUANTIZE
+            )
 
-        query_vec = self.text_encoder.encode([query], normalize_embeddings=True)
-        return np.array(query_vec, dtype="float32")
+        return self.embedding_cache.encode(
+            self.text_encoder,
+            encoder_cache_key(EMBEDDING_MODEL, ENCODER_BACKEND, ONNX_QUANTIZE, encoder=self.text_encoder),
+            [query],
+            normalize_embeddings=True,
+        )
 
     def encode_text_clip(self, query: str) -> np.ndarray:
         """
         Encode text query using CLIP-ViT-B-16 (for image FAISS index).
         """
         if self.image_text_encoder is None:
-            print("Loading CLIP text encoder (clip-ViT-B-16)...")
-            self.image_text_encoder = SentenceTransformer("clip-ViT-B-16", device="cpu")
+            print(f"Loading CLIP text encoder ({CLIP_MODEL}, backend={ENCODER_BACKEND})...")
+            self.image_text_encoder = load_encoder(
+                CLIP_MODEL, ENCODER_BACKEND, device="cpu", cache_dir=ONNX_CACHE_DIR, quantize=ONNX_QUANTIZE
+            )
 
-        query_vec = self.image_text_encoder.encode([query], normalize_embeddings=True)
-        return np.array(query_vec, dtype="float32")
+        return self.embedding_cache.encode(
+            self.image_text_encoder,
+            encoder_cache_key(CLIP_MODEL, ENCODER_BACKEND, ONNX_QUANTIZE, encoder=self.image_text_encoder),
+            [query],
+            normalize_embeddings=True,
+        )
 
 
     def retrieve_text(self, query: str, k: int = 10) -> List[Dict]:
@@ -97,14 +119,10 @@ class TextImageRetriever:
         Retrieve top-k text documents for a query string using BGE encoder.
         """
         query_vec = self.encode_text_bge(query)
+        # metadata is already gathered by FaissStore.search
         results = self.text_store.search(query_vec, k=k)
         for r in results:
             r["source"] = "text"
-            try:
-                meta = self.text_store.meta.iloc[r["id"]].to_dict()
-                r["metadata"] = meta
-            except Exception:
-                r["metadata"] = {}
         return results
 
     def retrieve_image_by_text(self, query: str, k: int = 10) -> List[Dict]:
@@ -123,114 +141,91 @@ class TextImageRetriever:
         List[Dict]
             List of ranked image search results.
         """
-        from sentence_transformers import SentenceTransformer
-        import numpy as np
-
-        # lazy-load CLIP text encoder
-        if self.image_text_encoder is None:
-            print("🧠 Loading CLIP text encoder (clip-ViT-B-16)...")
-            self.image_text_encoder = SentenceTransformer("clip-ViT-B-16", device="cpu")
-
-        # encode + normalize query
-        query_vec = self.image_text_encoder.encode(
-            query, convert_to_numpy=True, normalize_embeddings=True
-        )
-        query_vec = np.expand_dims(query_vec, axis=0)
+        # encode + normalize query (lazy-loads CLIP, served from cache when repeated)
+        query_vec = self.encode_text_clip(query)
 
         # search in FAISS image store
         results = self.image_store.search(query_vec, k=k)
         for r in results:
             r["source"] = "image"
-            try:
-                meta = self.image_store.meta.iloc[r["id"]].to_dict()
-                r["metadata"] = meta
-            except Exception:
-                r["metadata"] = {}
         return results
 
     def fuse_results(
             self,
             results_text: List[Dict],
             results_image: List[Dict],
-            method: Literal["rrf", "weighted"] = "rrf",
+            method: Literal["rrf", "weighted", "combsum", "combmnz"] = "rrf",
             alpha: float = 0.7,
             k: int = 10,
     ) -> List[Dict]:
         """
-        Gộp kết quả text + image (RRF hoặc weighted).
+        Gộp kết quả text + image bằng retriever/fusion.py (RRF với RRF_K của config,
+        hoặc weighted = CombSUM với trọng số alpha / 1 - alpha, hoặc CombMNZ).
         Hỗ trợ gộp trùng ID, tính điểm hợp lý, fallback title/image_url.
         """
-        import numpy as np
-        from collections import defaultdict
-
         if not results_text and not results_image:
             print("⚠️ Không có kết quả để gộp.")
             return []
+        if method not in ("rrf", "weighted", "combsum", "combmnz"):
+            raise ValueError(" Fusion method phải là 'rrf', 'weighted', 'combsum' hoặc 'combmnz'.")
+
+        # ============ Gán mã số cho từng ID (gộp trùng) ============
+        uid_codes: Dict[str, int] = {}
+        uids, metadata, sources = [], [], []
+        rank_lists, score_lists = [], []
+        for source_name, results in (("text", results_text), ("image", results_image)):
+            codes, scores = [], []
+            for r in sorted(results, key=lambda x: x.get("rank", 1000)):
+                meta = r.get("metadata", {}) or {}
+                uid = (
+                        meta.get("unique_id")
+                        or meta.get("asin")
+                        or meta.get("id")
+                        or meta.get("title")
+                        or f"noid_{id(r)}"
+                )
+                if uid not in uid_codes:
+                    uid_codes[uid] = len(uids)
+                    uids.append(uid)
+                    metadata.append(meta)
+                    sources.append(set())
+                code = uid_codes[uid]
+                # Nếu chưa có metadata có title thì gán
+                if not metadata[code].get("title") and meta:
+                    metadata[code] = meta
+                sources[code].add(r.get("source", source_name))
+                codes.append(code)
+                # FaissStore trả về khoảng cách L2 (càng nhỏ càng tốt) -> đổi dấu cho combsum / combmnz
+                scores.append(-r.get("score", 0.0))
+            rank_lists.append(codes)
+            score_lists.append(scores)
+
+        # ============ Fusion ============
+        fusion_method = "combsum" if method == "weighted" else method
+        weights = None if method == "rrf" else [alpha, 1 - alpha]
+        codes, fused_scores, counts = fuse_rank_lists(
+            pad_rank_lists(rank_lists),
+            pad_rank_lists(score_lists, fill=0.0, dtype="float64"),
+            weights=weights,
+            method=fusion_method,
+            k=RRF_K,
+            top_k=k,
+        )
 
-        # ============ RRF Fusion ============
-        rrf_k = 10  # nhỏ hơn => độ chênh điểm cao hơn
-        if method == "rrf":
-            for r in results_text:
-                r["fused_score"] = 1.0 / (rrf_k + r.get("rank", 1000))
-            for r in results_image:
-                r["fused_score"] = 1.0 / (rrf_k + r.get("rank", 1000))
-
-        # ============ Weighted Fusion ============
-        elif method == "weighted":
-            def normalize(arr):
-                arr = np.array(arr)
-                return (arr - np.min(arr)) / (np.max(arr) - np.min(arr) + 1e-8)
-
-            scores_t = normalize([r["score"] for r in results_text]) if results_text else []
-            scores_i = normalize([r["score"] for r in results_image]) if results_image else []
-            for i, r in enumerate(results_text):
-                r["fused_score"] = alpha * scores_t[i]
-            for i, r in enumerate(results_image):
-                r["fused_score"] = (1 - alpha) * scores_i[i]
-        else:
-            raise ValueError(" Fusion method phải là 'rrf' hoặc 'weighted'.")
-
-        # ============ Gộp và loại trùng ============
-        all_results = results_text + results_image
-        merged = defaultdict(lambda: {"fused_score": 0, "count": 0, "sources": set(), "metadata": {}})
-
-        for r in all_results:
-            meta = r.get("metadata", {}) or {}
-            uid = (
-                    meta.get("unique_id")
-                    or meta.get("asin")
-                    or meta.get("id")
-                    or meta.get("title")
-                    or f"noid_{id(r)}"
-            )
-
-            merged[uid]["fused_score"] += r.get("fused_score", r.get("score", 0))
-            merged[uid]["count"] += 1
-            merged[uid]["sources"].add(r.get("source", "?"))
-
-            # Nếu chưa có metadata có title thì gán
-            if not merged[uid]["metadata"].get("title") and meta:
-                merged[uid]["metadata"] = meta
-
-        # Chuyển lại sang list + sắp xếp
         fused = []
-        for uid, info in merged.items():
+        for rank, (code, score, count) in enumerate(zip(codes.tolist(), fused_scores.tolist(), counts.tolist()), 1):
             fused.append({
-                "id": uid,
-                "fused_score": info["fused_score"],
-                "count": info["count"],
-                "sources": list(info["sources"]),
-                "metadata": info["metadata"]
+                "id": uids[code],
+                "fused_score": score,
+                "count": count,
+                "sources": sorted(sources[code]),
+                "metadata": metadata[code],
+                "rank": rank,
             })
-
-        fused = sorted(fused, key=lambda x: (x["fused_score"], x["count"]), reverse=True)
-        for rank, r in enumerate(fused, 1):
-            r["rank"] = rank
-
-        fused = fused[:k]
+        n_inputs = len(results_text) + len(results_image)
 
         # ============ In tóm tắt =============
-        print(f"[INFO]  Gộp {len(fused)} kết quả cuối cùng từ {len(all_results)} kết quả gốc.")
+        print(f"[INFO]  Gộp {len(fused)} kết quả cuối cùng từ {n_inputs} kết quả gốc.")
         for r in fused:
             meta = r["metadata"]
             title = meta.get("title") or meta.get("content") or meta.get("description") or "❓(không có title)"
@@ -1,41 +1,569 @@
+import functools
+import os
+import re
 import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
 import config
+from utils.tracing import span
+
+# Các cột của bảng books (xem data/schema.sql)
+BOOK_COLUMNS = [
+    'unique_id', 'title', 'author_name', 'publisher', 'publication_year',
+    'main_category', 'categories', 'book_format', 'language', 'page_count',
+    'isbn_13', 'price', 'average_rating', 'rating_number',
+    'main_images', 'author_avatar'
+]
+# Cột kiểu số (REAL / INTEGER trong schema.sql), còn lại là TEXT
+NUMERIC_COLUMNS = ['publication_year', 'page_count', 'price', 'average_rating']
+INTEGER_COLUMNS = ['rating_number']
+
+# SQLite giới hạn số tham số "?" trong một câu lệnh (mặc định 999)
+SQL_CHUNK_SIZE = 900
+
+# Bảng FTS5 (BM25) trên các cột định danh của sách. Giữ đồng bộ với data/schema.sql;
+# dùng IF NOT EXISTS để nâng cấp DB được tạo trước khi có bảng này.
+FTS_COLUMNS = ['title', 'author_name', 'publisher', 'categories', 'isbn_13']
+# Trọng số BM25 theo cột (cùng thứ tự FTS_COLUMNS): trùng tên sách / ISBN quan trọng hơn thể loại
+FTS_WEIGHTS = [10.0, 5.0, 2.0, 1.0, 10.0]
+# Bảng FTS và các bảng ẩn của nó, không cho agent SQL nhìn thấy
+FTS_TABLES = ['books_fts', 'books_fts_data', 'books_fts_idx', 'books_fts_docsize', 'books_fts_config']
+FTS_TRIGGERS = ['books_fts_ai', 'books_fts_ad', 'books_fts_au']
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author_name, publisher, categories, isbn_13,
+    content='books', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES (new.rowid, new.title, new.author_name, new.publisher, new.categories, new.isbn_13);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES ('delete', old.rowid, old.title, old.author_name, old.publisher, old.categories, old.isbn_13);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES ('delete', old.rowid, old.title, old.author_name, old.publisher, old.categories, old.isbn_13);
+    INSERT INTO books_fts(rowid, title, author_name, publisher, categories, isbn_13)
+    VALUES (new.rowid, new.title, new.author_name, new.publisher, new.categories, new.isbn_13);
+END;
+"""
+
+
+def book_columns(columns=None):
+    """Kiểm tra danh sách cột (chỉ nhận cột của books) và đưa unique_id lên đầu."""
+    columns = BOOK_COLUMNS if columns is None else list(columns)
+    unknown = [c for c in columns if c not in BOOK_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cột không hợp lệ: {unknown}. Chọn trong {BOOK_COLUMNS}")
+    return ('unique_id',) + tuple(c for c in columns if c != 'unique_id')
+
+
+@functools.lru_cache(maxsize=32)
+def book_row_type(columns):
+    """namedtuple cho một tập cột (tuple, không có __dict__): nhẹ hơn dict khi lấy hàng nghìn sách."""
+    return namedtuple('BookRow', columns)
+
+
+def ensure_fts_index(conn):
+    """Tạo bảng FTS5 + trigger nếu chưa có; DB cũ (bảng FTS rỗng) được index lại toàn bộ một lần."""
+    conn.executescript(FTS_SCHEMA)
+    (n_books,) = conn.execute("SELECT COUNT(*) FROM books").fetchone()
+    (n_indexed,) = conn.execute("SELECT COUNT(*) FROM books_fts_docsize").fetchone()
+    if n_books and not n_indexed:
+        print(f"[SQLDatabase] Đang xây dựng full-text index cho {n_books} sách...")
+        conn.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+    conn.commit()
+
+
+# Bảng tổng hợp cho các câu hỏi có cấu trúc hay gặp của agent (số sách, giá thấp nhất / cao nhất,
+# rating trung bình, sách rating cao nhất theo thể loại / tác giả): <dim>_stats và <dim>_top_rated.
+# Trigger trên books tính lại đúng các key bị ảnh hưởng mỗi khi một dòng thay đổi.
+SUMMARY_DIMENSIONS = {'category': 'main_category', 'author': 'author_name'}
+SUMMARY_TOP_N = 10
+SUMMARY_TOP_COLUMNS = ['unique_id', 'title', 'author_name', 'main_category', 'price', 'average_rating', 'rating_number']
+SUMMARY_TABLES = [f"{dim}_{kind}" for dim in SUMMARY_DIMENSIONS for kind in ('stats', 'top_rated')]
+SUMMARY_TRIGGERS = [f"books_{dim}_summary_{event}" for dim in SUMMARY_DIMENSIONS for event in ('ai', 'ad', 'au')]
+
+
+def _summary_refresh_sql(dim, key, ref):
+    """Câu lệnh tính lại <dim>_stats / <dim>_top_rated cho key = {ref}.{key} (ref = new / old trong trigger)."""
+    top_columns = ', '.join(SUMMARY_TOP_COLUMNS)
+    return f"""
+    DELETE FROM {dim}_stats WHERE {key} = {ref}.{key};
+    INSERT INTO {dim}_stats ({key}, book_count, min_price, max_price, avg_price, avg_rating, max_rating)
+        SELECT {key}, COUNT(*), MIN(price), MAX(price), AVG(price), AVG(average_rating), MAX(average_rating)
+        FROM books WHERE {key} = {ref}.{key} GROUP BY {key};
+    DELETE FROM {dim}_top_rated WHERE {key} = {ref}.{key};
+    INSERT INTO {dim}_top_rated (rank, {top_columns})
+        SELECT ROW_NUMBER() OVER (ORDER BY average_rating DESC, rating_number DESC), {top_columns}
+        FROM (SELECT {top_columns} FROM books
+              WHERE {key} = {ref}.{key} AND average_rating IS NOT NULL
+              ORDER BY average_rating DESC, rating_number DESC LIMIT {SUMMARY_TOP_N});
+"""
+
+
+def _summary_trigger_statements():
+    """Các câu CREATE TRIGGER (mỗi phần tử một câu lệnh) giữ bảng tổng hợp đồng bộ với books."""
+    tracked = 'title, author_name, main_category, price, average_rating, rating_number'
+    statements = []
+    for dim, key in SUMMARY_DIMENSIONS.items():
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS books_{dim}_summary_ai AFTER INSERT ON books BEGIN\n"
+            f"{_summary_refresh_sql(dim, key, 'new')}END",
+            f"CREATE TRIGGER IF NOT EXISTS books_{dim}_summary_ad AFTER DELETE ON books BEGIN\n"
+            f"{_summary_refresh_sql(dim, key, 'old')}END",
+            f"CREATE TRIGGER IF NOT EXISTS books_{dim}_summary_au AFTER UPDATE OF {tracked} ON books BEGIN\n"
+            f"{_summary_refresh_sql(dim, key, 'old')}{_summary_refresh_sql(dim, key, 'new')}END",
+        ]
+    return statements
+
+
+def _summary_schema_sql():
+    statements = []
+    for dim, key in SUMMARY_DIMENSIONS.items():
+        top_columns = ', '.join(f"{c} {'REAL' if c in NUMERIC_COLUMNS else 'INTEGER' if c in INTEGER_COLUMNS else 'TEXT'}"
+                                for c in SUMMARY_TOP_COLUMNS)
+        statements.append(f"""
+CREATE TABLE IF NOT EXISTS {dim}_stats (
+    {key} TEXT PRIMARY KEY,
+    book_count INTEGER,
+    min_price REAL,
+    max_price REAL,
+    avg_price REAL,
+    avg_rating REAL,
+    max_rating REAL
+);
+CREATE TABLE IF NOT EXISTS {dim}_top_rated (
+    rank INTEGER,                       -- 1 = rating cao nhất (hòa thì nhiều lượt đánh giá hơn đứng trước)
+    {top_columns},
+    PRIMARY KEY ({key}, rank)
+);
+-- Index phục vụ trigger (và các câu ORDER BY price / rating theo {key} của agent)
+CREATE INDEX IF NOT EXISTS idx_{dim}_price ON books({key}, price);
+CREATE INDEX IF NOT EXISTS idx_{dim}_rating ON books({key}, average_rating DESC, rating_number DESC);
+""")
+    statements += [f"{statement};\n" for statement in _summary_trigger_statements()]
+    return ''.join(statements)
+
+
+def summary_tables_description():
+    """Mô tả các bảng tổng hợp cho LLM (đưa vào description của SQL tool)."""
+    stats_columns = "book_count, min_price, max_price, avg_price, avg_rating, max_rating"
+    top_columns = ', '.join(SUMMARY_TOP_COLUMNS)
+    parts = []
+    for dim, key in SUMMARY_DIMENSIONS.items():
+        parts.append(f"{dim}_stats({key}, {stats_columns})")
+        parts.append(f"{dim}_top_rated(rank, {top_columns}) = top {SUMMARY_TOP_N} sách rating cao nhất, rank 1 = cao nhất")
+    return "; ".join(parts)
+
+
+def _refresh_summary(conn, dim, key, where="", params=()):
+    top_columns = ', '.join(SUMMARY_TOP_COLUMNS)
+    conn.execute(f"DELETE FROM {dim}_stats WHERE 1 {where}", params)
+    conn.execute(
+        f"INSERT INTO {dim}_stats ({key}, book_count, min_price, max_price, avg_price, avg_rating, max_rating) "
+        f"SELECT {key}, COUNT(*), MIN(price), MAX(price), AVG(price), AVG(average_rating), MAX(average_rating) "
+        f"FROM books WHERE {key} IS NOT NULL {where} GROUP BY {key}",
+        params,
+    )
+    conn.execute(f"DELETE FROM {dim}_top_rated WHERE 1 {where}", params)
+    conn.execute(
+        f"INSERT INTO {dim}_top_rated (rank, {top_columns}) "
+        f"SELECT rank, {top_columns} FROM ("
+        f"  SELECT {top_columns}, ROW_NUMBER() OVER ("
+        f"    PARTITION BY {key} ORDER BY average_rating DESC, rating_number DESC) AS rank"
+        f"  FROM books WHERE {key} IS NOT NULL AND average_rating IS NOT NULL {where}"
+        f") WHERE rank <= {SUMMARY_TOP_N}",
+        params,
+    )
+
+
+def rebuild_summary_tables(conn):
+    """Tính lại toàn bộ bảng tổng hợp bằng một lần GROUP BY (sau khi nạp dữ liệu hàng loạt)."""
+    for dim, key in SUMMARY_DIMENSIONS.items():
+        _refresh_summary(conn, dim, key)
+
+
+def refresh_summary_keys(conn, keys):
+    """Tính lại bảng tổng hợp chỉ cho các key bị ảnh hưởng: keys = {dim: tập giá trị của cột key}."""
+    for dim, key in SUMMARY_DIMENSIONS.items():
+        values = sorted(v for v in keys.get(dim, ()) if v is not None)
+        for start in range(0, len(values), SQL_CHUNK_SIZE):
+            chunk = values[start:start + SQL_CHUNK_SIZE]
+            _refresh_summary(conn, dim, key, f"AND {key} IN ({', '.join('?' for _ in chunk)})", chunk)
+
+
+def _summary_keys(conn, unique_ids):
+    """{dim: tập giá trị key} của các sách unique_ids đang có trong books."""
+    keys = {dim: set() for dim in SUMMARY_DIMENSIONS}
+    columns = ', '.join(SUMMARY_DIMENSIONS.values())
+    for start in range(0, len(unique_ids), SQL_CHUNK_SIZE):
+        chunk = unique_ids[start:start + SQL_CHUNK_SIZE]
+        rows = conn.execute(
+            f"SELECT {columns} FROM books WHERE unique_id IN ({', '.join('?' for _ in chunk)})", chunk
+        ).fetchall()
+        for row in rows:
+            for dim, value in zip(SUMMARY_DIMENSIONS, row):
+                keys[dim].add(value)
+    return keys
+
+
+@contextmanager
+def bulk_summary_update(conn, unique_ids):
+    """
+    Ghi hàng loạt vào books (trong writer()) mà không để trigger tính lại bảng tổng hợp cho từng dòng:
+    trigger bị xóa trong transaction, sau khi ghi chỉ các thể loại / tác giả của unique_ids (trước và
+    sau khi ghi) được tính lại, rồi trigger được tạo lại. DDL của SQLite nằm trong transaction nên
+    connection khác không thấy trạng thái giữa chừng; lỗi -> rollback khôi phục cả trigger.
+    """
+    unique_ids = list(unique_ids)
+    if not conn.in_transaction:
+        # DDL không tự mở transaction trong sqlite3 của Python
+        conn.execute("BEGIN")
+    keys = _summary_keys(conn, unique_ids)
+    for name in SUMMARY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    yield
+    for dim, values in _summary_keys(conn, unique_ids).items():
+        keys[dim] |= values
+    refresh_summary_keys(conn, keys)
+    for statement in _summary_trigger_statements():
+        conn.execute(statement)
+
+
+def drop_summary_triggers(conn):
+    """Tắt cập nhật tăng dần (nạp hàng loạt), gọi ensure_summary_tables(conn, rebuild=True) sau khi nạp xong."""
+    conn.executescript(''.join(f"DROP TRIGGER IF EXISTS {name};" for name in SUMMARY_TRIGGERS))
+
+
+def ensure_summary_tables(conn, rebuild=False):
+    """Tạo bảng tổng hợp + trigger nếu chưa có; tính lại toàn bộ khi rebuild hoặc khi bảng còn rỗng."""
+    conn.executescript(_summary_schema_sql())
+    (n_books,) = conn.execute("SELECT COUNT(*) FROM books").fetchone()
+    (n_stats,) = conn.execute(f"SELECT COUNT(*) FROM {SUMMARY_TABLES[0]}").fetchone()
+    if rebuild or (n_books and not n_stats):
+        print(f"[SQLDatabase] Đang tính bảng tổng hợp ({', '.join(SUMMARY_TABLES)}) cho {n_books} sách...")
+        rebuild_summary_tables(conn)
+    conn.commit()
+
+
+def schema_up_to_date(conn):
+    """
+    Kiểm tra bằng connection chỉ đọc: bảng FTS, bảng tổng hợp và các trigger đã có, và đã được
+    tính nếu books có dữ liệu. True = không cần mở connection ghi / chạy DDL khi khởi động.
+    """
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    if not names.issuperset(['books_fts', *FTS_TRIGGERS, *SUMMARY_TABLES, *SUMMARY_TRIGGERS]):
+        return False
+    (has_books,) = conn.execute("SELECT EXISTS (SELECT 1 FROM books)").fetchone()
+    if not has_books:
+        return True
+    (fts_indexed,) = conn.execute("SELECT EXISTS (SELECT 1 FROM books_fts_docsize)").fetchone()
+    (summarized,) = conn.execute(f"SELECT EXISTS (SELECT 1 FROM {SUMMARY_TABLES[0]})").fetchone()
+    return bool(fts_indexed and summarized)
+
+
+def fts_match_query(text):
+    """Câu hỏi tự do -> biểu thức MATCH của FTS5: các từ được đặt trong ngoặc kép và nối bằng OR."""
+    tokens = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(tokens))
+
+
+def normalize_title(text):
+    """Chuẩn hóa để so khớp chính xác tên sách / ISBN: chữ thường, chỉ giữ chữ và số."""
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+
+def _apply_pragmas(conn):
+    conn.execute(f"PRAGMA mmap_size = {int(config.SQL_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size = -{int(config.SQL_CACHE_SIZE_KB)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def connect_writer(db_path=None):
+    """
+    Connection ghi: bật WAL (lưu trong file DB, reader không bị writer chặn) và recursive_triggers
+    (INSERT OR REPLACE mới kích hoạt trigger DELETE, cần cho bảng books_fts).
+    """
+    conn = sqlite3.connect(db_path or config.SQL_DB_PATH, timeout=config.SQL_BUSY_TIMEOUT_S,
+                           check_same_thread=False)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    except sqlite3.OperationalError as e:
+        # File / thư mục chỉ đọc: vẫn dùng được với rollback journal
+        print(f"[ConnectionPool] Không bật được WAL: {e}")
+    conn.execute("PRAGMA recursive_triggers = ON")
+    _apply_pragmas(conn)
+    return conn
+
+
+def connect_reader(db_path=None):
+    """Connection chỉ đọc (URI mode=ro): câu lệnh ghi bị SQLite từ chối ngay."""
+    uri = f"file:{pathname2url(os.path.abspath(db_path or config.SQL_DB_PATH))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=config.SQL_BUSY_TIMEOUT_S, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
+    return conn
+
+
+# Bảng bị ghi mà authorizer của SQLite báo cho connection ghi (tên bảng ở tham số đầu tiên)
+_WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+# Đổi schema (PRAGMA schema_version thay đổi): coi như mọi bảng đều bị ghi
+ALL_TABLES = "*"
+
+
+class ConnectionPool:
+    """
+    Các connection SQLite dùng chung trong process cho một file DB:
+        - reader(): connection chỉ đọc riêng cho từng thread, tạo lần đầu rồi dùng lại
+          (thread pool của FastAPI đọc song song, không tranh nhau một handle)
+        - writer(): context manager trên MỘT connection ghi, tuần tự hóa bằng lock,
+          commit khi thoát bình thường và rollback khi có lỗi
+        - add_write_listener(callback): callback(tables) được gọi sau mỗi khối writer() với
+          tập tên bảng đã bị ghi (kể cả bảng do trigger ghi; ALL_TABLES khi schema thực sự
+          thay đổi, DDL "IF NOT EXISTS" không làm gì thì không tính)
+        - external_version(): tăng mỗi khi một connection KHÁC (process khác: build-index,
+          worker khác) commit vào DB, phát hiện bằng PRAGMA data_version của connection ghi
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = os.path.abspath(db_path or config.SQL_DB_PATH)
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._written = None
+        self._write_listeners = []
+        self._data_version = None
+        self._external_version = 0
+
+    def reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self._writer is None:
+                # Connection ghi đầu tiên chuyển DB sang WAL trước khi các reader mở
+                with self.writer():
+                    pass
+            conn = connect_reader(self.db_path)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = connect_writer(self.db_path)
+            conn = self._writer
+            # writer() lồng nhau: chỉ khối ngoài cùng ghi nhận bảng bị ghi và báo cho listener
+            outermost = self._written is None
+            if outermost:
+                self._written = set()
+                (schema_version,) = conn.execute("PRAGMA schema_version").fetchone()
+                # Đặt authorizer làm các câu lệnh đã prepare hết hạn -> mọi câu đều đi qua callback
+                conn.set_authorizer(self._record_write)
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                if outermost:
+                    conn.set_authorizer(None)
+                    self._check_data_version(conn)
+                    written, self._written = self._written, None
+                    if conn.execute("PRAGMA schema_version").fetchone()[0] != schema_version:
+                        written.add(ALL_TABLES)
+                    # Báo cả khi rollback: xóa thừa cache an toàn hơn giữ kết quả cũ
+                    if written:
+                        self._notify_write(frozenset(written))
+
+    def external_version(self):
+        """
+        Bộ đếm số lần phát hiện process khác ghi vào DB. data_version của connection ghi không đổi
+        khi chính nó commit (reader của pool chỉ đọc), nên mọi thay đổi đều đến từ bên ngoài.
+        Khi writer() đang chạy thì trả về giá trị đã biết; khối writer() kiểm tra lại lúc kết thúc.
+        """
+        if self._writer is not None and self._write_lock.acquire(blocking=False):
+            try:
+                if self._writer is not None:
+                    self._check_data_version(self._writer)
+            finally:
+                self._write_lock.release()
+        return self._external_version
+
+    def _check_data_version(self, conn):
+        (data_version,) = conn.execute("PRAGMA data_version").fetchone()
+        if self._data_version is not None and data_version != self._data_version:
+            self._external_version += 1
+        self._data_version = data_version
+
+    def add_write_listener(self, callback):
+        self._write_listeners.append(callback)
+
+    def remove_write_listener(self, callback):
+        if callback in self._write_listeners:
+            self._write_listeners.remove(callback)
+
+    def _record_write(self, action, arg1, arg2, db_name, source):
+        # sqlite_master / sqlite_sequence: ghi nội bộ của DDL / AUTOINCREMENT, schema được xét riêng
+        if action in _WRITE_ACTIONS and arg1 and not arg1.lower().startswith('sqlite_'):
+            self._written.add(arg1.lower())
+        return sqlite3.SQLITE_OK
+
+    def _notify_write(self, tables):
+        for callback in list(self._write_listeners):
+            try:
+                callback(tables)
+            except Exception as e:
+                print(f"[ConnectionPool] Lỗi khi báo thay đổi bảng {sorted(tables)}: {e}")
+
+    def close(self):
+        """Đóng mọi connection; lần dùng tiếp theo sẽ mở lại."""
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+            self._local = threading.local()
+        for conn in readers:
+            conn.close()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+                # data_version chỉ so sánh được trên cùng một connection
+                self._data_version = None
+                self._external_version += 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=None):
+    """ConnectionPool dùng chung của process cho file DB (mặc định SQL_DB_PATH)."""
+    path = os.path.abspath(db_path or config.SQL_DB_PATH)
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
 
 class SQLDatabase:
-    def __init__(self):
-        print(f"[SQLDatabase] Đang kết nối tới: {config.SQL_DB_PATH}")
+    def __init__(self, pool=None):
+        # Pool dùng chung của process (get_pool) thuộc về mọi module, chỉ pool truyền vào mới được close()
+        self._owns_pool = pool is not None
+        self.pool = pool or get_pool()
+        print(f"[SQLDatabase] Đang kết nối tới: {self.pool.db_path}")
         try:
-            self.conn = sqlite3.connect(config.SQL_DB_PATH)
-            self.conn.row_factory = sqlite3.Row
+            self.pool.reader()
             print("[SQLDatabase] Kết nối thành công.")
         except Exception as e:
             print(f"[SQLDatabase] Lỗi kết nối: {e}")
-            self.conn = None
+            self.pool = None
+            return
+
+        try:
+            # Schema đã đủ (trường hợp thường gặp): không lấy lock ghi, không chạy DDL
+            if schema_up_to_date(self.pool.reader()):
+                return
+        except sqlite3.Error:
+            pass
+
+        try:
+            with self.pool.writer() as conn:
+                ensure_fts_index(conn)
+        except sqlite3.Error as e:
+            # Không có FTS thì vẫn dùng được tìm kiếm vector, chỉ mất nhánh lexical
+            print(f"[SQLDatabase] Không tạo được full-text index: {e}")
+
+        try:
+            with self.pool.writer() as conn:
+                ensure_summary_tables(conn)
+        except sqlite3.Error as e:
+            print(f"[SQLDatabase] Không tạo được bảng tổng hợp: {e}")
 
-    def get_details_by_ids(self, unique_ids):
+    @property
+    def conn(self):
+        """Connection chỉ đọc của thread hiện tại (None nếu không kết nối được)."""
+        return self.pool.reader() if self.pool is not None else None
+
+    def get_details_by_ids(self, unique_ids, columns=None, as_tuples=False):
         """
-        Truy vấn SQL DB để lấy thông tin chi tiết của sách từ list unique_id.
+        Truy vấn SQL DB để lấy thông tin chi tiết của sách từ list unique_id,
+        giữ đúng thứ tự của unique_ids (id lặp lại trả về một lần, id không có trong DB bị bỏ qua).
+        columns  : các cột cần lấy (mặc định BOOK_COLUMNS), unique_id luôn có và đứng đầu.
+        as_tuples: True -> trả về namedtuple BookRow thay cho dict.
         """
         if not self.conn or not unique_ids:
             return []
-            
+
+        columns = book_columns(columns)
+        if as_tuples:
+            make_row = book_row_type(columns)._make
+        else:
+            def make_row(row):
+                return dict(zip(columns, row))
+
         try:
-            placeholders = ', '.join('?' for _ in unique_ids)
-            query_sql = f"SELECT * FROM books WHERE unique_id IN ({placeholders})"
-            
-            cursor = self.conn.cursor()
-            cursor.execute(query_sql, unique_ids)
-            
-            results = [dict(row) for row in cursor.fetchall()]
-            
-            # Sắp xếp lại kết quả theo đúng thứ tự của unique_ids
-            results_sorted = sorted(results, key=lambda x: unique_ids.index(x['unique_id']))
-            return results_sorted
+            # Vị trí của từng id trong input: sắp xếp lại kết quả trong O(n)
+            position = {}
+            for uid in unique_ids:
+                position.setdefault(str(uid), len(position))
+            ids = list(position)
+            ordered = [None] * len(ids)
+
+            select_sql = f"SELECT {', '.join(columns)} FROM books WHERE unique_id IN "
+            with span("sql_fetch", n_ids=len(ids)):
+                cursor = self.conn.cursor()
+                cursor.row_factory = None
+                for start in range(0, len(ids), SQL_CHUNK_SIZE):
+                    chunk = ids[start:start + SQL_CHUNK_SIZE]
+                    cursor.execute(select_sql + f"({', '.join('?' for _ in chunk)})", chunk)
+                    for row in cursor:
+                        ordered[position[row[0]]] = make_row(row)
+            return [row for row in ordered if row is not None]
         except Exception as e:
             print(f"[SQLDatabase] Lỗi truy vấn: {e}")
             return []
 
+    def search_lexical(self, query, limit=20):
+        """
+        Tìm kiếm full-text (BM25) trên tên sách, tác giả, NXB, thể loại, ISBN.
+        Trả về list dict {unique_id, title, isbn_13, score}, score càng nhỏ càng khớp (quy ước bm25 của FTS5).
+        """
+        match = fts_match_query(query)
+        if not self.conn or not match:
+            return []
+
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        query_sql = (
+            f"SELECT b.unique_id, b.title, b.isbn_13, bm25(books_fts, {weights}) AS score "
+            "FROM books_fts JOIN books b ON b.rowid = books_fts.rowid "
+            "WHERE books_fts MATCH ? ORDER BY score LIMIT ?"
+        )
+        try:
+            with span("lexical_search", limit=limit):
+                return [dict(row) for row in self.conn.execute(query_sql, (match, limit)).fetchall()]
+        except sqlite3.Error as e:
+            print(f"[SQLDatabase] Lỗi tìm kiếm full-text: {e}")
+            return []
+
     def close(self):
-        if self.conn:
-            self.conn.close()
+        """Đóng pool nếu nó được truyền vào; pool dùng chung (get_pool) vẫn phục vụ các module khác."""
+        if self.pool is not None and self._owns_pool:
+            self.pool.close()
             print("[SQLDatabase] Đã đóng kết nối.")
\ No newline at end of file
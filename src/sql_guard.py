@@ -0,0 +1,279 @@
+"""
+sql_guard.py
+============
+Chạy câu SQL do LLM sinh ra (SQL tool của agent) trong giới hạn, để độ trễ của /chat
+không phụ thuộc vào câu lệnh model viết ra:
+    - chỉ một câu SELECT / WITH, trên connection chỉ đọc (mode=ro) của ConnectionPool
+    - EXPLAIN QUERY PLAN trước khi chạy: từ chối các vòng lặp lồng nhau quét toàn bộ
+      (cross join, join không có điều kiện dùng được index, subquery tương quan quét toàn bảng)
+    - luôn bọc thành SELECT * FROM (...) LIMIT: câu quét toàn bảng không có LIMIT
+      không thể trả về hàng nghìn dòng
+    - progress handler của SQLite ngắt câu lệnh chạy quá thời gian cho phép
+    - cắt số dòng / số byte trả về cho LLM
+    - SQLResultCache: dùng lại kết quả của câu lệnh tương đương (khác khoảng trắng,
+      chữ hoa / thường, alias), bị xóa khi các bảng nó đọc bị ghi qua ConnectionPool.writer()
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import config
+from sql_database import ALL_TABLES, get_pool
+from utils.tracing import span
+
+# Số lệnh VM của SQLite giữa hai lần gọi progress handler (~ vài chục micro giây)
+PROGRESS_STEPS = 10000
+
+_READ_ONLY_STATEMENT = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+# P4 của VOpen là địa chỉ vtab, khác nhau giữa các connection
+_VTAB_POINTER = re.compile(r"^vtab:[0-9A-Fa-f]+$")
+
+
+class UnsafeQueryError(ValueError):
+    """Câu SQL bị từ chối trước khi chạy."""
+
+
+def check_query_plan(plan):
+    """
+    plan: các dòng (id, parent, notused, detail) của EXPLAIN QUERY PLAN.
+    Raise UnsafeQueryError nếu có hai lần quét toàn bộ lồng nhau. Trả về số lần quét toàn bộ.
+    """
+    parents = {row[0]: row[1] for row in plan}
+    details = {row[0]: row[3] for row in plan}
+    scans = [row for row in plan if _FULL_SCAN.match(row[3])]
+
+    # Hai bảng quét toàn bộ cùng cấp = vòng lặp lồng nhau (tích Descartes)
+    siblings = Counter(row[1] for row in scans)
+    if any(count >= 2 for count in siblings.values()):
+        raise UnsafeQueryError(
+            "Câu truy vấn join nhiều bảng mà không có điều kiện dùng được index (cross join). "
+            "Hãy thêm điều kiện JOIN ... ON / WHERE trên cột có index hoặc dùng các bảng tổng hợp."
+        )
+
+    # Subquery tương quan quét toàn bảng, chạy lại cho mỗi dòng của một lần quét toàn bảng khác
+    def correlated(node_id):
+        while node_id:
+            if details.get(node_id, "").startswith("CORRELATED"):
+                return True
+            node_id = parents.get(node_id, 0)
+        return False
+
+    inner = [row for row in scans if correlated(row[1])]
+    if inner and len(scans) > len(inner):
+        raise UnsafeQueryError(
+            "Subquery tương quan quét toàn bảng cho mỗi dòng của bảng ngoài. "
+            "Hãy viết lại bằng JOIN / GROUP BY hoặc dùng các bảng tổng hợp."
+        )
+    return len(scans)
+
+
+def _normalize(query):
+    query = query.strip().rstrip(";").strip()
+    if not _READ_ONLY_STATEMENT.match(_LINE_COMMENT.sub("", query)):
+        raise UnsafeQueryError("Chỉ được chạy một câu SELECT (hoặc WITH ... SELECT).")
+    return query
+
+
+class SQLResultCache:
+    """
+    LRU kết quả của run_guarded_query, khóa = chương trình bytecode mà SQLite biên dịch
+    từ câu lệnh (EXPLAIN) + tham số + giới hạn. Hai câu chỉ khác khoảng trắng, chữ hoa /
+    thường của từ khóa hay alias bảng biên dịch ra cùng một chương trình nên dùng chung entry.
+
+    Mỗi entry nhớ các bảng câu lệnh đã đọc; invalidate(tables) (đăng ký làm write listener
+    của ConnectionPool) xóa mọi entry đọc một trong các bảng đó. Ghi từ process khác
+    (build-index, worker khác) được phát hiện qua ConnectionPool.external_version():
+    sync() xóa toàn bộ cache khi giá trị này thay đổi. Kết quả đã bị cắt theo
+    SQL_TOOL_MAX_BYTES nên bộ nhớ bị chặn bởi max_size * max_bytes.
+    """
+
+    def __init__(self, max_size=256, ttl_s=None):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()    # key -> (tables, value, created)
+        self._by_table = {}              # tên bảng -> set key
+        self._lock = threading.Lock()
+        self._external_version = None
+
+        # Tăng sau mỗi lần invalidate: kết quả đọc trước một lần ghi không được put vào cache
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_s is not None and time.time() - entry[2] > self.ttl_s:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, tables, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (tables, value, time.time())
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def sync(self, external_version):
+        """Xóa toàn bộ cache khi DB bị process khác ghi (external_version thay đổi)."""
+        with self._lock:
+            if external_version == self._external_version:
+                return
+            if self._external_version is not None:
+                self.invalidated += len(self._entries)
+                self._entries.clear()
+                self._by_table.clear()
+                self.generation += 1
+            self._external_version = external_version
+
+    def invalidate(self, tables):
+        """Xóa các entry đã đọc một trong các bảng (ALL_TABLES = xóa hết)."""
+        with self._lock:
+            if ALL_TABLES in tables:
+                keys = list(self._entries)
+            else:
+                keys = {key for table in tables for key in self._by_table.get(table, ())}
+            for key in keys:
+                self._remove(key)
+            self.invalidated += len(keys)
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _remove(self, key):
+        tables, _, _ = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+
+def canonical_statement(conn, query, params=()):
+    """
+    (chương trình bytecode đã chuẩn hóa, frozenset bảng được đọc) của câu lệnh.
+    Bỏ cột addr / comment của EXPLAIN (comment chứa alias); bảng được đọc lấy từ
+    authorizer (SQLITE_READ), gồm cả bảng nằm sau view.
+    """
+    tables = set()
+
+    def record_read(action, arg1, arg2, db_name, source):
+        if action == sqlite3.SQLITE_READ and arg1:
+            tables.add(arg1.lower())
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(record_read)
+    try:
+        program = conn.execute(f"EXPLAIN {query}", params).fetchall()
+    finally:
+        conn.set_authorizer(None)
+    program = tuple(
+        (row[1], row[2], row[3], row[4],
+         "vtab" if isinstance(row[5], str) and _VTAB_POINTER.match(row[5]) else row[5], row[6])
+        for row in program
+    )
+    return program, frozenset(tables)
+
+
+def _cell(value, max_string):
+    if isinstance(value, str) and len(value) > max_string:
+        return value[:max_string] + "..."
+    return value
+
+
+def run_guarded_query(query, timeout_s=None, max_rows=None, max_bytes=None, conn=None,
+                      params=(), cache=None, pool=None):
+    """
+    Chạy câu SQL trong giới hạn. Trả về dict:
+        columns, rows (list tuple), full_scans, truncated (None / "rows" / "bytes"), cached
+    Raise UnsafeQueryError khi câu lệnh bị từ chối, sqlite3.Error khi chạy lỗi hoặc quá thời gian
+    (OperationalError "interrupted").
+    cache: SQLResultCache (tùy chọn) để dùng lại kết quả của câu lệnh tương đương.
+    pool: ConnectionPool của DB (mặc định get_pool()), dùng để phát hiện ghi từ process khác.
+    """
+    timeout_s = config.SQL_TOOL_TIMEOUT_S if timeout_s is None else timeout_s
+    max_rows = max_rows or config.SQL_TOOL_MAX_ROWS
+    max_bytes = max_bytes or config.SQL_TOOL_MAX_BYTES
+    pool = pool or get_pool()
+    conn = conn or pool.reader()
+    query = _normalize(query)
+    params = tuple(params)
+
+    # Xuống dòng trước ")" để comment "--" ở cuối câu không nuốt mất phần bọc
+    bounded = f"SELECT * FROM (\n{query}\n) LIMIT {int(max_rows) + 1}"
+    deadline = time.perf_counter() + timeout_s
+    conn.set_progress_handler(lambda: int(time.perf_counter() > deadline), PROGRESS_STEPS)
+    try:
+        key = tables = generation = None
+        if cache is not None:
+            cache.sync(pool.external_version())
+            generation = cache.generation
+            with span("sql_guard_cache") as record:
+                program, tables = canonical_statement(conn, query, params)
+                key = (program, params, max_rows, max_bytes)
+                result = cache.get(key)
+                if record is not None:
+                    record["attrs"]["hit"] = result is not None
+            if result is not None:
+                # Tên cột lấy theo câu lệnh hiện tại (alias cột có thể khác câu đã cache)
+                columns = [d[0] for d in conn.execute(
+                    f"SELECT * FROM (\n{query}\n) LIMIT 0", params).description]
+                return dict(result, columns=columns, cached=True)
+
+        with span("sql_guard_plan"):
+            full_scans = check_query_plan(conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall())
+
+        with span("sql_guard_execute", full_scans=full_scans):
+            cursor = conn.execute(bounded, params)
+            columns = [d[0] for d in cursor.description]
+            raw_rows = cursor.fetchall()
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    truncated = "rows" if len(raw_rows) > max_rows else None
+    rows, size = [], 0
+    for raw in raw_rows[:max_rows]:
+        row = tuple(_cell(v, config.SQL_TOOL_MAX_STRING) for v in raw)
+        size += len(repr(row))
+        if rows and size > max_bytes:
+            truncated = "bytes"
+            break
+        rows.append(row)
+    result = {"columns": columns, "rows": rows, "full_scans": full_scans, "truncated": truncated,
+              "cached": False}
+    if cache is not None:
+        cache.put(key, tables, result, generation=generation)
+    return result
@@ -0,0 +1,104 @@
+"""
+benchmark_encoder.py
+====================
+Kiểm tra backend ONNX (int8) so với SentenceTransformer (PyTorch):
+    - parity: cosine similarity giữa embedding ONNX và PyTorch cho từng câu
+      (thoát với mã lỗi 1 nếu có câu dưới ngưỡng --min-cosine)
+    - độ trễ p50 / p99 khi encode từng câu truy vấn và khi encode cả batch
+
+Lần chạy đầu (cần model trong HF cache hoặc có mạng) sẽ export sang config.ONNX_CACHE_DIR;
+các lần sau backend "onnx" chỉ đọc file local, chạy được offline hoàn toàn.
+    python src/utils/benchmark_encoder.py
+    python src/utils/benchmark_encoder.py --models BAAI/bge-small-en-v1.5 --no-quantize
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if SRC_PATH not in sys.path:
+    sys.path.append(SRC_PATH)
+
+import config
+from encoders import export_onnx, load_encoder, model_cache_dir
+
+SAMPLE_QUERIES = [
+    "query: What is the book 'The Hobbit' about?",
+    "query: dark fantasy novels with morally grey heroes",
+    "query: biography of english author",
+    "query: children's book about reading and writing",
+    "query: navy seal war memoir",
+    "query: cheapest horror book",
+    "query: Tìm sách dựa trên các sở thích sau: category Fantasy AND author Tolkien",
+    "query: beginner guide to machine learning with python",
+    "query: cozy mystery set in a small english village",
+    "query: a",
+]
+
+
+def cosine_parity(reference, candidate):
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return np.einsum('ij,ij->i', reference, candidate)
+
+
+def latency_ms(encoder, texts, repeats):
+    single = []
+    for _ in range(repeats):
+        for text in texts:
+            t0 = time.perf_counter()
+            encoder.encode([text], normalize_embeddings=True)
+            single.append((time.perf_counter() - t0) * 1000)
+    batch = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        encoder.encode(texts, batch_size=len(texts), normalize_embeddings=True)
+        batch.append((time.perf_counter() - t0) * 1000)
+    return np.percentile(single, 50), np.percentile(single, 99), np.percentile(batch, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity + latency của encoder ONNX so với PyTorch.")
+    parser.add_argument("--models", nargs="+", default=[config.EMBEDDING_MODEL, config.CLIP_MODEL])
+    parser.add_argument("--cache-dir", default=config.ONNX_CACHE_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="So sánh bản ONNX fp32 thay vì int8.")
+    parser.add_argument("--re-export", action="store_true", help="Xóa bản export cũ và export lại.")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    quantize = not args.no_quantize
+
+    failed = False
+    for model_name in args.models:
+        if args.re_export:
+            shutil.rmtree(model_cache_dir(args.cache_dir, model_name), ignore_errors=True)
+            export_onnx(model_name, args.cache_dir, quantize=quantize)
+
+        torch_encoder = load_encoder(model_name, "torch")
+        onnx_encoder = load_encoder(model_name, "onnx", cache_dir=args.cache_dir, quantize=quantize)
+        # In độ chính xác thực sự (int8 có thể đã fallback sang fp32)
+        print(f"\n=== {model_name} (onnx-{onnx_encoder.precision}) ===")
+
+        reference = np.asarray(torch_encoder.encode(SAMPLE_QUERIES, normalize_embeddings=True), dtype='float32')
+        candidate = onnx_encoder.encode(SAMPLE_QUERIES, normalize_embeddings=True)
+        cosines = cosine_parity(reference, candidate)
+        status = "OK" if cosines.min() >= args.min_cosine else "FAIL"
+        failed |= status == "FAIL"
+        print(f"[Parity] cosine min={cosines.min():.5f} mean={cosines.mean():.5f} "
+              f"(ngưỡng {args.min_cosine}) -> {status}")
+
+        for name, encoder in (("torch", torch_encoder), ("onnx", onnx_encoder)):
+            p50, p99, batch_p50 = latency_ms(encoder, SAMPLE_QUERIES, args.repeats)
+            print(f"[Latency] {name:<6} 1 câu: p50={p50:.2f} ms p99={p99:.2f} ms | "
+                  f"batch {len(SAMPLE_QUERIES)} câu: p50={batch_p50:.2f} ms")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
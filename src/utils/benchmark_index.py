@@ -0,0 +1,159 @@
+"""
+benchmark_index.py
+==================
+So sánh các loại FAISS index (flat / ivf / hnsw / ivfpq / sq8 / pq) trên embeddings.npy:
+    - recall@k so với baseline IndexFlatL2
+    - độ trễ p50 / p99 cho mỗi truy vấn đơn lẻ
+    - thời gian build và kích thước index
+    - với index nén: thêm một dòng "+rerank" (rerank chính xác trên embeddings gốc)
+
+Chạy từ thư mục gốc của project:
+    python src/utils/benchmark_index.py --types flat ivf hnsw ivfpq --k 20
+    python src/utils/benchmark_index.py --types hnsw --ef-search 32 64 128 --save hnsw
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if SRC_PATH not in sys.path:
+    sys.path.append(SRC_PATH)
+
+import config
+from vectorstore import INDEX_TYPES, build_faiss_index, exact_rerank, is_compressed_index, make_search_params
+
+
+def sample_queries(embeddings, n_queries, noise=0.05, seed=0):
+    """
+    Lấy ngẫu nhiên các vector trong corpus, cộng nhiễu rồi chuẩn hóa lại,
+    để truy vấn không trùng khít với một điểm có sẵn trong index.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(embeddings), size=n_queries, replace=False)
+    queries = embeddings[picks] + rng.normal(0, noise, size=(n_queries, embeddings.shape[1]))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype('float32')
+
+
+def recall_at_k(ground_truth, retrieved, k):
+    """Tỉ lệ trung bình số láng giềng thật (flat) xuất hiện trong top-k của index ANN."""
+    hits = [len(set(gt[:k]) & set(rt[:k])) for gt, rt in zip(ground_truth, retrieved)]
+    return float(np.mean(hits)) / k
+
+
+def time_queries(index, queries, k, params=None, embeddings=None, rerank_factor=1):
+    """
+    Chạy từng truy vấn một (giống lúc phục vụ API) và trả về (I, latencies_ms).
+    Nếu truyền embeddings: lấy k * rerank_factor ứng viên rồi rerank chính xác (tính cả vào độ trễ).
+    """
+    all_I = np.empty((len(queries), k), dtype='int64')
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        q = queries[i:i + 1]
+        t0 = time.perf_counter()
+        if embeddings is not None:
+            _, I = index.search(q, k * rerank_factor, params=params)
+            _, I = exact_rerank(embeddings, q, I, k)
+        else:
+            _, I = index.search(q, k, params=params)
+        latencies[i] = (time.perf_counter() - t0) * 1000
+        all_I[i] = I[0]
+    return all_I, latencies
+
+
+def run_benchmark(embeddings, index_types, k=20, n_queries=1000, nprobes=None, ef_searches=None,
+                  rerank_factor=config.RERANK_FACTOR):
+    queries = sample_queries(embeddings, n_queries)
+
+    print(f"[Benchmark] Đang tính ground truth với IndexFlatL2 trên {len(embeddings)} vectors...")
+    flat = build_faiss_index(embeddings, "flat")
+    _, ground_truth = flat.search(queries, k)
+
+    rows = []
+    built = {}
+    for index_type in index_types:
+        t0 = time.perf_counter()
+        index = flat if index_type == "flat" else build_faiss_index(embeddings, index_type)
+        build_s = time.perf_counter() - t0
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        built[index_type] = index
+
+        if index_type in ("ivf", "ivfpq"):
+            knobs = [("nprobe", v) for v in (nprobes or [config.IVF_NPROBE])]
+        elif index_type == "hnsw":
+            knobs = [("efSearch", v) for v in (ef_searches or [config.HNSW_EF_SEARCH])]
+        else:
+            knobs = [("-", None)]
+
+        for knob_name, knob_value in knobs:
+            params = make_search_params(
+                index,
+                nprobe=knob_value if knob_name == "nprobe" else None,
+                ef_search=knob_value if knob_name == "efSearch" else None,
+            )
+            variants = [(index_type, None)]
+            if is_compressed_index(index) and rerank_factor > 1:
+                variants.append((f"{index_type}+rerank", embeddings))
+            for label, rerank_source in variants:
+                I, latencies = time_queries(index, queries, k, params=params,
+                                            embeddings=rerank_source, rerank_factor=rerank_factor)
+                rows.append({
+                    "type": label,
+                    "knob": f"{knob_name}={knob_value}" if knob_value is not None else "-",
+                    "recall": recall_at_k(ground_truth, I, k),
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p99_ms": float(np.percentile(latencies, 99)),
+                    "build_s": build_s,
+                    "size_mb": size_mb,
+                })
+    return rows, built
+
+
+def print_report(rows, k):
+    header = f"{'type':<14}{'knob':<15}{f'recall@{k}':>11}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}{'size MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['type']:<14}{r['knob']:<15}{r['recall']:>11.4f}{r['p50_ms']:>10.3f}"
+              f"{r['p99_ms']:>10.3f}{r['build_s']:>10.2f}{r['size_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall/latency của các loại FAISS index.")
+    parser.add_argument("--embeddings", default=config.EMBEDDINGS_PATH)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--nprobe", type=int, nargs="+", help="Các giá trị nprobe cần thử (IVF).")
+    parser.add_argument("--ef-search", type=int, nargs="+", help="Các giá trị efSearch cần thử (HNSW).")
+    parser.add_argument("--rerank-factor", type=int, default=config.RERANK_FACTOR,
+                        help="Số ứng viên (k * factor) để rerank chính xác với index nén; 1 = tắt.")
+    parser.add_argument("--save", choices=INDEX_TYPES,
+                        help="Ghi index của loại này ra config.FAISS_INDEX_PATH sau khi benchmark.")
+    args = parser.parse_args()
+
+    print(f"[Benchmark] Đang tải embeddings từ: {args.embeddings}")
+    embeddings = np.load(args.embeddings).astype('float32')
+
+    types = list(args.types)
+    if args.save and args.save not in types:
+        types.append(args.save)
+
+    rows, built = run_benchmark(
+        embeddings, types, k=args.k, n_queries=args.queries,
+        nprobes=args.nprobe, ef_searches=args.ef_search, rerank_factor=args.rerank_factor,
+    )
+    print_report(rows, args.k)
+
+    if args.save:
+        print(f"[Benchmark] Đang lưu index '{args.save}' tại: {config.FAISS_INDEX_PATH}")
+        faiss.write_index(built[args.save], config.FAISS_INDEX_PATH)
+
+
+if __name__ == "__main__":
+    main()
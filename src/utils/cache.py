@@ -0,0 +1,310 @@
+"""
+cache.py
+========
+Cache LRU có giới hạn kích thước, kèm một lớp lưu trữ SQLite (tùy chọn)
+để dữ liệu còn lại sau khi restart server.
+
+    - LRUCache       : cache key (str) -> value (bytes), có đếm hit/miss, TTL tùy chọn
+    - EmbeddingCache : cache vector embedding theo (tên model, text đã chuẩn hóa)
+    - ExpansionCache : cache kết quả mở rộng câu hỏi của LLM theo (model, num_queries, câu hỏi)
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """
+    Cache 2 tầng: OrderedDict trong RAM (LRU) + bảng SQLite trên đĩa (tùy chọn).
+    Thread-safe; giá trị luôn là bytes.
+    ttl_s: entry cũ hơn ttl_s giây (tính từ lúc put) bị coi như không có, None = không hết hạn.
+
+    Ghi đĩa kiểu write-behind: put chỉ đưa entry vào bộ đệm, thời điểm truy cập của các
+    disk hit chỉ được ghi nhận trong RAM; một thread nền ghi cả lô trong một transaction
+    mỗi flush_interval_s giây (hoặc ngay khi bộ đệm đủ flush_size entry) và khi close().
+    Đường đọc không bao giờ chờ commit.
+    """
+
+    def __init__(self, max_size=10000, path=None, table="cache", max_disk_size=None, ttl_s=None,
+                 flush_interval_s=1.0, flush_size=256):
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size or max_size * 10
+        self.table = table
+        self.ttl_s = ttl_s
+        self.flush_interval_s = flush_interval_s
+        self.flush_size = flush_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+
+        # key -> (value, created) chờ ghi / đang được ghi; key -> thời điểm disk hit gần nhất
+        self._pending = {}
+        self._flushing = {}
+        self._touched = {}
+        self._db_lock = threading.Lock()
+        self._flush_wakeup = threading.Event()
+        self._closed = False
+        self._flusher = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+        self._db = None
+        self._writer = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Connection ghi chỉ dùng trong flush (thread nền); connection đọc phục vụ get
+            self._writer = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            self._writer.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(key TEXT PRIMARY KEY, value BLOB, accessed REAL, created REAL)"
+            )
+            # File cache tạo trước khi có TTL: thêm cột created
+            columns = [row[1] for row in self._writer.execute(f"PRAGMA table_info({table})")]
+            if "created" not in columns:
+                self._writer.execute(f"ALTER TABLE {table} ADD COLUMN created REAL")
+            self._writer.commit()
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+
+            self._flusher = threading.Thread(target=self._flush_loop, name=f"cache-flush-{table}", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def get(self, key):
+        with self._lock:
+            now = time.time()
+            if key in self._data:
+                value, created = self._data[key]
+                if not self._is_expired(created, now):
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                if self._db is None:
+                    self.expired += 1
+
+            if self._db is not None:
+                # Entry đã put nhưng chưa xuống đĩa (có thể đã bị đẩy khỏi LRU trong RAM)
+                row = self._pending.get(key) or self._flushing.get(key)
+                from_disk = row is None
+                if from_disk:
+                    row = self._db.execute(
+                        f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)
+                    ).fetchone()
+                if row is not None and not self._is_expired(row[1], now):
+                    self.hits += 1
+                    if from_disk:
+                        self.disk_hits += 1
+                        # Chỉ ghi nhận trong RAM, UPDATE accessed được gom vào lần flush tiếp theo
+                        self._touched[key] = now
+                    self._put_memory(key, row[0], row[1])
+                    return row[0]
+                if row is not None:
+                    # Entry hết hạn trên đĩa được _prune_disk xóa, không ghi trên đường đọc
+                    self.expired += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            now = time.time()
+            self._put_memory(key, value, now)
+            if self._db is not None:
+                self._pending[key] = (value, now)
+                self._touched.pop(key, None)
+                if len(self._pending) >= self.flush_size:
+                    self._flush_wakeup.set()
+
+    def flush(self):
+        """Ghi các put / thời điểm truy cập đang chờ xuống đĩa trong một transaction."""
+        if self._writer is None:
+            return
+        with self._db_lock:
+            with self._lock:
+                if not self._pending and not self._touched:
+                    return
+                self._flushing, self._pending = self._pending, {}
+                touched, self._touched = self._touched, {}
+            try:
+                with self._writer:
+                    self._writer.executemany(
+                        f"INSERT OR REPLACE INTO {self.table} (key, value, accessed, created) VALUES (?, ?, ?, ?)",
+                        ((key, value, created, created) for key, (value, created) in self._flushing.items()),
+                    )
+                    self._writer.executemany(
+                        f"UPDATE {self.table} SET accessed = ? WHERE key = ?",
+                        ((accessed, key) for key, accessed in touched.items()),
+                    )
+            except sqlite3.Error as e:
+                print(f"[Cache] Lỗi ghi cache '{self.table}' xuống đĩa: {e}")
+            self._puts_since_prune += len(self._flushing)
+            with self._lock:
+                self._flushing = {}
+            if self._puts_since_prune >= 1000:
+                self._prune_disk()
+
+    def clear(self):
+        with self._db_lock:
+            with self._lock:
+                self._data.clear()
+                self._pending.clear()
+                self._touched.clear()
+                if self._writer is not None:
+                    self._writer.execute(f"DELETE FROM {self.table}")
+                    self._writer.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "pending_writes": len(self._pending),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._flusher is not None:
+            self._flush_wakeup.set()
+            self._flusher.join()
+        self.flush()
+        with self._db_lock, self._lock:
+            for conn in (self._db, self._writer):
+                if conn is not None:
+                    conn.close()
+            self._db = None
+            self._writer = None
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._flush_wakeup.wait(self.flush_interval_s)
+            self._flush_wakeup.clear()
+            if self._closed:
+                return
+            self.flush()
+
+    def _is_expired(self, created, now):
+        # created = NULL: entry ghi trước khi có TTL, coi như còn hạn
+        return self.ttl_s is not None and created is not None and now - created > self.ttl_s
+
+    def _put_memory(self, key, value, created):
+        self._data[key] = (value, created)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def _prune_disk(self):
+        """Xóa entry hết hạn và các entry ít được truy cập nhất khi bảng trên đĩa vượt quá max_disk_size."""
+        self._puts_since_prune = 0
+        if self.ttl_s is not None:
+            self._writer.execute(f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.ttl_s,))
+        self._writer.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_size,),
+        )
+        self._writer.commit()
+
+
+class EmbeddingCache:
+    """
+    Cache embedding của câu truy vấn, key = (tên model, text đã chuẩn hóa).
+    Query lặp lại sẽ bỏ qua hoàn toàn bước forward của transformer.
+    """
+
+    def __init__(self, max_size=10000, path=None):
+        self._cache = LRUCache(max_size=max_size, path=path, table="embeddings")
+
+    @staticmethod
+    def normalize_text(text):
+        # BGE và CLIP đều dùng tokenizer lowercase, nên gộp khác biệt hoa/thường và khoảng trắng
+        return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+    def make_key(self, model_name, text):
+        return f"{model_name}\x1f{self.normalize_text(text)}"
+
+    def encode(self, model, model_name, texts, **encode_kwargs):
+        """
+        Encode một list text, chỉ gọi model.encode cho các text chưa có trong cache.
+        Trả về ma trận float32 shape (len(texts), dim), cùng thứ tự với texts.
+        """
+        keys = [self.make_key(model_name, t) for t in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+        for i, key in enumerate(keys):
+            cached = self._cache.get(key)
+            if cached is not None:
+                vectors[i] = np.frombuffer(cached, dtype='float32')
+            else:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            miss_positions = [positions[0] for positions in missing.values()]
+            encoded = model.encode(
+                [texts[i] for i in miss_positions],
+                batch_size=len(miss_positions),
+                **encode_kwargs,
+            )
+            encoded = np.asarray(encoded, dtype='float32')
+            for (key, positions), vec in zip(missing.items(), encoded):
+                self._cache.put(key, vec.tobytes())
+                for i in positions:
+                    vectors[i] = vec
+
+        return np.ascontiguousarray(np.vstack(vectors), dtype='float32')
+
+    def stats(self):
+        return self._cache.stats()
+
+    def clear(self):
+        self._cache.clear()
+
+    def close(self):
+        self._cache.close()
+
+
+class ExpansionCache:
+    """
+    Cache các câu hỏi mở rộng do LLM sinh ra, key = (model, num_queries, câu hỏi đã chuẩn hóa).
+    Câu hỏi lặp lại (kể cả prompt cố định của tool gợi ý cá nhân hóa) không cần gọi LLM.
+    """
+
+    def __init__(self, max_size=5000, path=None, ttl_s=None):
+        self._cache = LRUCache(max_size=max_size, path=path, table="expansions", ttl_s=ttl_s)
+
+    def make_key(self, model_name, num_queries, query):
+        return f"{model_name}\x1f{num_queries}\x1f{EmbeddingCache.normalize_text(query)}"
+
+    def get(self, model_name, num_queries, query):
+        cached = self._cache.get(self.make_key(model_name, num_queries, query))
+        return None if cached is None else json.loads(cached.decode("utf-8"))
+
+    def put(self, model_name, num_queries, query, queries):
+        value = json.dumps(list(queries), ensure_ascii=False).encode("utf-8")
+        self._cache.put(self.make_key(model_name, num_queries, query), value)
+
+    def stats(self):
+        return self._cache.stats()
+
+    def clear(self):
+        self._cache.clear()
+
+    def close(self):
+        self._cache.close()
@@ -0,0 +1,124 @@
+"""
+fake_llm.py
+===========
+LLM giả lập cho test / benchmark, thay cho OpenAI khi mở rộng câu hỏi:
+    - FakeChatClient: stub chạy trong process, API giống OpenAI().chat.completions.create
+          OpenAIQueryExpander(client=FakeChatClient(latency_s=0.5))
+    - server HTTP tương thích OpenAI (POST /v1/chat/completions), không cần mạng hay API key:
+          python src/utils/fake_llm.py --port 8001 --latency 0.5
+          OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake uvicorn src.app.main:app
+
+Câu trả lời là các biến thể cố định của câu hỏi gốc, nên kết quả lặp lại được.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+VARIANT_TEMPLATES = (
+    "books about {query}",
+    "best books on {query}",
+    "summary of {query}",
+    "recommendations similar to {query}",
+    "reviews of {query}",
+)
+
+
+def fake_expansion(prompt):
+    """Sinh list câu hỏi (dạng Python literal) từ prompt của OpenAIQueryExpander."""
+    query_match = re.search(r"Original Query:\s*(.+)", prompt)
+    count_match = re.search(r"generate (\d+)", prompt)
+    query = query_match.group(1).strip() if query_match else prompt.strip()
+    num_queries = int(count_match.group(1)) if count_match else 4
+    variants = [VARIANT_TEMPLATES[i % len(VARIANT_TEMPLATES)].format(query=query) for i in range(num_queries)]
+    return json.dumps(variants, ensure_ascii=False)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, messages, timeout=None, **kwargs):
+        owner = self._owner
+        with owner._lock:
+            owner.calls += 1
+        if owner.latency_s:
+            if timeout is not None and owner.latency_s > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f"FakeChatClient: vượt quá timeout {timeout}s")
+            time.sleep(owner.latency_s)
+        content = fake_expansion(messages[-1]["content"])
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=content))],
+        )
+
+
+class FakeChatClient:
+    """Stub trong process thay cho openai.OpenAI; đếm số lần gọi và giả lập độ trễ mạng."""
+
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+
+def make_handler(client):
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            response = client.chat.completions.create(body.get("model", "fake"), body.get("messages", []))
+            payload = json.dumps({
+                "id": f"chatcmpl-fake-{client.calls}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": response.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": response.choices[0].message.content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeOpenAIHandler
+
+
+def serve(host="127.0.0.1", port=8001, latency_s=0.0):
+    server = ThreadingHTTPServer((host, port), make_handler(FakeChatClient(latency_s)))
+    print(f"[FakeLLM] Đang lắng nghe tại http://{host}:{port}/v1 (latency {latency_s}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập OpenAI chat completions cho test / benchmark.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ giả lập mỗi request (giây).")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.latency)
+
+
+if __name__ == "__main__":
+    main()
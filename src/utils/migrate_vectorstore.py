@@ -0,0 +1,73 @@
+"""
+migrate_vectorstore.py
+======================
+Chuyển cặp file index.faiss / unique_ids.pkl cũ sang dạng dùng được với
+VS_LOAD_MODE = "mmap":
+    - unique_ids.pkl (list Python) -> unique_ids.npy (mảng độ rộng cố định, mmap được)
+    - kiểm tra index.faiss memory-map được và khớp số lượng với id map
+
+Chạy từ thư mục gốc của project:
+    python src/utils/migrate_vectorstore.py
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import faiss
+import numpy as np
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if SRC_PATH not in sys.path:
+    sys.path.append(SRC_PATH)
+
+import config
+from vectorstore import ids_to_array, load_mmap_artefacts
+
+
+def migrate(index_path, pkl_path, npy_path):
+    print(f"[Migrate] Đang đọc id map cũ: {pkl_path}")
+    with open(pkl_path, 'rb') as f:
+        unique_ids = pickle.load(f)
+
+    ids_array = ids_to_array(unique_ids)
+    print(f"[Migrate] {len(ids_array)} ids, dtype={ids_array.dtype} "
+          f"({ids_array.nbytes / 1e6:.1f} MB thay vì list Python)")
+
+    index = faiss.read_index(index_path, faiss.IO_FLAG_READ_ONLY)
+    if index.ntotal != len(ids_array):
+        raise ValueError(f"Index có {index.ntotal} vectors nhưng unique_ids.pkl có {len(ids_array)} phần tử.")
+    del index
+
+    # Ghi ra file tạm rồi rename để worker đang chạy không đọc phải file ghi dở
+    tmp_path = npy_path + ".tmp.npy"
+    np.save(tmp_path, ids_array)
+    os.replace(tmp_path, npy_path)
+    print(f"[Migrate] Đã ghi: {npy_path}")
+
+    t0 = time.perf_counter()
+    index, mmapped_ids = load_mmap_artefacts(index_path, npy_path)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    sample = np.random.default_rng(0).choice(len(mmapped_ids), size=min(1000, len(mmapped_ids)), replace=False)
+    for pos in sample:
+        value = mmapped_ids[pos]
+        value = value.decode('ascii') if isinstance(value, bytes) else str(value)
+        if value != str(unique_ids[pos]):
+            raise ValueError(f"Id tại vị trí {pos} không khớp sau khi chuyển đổi.")
+    print(f"[Migrate] Kiểm tra mmap OK: {index.ntotal} vectors, load trong {elapsed_ms:.1f} ms.")
+    print('[Migrate] Đặt VS_LOAD_MODE = "mmap" trong config.py để sử dụng.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển vector store sang định dạng memory-map.")
+    parser.add_argument("--index", default=config.FAISS_INDEX_PATH)
+    parser.add_argument("--ids-pkl", default=config.META_PATH)
+    parser.add_argument("--ids-npy", default=config.UNIQUE_IDS_NPY_PATH)
+    args = parser.parse_args()
+    migrate(args.index, args.ids_pkl, args.ids_npy)
+
+
+if __name__ == "__main__":
+    main()
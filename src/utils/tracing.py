@@ -0,0 +1,132 @@
+"""
+tracing.py
+==========
+Tracing nhẹ cho pipeline retrieval / agent: đo thời gian từng giai đoạn bằng
+time.perf_counter (monotonic) và trả về kết quả dạng dict.
+
+    with start_trace("chat") as trace:
+        with span("index_search", k=20):
+            ...
+    trace.to_dict()  ->  {"name": "chat", "total_ms": ..., "spans": [...], "by_stage": {...}}
+
+Trace hiện tại được giữ trong contextvars. Khi không có trace nào đang chạy,
+span() chỉ đọc một ContextVar rồi trả về ngay, nên chi phí gần như bằng 0.
+Code chạy trong thread pool phải được bọc bằng wrap_context() để thấy trace của request.
+"""
+
+import contextvars
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_current_trace = contextvars.ContextVar("bookinsight_trace", default=None)
+_current_span = contextvars.ContextVar("bookinsight_span", default=None)
+_NULL_SPAN = nullcontext()
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.end_time = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def begin(self, name, parent_id=None, **attrs):
+        """Mở một span thủ công (dùng cho callback không có with); trả về record để truyền vào end()."""
+        record = {
+            "name": name,
+            "parent_id": parent_id,
+            "start_ms": (time.perf_counter() - self.t0) * 1000,
+            "duration_ms": None,
+            "attrs": attrs,
+        }
+        with self._lock:
+            record["id"] = len(self.spans)
+            self.spans.append(record)
+        return record
+
+    def end(self, record, **attrs):
+        record["duration_ms"] = (time.perf_counter() - self.t0) * 1000 - record["start_ms"]
+        if attrs:
+            record["attrs"].update(attrs)
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+
+    def to_dict(self):
+        end_time = self.end_time or time.perf_counter()
+        with self._lock:
+            spans = [dict(s, attrs=dict(s["attrs"])) for s in self.spans]
+        by_stage = {}
+        for s in spans:
+            if s["duration_ms"] is not None:
+                by_stage[s["name"]] = by_stage.get(s["name"], 0.0) + s["duration_ms"]
+        return {
+            "name": self.name,
+            "total_ms": (end_time - self.t0) * 1000,
+            "spans": spans,
+            "by_stage": by_stage,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name):
+    """Bắt đầu một trace mới cho request hiện tại (trace lồng nhau dùng lại trace ngoài)."""
+    existing = _current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+    trace = Trace(name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def span(name, **attrs):
+    """
+    Đo một giai đoạn. Yield record của span (dict, có thể gán thêm record["attrs"][...])
+    hoặc None khi tracing không bật.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        # Không tạo generator mới: dùng lại một context manager rỗng
+        return _NULL_SPAN
+    return _span(trace, name, attrs)
+
+
+@contextmanager
+def _span(trace, name, attrs):
+    record = trace.begin(name, parent_id=_current_span.get(), **attrs)
+    token = _current_span.set(record["id"])
+    try:
+        yield record
+    finally:
+        _current_span.reset(token)
+        trace.end(record)
+
+
+def wrap_context(func):
+    """Gắn context hiện tại (trace + span cha) vào func trước khi gửi sang thread khác."""
+    if _current_trace.get() is None:
+        return func
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, func)
+
+
+def current_span_id():
+    return _current_span.get()
@@ -1,40 +1,731 @@
+import os
 import faiss
 import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import config
+from utils.locks import ReadWriteLock
+from encoders import encoder_cache_key, load_encoder
+from utils.cache import EmbeddingCache
+from utils.tracing import span
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq8", "pq")
+CHUNK_AGGREGATIONS = ("max", "sum")
+
+
+def build_faiss_index(embeddings, index_type=None):
+    """
+    Xây dựng FAISS index theo loại cấu hình trong config.INDEX_TYPE.
+    - flat : IndexFlatL2 (brute-force, recall tuyệt đối)
+    - ivf  : IndexIVFFlat (chia cluster, chỉ quét nprobe cluster)
+    - hnsw : IndexHNSWFlat (đồ thị, không cần train)
+    - ivfpq: IndexIVFPQ (IVF + nén Product Quantization)
+    - sq8  : IndexScalarQuantizer 8-bit (nén ~4x)
+    - pq   : IndexPQ (nén PQ_M bytes/vector)
+    """
+    index_type = index_type or config.INDEX_TYPE
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    n, d = embeddings.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type in ("ivf", "ivfpq"):
+        # FAISS cần khoảng 39 điểm train cho mỗi cluster
+        nlist = max(1, min(config.IVF_NLIST, n // 39))
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, config.IVFPQ_M, config.IVFPQ_NBITS)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, config.HNSW_M)
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif index_type == "pq":
+        index = faiss.IndexPQ(d, config.PQ_M, config.PQ_NBITS, faiss.METRIC_L2)
+    else:
+        raise ValueError(f"INDEX_TYPE không hợp lệ: '{index_type}'. Chọn một trong {INDEX_TYPES}")
+
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        n_train = min(n, ivf.nlist * 256 if ivf is not None else 100_000)
+        sample = embeddings[np.random.default_rng(0).choice(n, n_train, replace=False)]
+        print(f"[VectorStore] Đang train index '{index_type}' trên {n_train} vectors...")
+        index.train(sample)
+
+    index.add(embeddings)
+    apply_query_defaults(index)
+    return index
+
+
+def apply_query_defaults(index):
+    """Gán nprobe / efSearch mặc định từ config cho index vừa load hoặc vừa build."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = config.IVF_NPROBE
+    hnsw_index = _find_hnsw(index)
+    if hnsw_index is not None:
+        hnsw_index.hnsw.efSearch = config.HNSW_EF_SEARCH
+
+
+def make_search_params(index, nprobe=None, ef_search=None, sel=None):
+    """
+    Tạo SearchParameters cho một lần truy vấn (không thay đổi trạng thái của index).
+    sel: faiss.IDSelector giới hạn các id được phép trả về (theo label của IndexIDMap).
+    Trả về None nếu không có knob nào được truyền hoặc index không hỗ trợ.
+    """
+    kwargs = {} if sel is None else {"sel": sel}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if nprobe is None and not kwargs:
+            return None
+        # SearchParametersIVF mặc định nprobe=1, nên luôn truyền giá trị hiện tại của index
+        return faiss.SearchParametersIVF(nprobe=int(nprobe if nprobe is not None else ivf.nprobe), **kwargs)
+    hnsw_index = _find_hnsw(index)
+    if hnsw_index is not None:
+        if ef_search is None and not kwargs:
+            return None
+        ef = ef_search if ef_search is not None else hnsw_index.hnsw.efSearch
+        return faiss.SearchParametersHNSW(efSearch=int(ef), **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+
+def is_compressed_index(index):
+    """True nếu index lưu vector dạng nén (khoảng cách trả về chỉ là xấp xỉ)."""
+    compressed_types = (faiss.IndexScalarQuantizer, faiss.IndexPQ, faiss.IndexIVFPQ, faiss.IndexIVFScalarQuantizer)
+    index = faiss.downcast_index(index)
+    while hasattr(index, "index") and not isinstance(index, compressed_types):
+        index = faiss.downcast_index(index.index)
+    return isinstance(index, compressed_types)
+
+
+def exact_rerank(embeddings, query_vectors, I, k):
+    """
+    Tính lại khoảng cách L2 chính xác cho các ứng viên I (lấy từ index nén)
+    dựa trên embeddings gốc (float32, có thể là mảng mmap), rồi giữ top-k.
+    Trả về (D, I) shape (n_queries, k), -1 / inf cho các ô trống.
+    """
+    n_queries, n_candidates = I.shape
+    valid = I >= 0
+    # Đọc các dòng embeddings theo thứ tự tăng dần -> truy cập mmap tuần tự, mỗi dòng một lần
+    unique_positions, inverse = np.unique(I[valid], return_inverse=True)
+    candidate_vectors = np.asarray(embeddings[unique_positions], dtype='float32')
+
+    distances = np.full((n_queries, n_candidates), np.inf, dtype='float32')
+    diff = candidate_vectors[inverse] - np.repeat(query_vectors, valid.sum(axis=1), axis=0)
+    distances[valid] = np.einsum('ij,ij->i', diff, diff)
+
+    k = min(k, n_candidates)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    D = np.take_along_axis(distances, order, axis=1)
+    I = np.where(np.isinf(D), -1, np.take_along_axis(I, order, axis=1))
+    return D, I
+
+
+def exact_search_subset(embeddings, query_vectors, labels, k):
+    """
+    Brute-force L2 chính xác chỉ trên các dòng embeddings[labels] (ví dụ tập sách thỏa bộ lọc).
+    Trả về (D, I) shape (n_queries, k) với I là label gốc, -1 / inf cho ô trống.
+    """
+    vectors = np.asarray(embeddings[labels], dtype='float32')
+    distances = (
+        np.einsum('ij,ij->i', vectors, vectors)[None, :]
+        - 2.0 * query_vectors @ vectors.T
+        + np.einsum('ij,ij->i', query_vectors, query_vectors)[:, None]
+    )
+    n_queries = len(query_vectors)
+    top = min(k, len(labels))
+    part = np.argpartition(distances, top - 1, axis=1)[:, :top]
+    part_d = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_d, axis=1, kind='stable')
+    D = np.full((n_queries, k), np.inf, dtype='float32')
+    I = np.full((n_queries, k), -1, dtype='int64')
+    D[:, :top] = np.take_along_axis(part_d, order, axis=1)
+    I[:, :top] = labels[np.take_along_axis(part, order, axis=1)]
+    return D, I
+
+
+def scale_search_knobs(index, selectivity, k, nprobe=None, ef_search=None):
+    """
+    Khi chỉ một phần nhỏ vector được phép trả về (IDSelector), tăng nprobe / efSearch
+    tỉ lệ nghịch với độ chọn lọc để vẫn tìm đủ k kết quả.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nlist, int(np.ceil((nprobe or ivf.nprobe) / selectivity)))
+    hnsw_index = _find_hnsw(index)
+    if hnsw_index is not None:
+        ef = max(ef_search or hnsw_index.hnsw.efSearch, k)
+        ef_search = min(config.FILTER_MAX_EF_SEARCH, int(np.ceil(ef / selectivity)))
+    return nprobe, ef_search
+
+
+def aggregate_chunk_hits(D, I, chunk_book, k, method="max"):
+    """
+    Gộp kết quả mức chunk thành mức sách, vector hóa trên cả batch truy vấn.
+    D là khoảng cách L2 giữa các vector đã chuẩn hóa -> similarity = 1 - D / 2.
+    method: "max" (chunk tốt nhất của mỗi sách) hoặc "sum" (cộng điểm các chunk).
+    Trả về (D, I) shape (n_queries, k): I là label sách (không trùng lặp),
+    D = 2 - 2 * score (với "max" đúng bằng khoảng cách của chunk tốt nhất).
+    """
+    if method not in CHUNK_AGGREGATIONS:
+        raise ValueError(f"CHUNK_AGGREGATION không hợp lệ: '{method}'. Chọn một trong {CHUNK_AGGREGATIONS}")
+    n_queries = len(I)
+    out_D = np.full((n_queries, k), np.inf, dtype='float32')
+    out_I = np.full((n_queries, k), -1, dtype='int64')
+    rows, cols = np.nonzero(I >= 0)
+    if len(rows) == 0:
+        return out_D, out_I
+
+    books = chunk_book[I[rows, cols]].astype('int64')
+    sims = 1.0 - D[rows, cols].astype('float64') / 2.0
+    width = int(books.max()) + 1
+    keys = rows.astype('int64') * width + books
+    if method == "max":
+        # Mỗi hàng kết quả FAISS đã sắp xếp theo khoảng cách tăng dần
+        # -> lần xuất hiện đầu tiên của (query, sách) chính là chunk tốt nhất
+        unique_keys, first = np.unique(keys, return_index=True)
+        scores = sims[first]
+    else:
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=sims, minlength=len(unique_keys))
+
+    query_rows = unique_keys // width
+    order = np.lexsort((-scores, query_rows))
+    query_rows, book_labels, scores = query_rows[order], (unique_keys % width)[order], scores[order]
+    rank = np.arange(len(query_rows)) - np.searchsorted(query_rows, query_rows)
+    keep = rank < k
+    out_D[query_rows[keep], rank[keep]] = 2.0 - 2.0 * scores[keep]
+    out_I[query_rows[keep], rank[keep]] = book_labels[keep]
+    return out_D, out_I
+
+
+def _find_hnsw(index):
+    index = faiss.downcast_index(index)
+    while True:
+        if hasattr(index, "hnsw"):
+            return index
+        if not hasattr(index, "index"):
+            return None
+        index = faiss.downcast_index(index.index)
+
+
+def mmap_io_flags(flat_codes=True):
+    """
+    IO flags để FAISS memory-map file index thay vì đọc vào heap.
+    flat_codes: thêm IO_FLAG_MMAP_IFC (mmap cả flat codes, chỉ có ở các bản FAISS mới) - dùng được cho
+    flat / HNSW / SQ / PQ nhưng làm read_index lỗi với inverted lists của IVF ("mmap only supported
+    for File objects"), IVF chỉ dùng IO_FLAG_MMAP.
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    if flat_codes:
+        flags |= getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    return flags
+
+
+def read_index_mmap(index_path):
+    """Memory-map một file index bất kỳ loại nào: thử IO_FLAG_MMAP_IFC trước, lỗi (IVF) thì chỉ IO_FLAG_MMAP."""
+    flags = mmap_io_flags()
+    if flags != mmap_io_flags(flat_codes=False):
+        try:
+            return faiss.read_index(index_path, flags)
+        except RuntimeError:
+            pass
+    return faiss.read_index(index_path, mmap_io_flags(flat_codes=False))
+
+
+def load_mmap_artefacts(index_path=None, ids_path=None):
+    """
+    Memory-map index.faiss và unique_ids.npy (read-only).
+    Nhiều process cùng đọc một file sẽ dùng chung một bản trong page cache của OS.
+    """
+    index_path = index_path or config.FAISS_INDEX_PATH
+    ids_path = ids_path or config.UNIQUE_IDS_NPY_PATH
+    print(f"[VectorStore] Đang memory-map FAISS index: {index_path}")
+    index = read_index_mmap(index_path)
+    print(f"[VectorStore] Đang memory-map id map: {ids_path}")
+    unique_ids = np.load(ids_path, mmap_mode='r')
+    if index.ntotal != len(unique_ids):
+        raise ValueError(f"Index có {index.ntotal} vectors nhưng id map có {len(unique_ids)} phần tử.")
+    return index, unique_ids
+
+
+def append_npy_rows(path, rows):
+    """
+    Nối thêm rows vào cuối một file .npy (C-order) mà không đọc lại toàn bộ file:
+    chỉ ghi lại header (shape mới) và phần dữ liệu mới. Nếu dtype khác hoặc
+    header đổi độ dài thì ghi lại cả file.
+    """
+    import io
+    from numpy.lib import format as npy_format
+
+    rows = np.ascontiguousarray(rows)
+    if not os.path.exists(path):
+        np.save(path, rows)
+        return
+
+    with open(path, 'rb') as f:
+        version = npy_format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+        data_offset = f.tell()
+
+    header = {"descr": npy_format.dtype_to_descr(dtype), "fortran_order": False,
+              "shape": (shape[0] + len(rows),) + tuple(shape[1:])}
+    buffer = io.BytesIO()
+    if version == (1, 0):
+        npy_format.write_array_header_1_0(buffer, header)
+    else:
+        npy_format.write_array_header_2_0(buffer, header)
+
+    if fortran_order or dtype != rows.dtype or tuple(shape[1:]) != rows.shape[1:] or buffer.tell() != data_offset:
+        existing = np.load(path)
+        merged = np.concatenate([existing.astype(np.result_type(existing, rows)), rows])
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, merged)
+        os.replace(tmp_path, path)
+        return
+
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        f.write(rows.tobytes())
+        f.seek(0)
+        f.write(buffer.getvalue())
+
+
+def ids_to_array(unique_ids):
+    """Chuyển list unique_id (str) sang mảng numpy độ rộng cố định ('S' nếu toàn ASCII, ngược lại 'U')."""
+    unique_ids = [str(u) for u in unique_ids]
+    if all(u.isascii() for u in unique_ids):
+        return np.array([u.encode('ascii') for u in unique_ids], dtype='S')
+    return np.array(unique_ids, dtype='U')
+
+
+class ChunkIndex:
+    """
+    Index mức chunk: mỗi sách có nhiều vector (các đoạn description / features / author_about).
+    Chunk được lưu liên tiếp theo label sách: các chunk của sách `label` nằm ở
+    [book_offsets[label], book_offsets[label + 1]) trong index.
+    """
+
+    def __init__(self, index, book_offsets, dead_books=None, chunk_dir=None):
+        self.index = index
+        self.book_offsets = np.asarray(book_offsets, dtype='int64')
+        self.chunk_book = np.repeat(np.arange(self.n_books, dtype='int32'), np.diff(self.book_offsets))
+        # Sách đã bị compact khỏi index sách nhưng chunk vẫn còn trong index này
+        self.dead_books = np.asarray(dead_books if dead_books is not None else [], dtype='int64')
+        self.chunk_dir = chunk_dir or config.CHUNK_DIR
+        self._selector_cache = None
+
+    @classmethod
+    def load(cls, chunk_dir=None, mmap=False):
+        """Đọc index chunk từ chunk_dir, None nếu chưa build (python src/cli.py build-index --chunks)."""
+        chunk_dir = chunk_dir or config.CHUNK_DIR
+        index_path = os.path.join(chunk_dir, "index.faiss")
+        if not os.path.exists(index_path):
+            return None
+        print(f"[VectorStore] Đang tải index chunk từ: {index_path}")
+        index = read_index_mmap(index_path) if mmap else faiss.read_index(index_path)
+        apply_query_defaults(index)
+        book_offsets = np.load(os.path.join(chunk_dir, "book_offsets.npy"))
+        dead_path = os.path.join(chunk_dir, "dead_books.npy")
+        dead_books = np.load(dead_path) if os.path.exists(dead_path) else None
+        if index.ntotal != book_offsets[-1]:
+            raise ValueError(f"Index chunk có {index.ntotal} vectors nhưng book_offsets trỏ tới {book_offsets[-1]}.")
+        return cls(index, book_offsets, dead_books, chunk_dir)
+
+    @property
+    def n_books(self):
+        return len(self.book_offsets) - 1
+
+    def search(self, query_vectors, k, book_mask=None, nprobe=None, ef_search=None, cache_key=None):
+        """
+        Tìm k sách (không trùng) bằng cách lấy k * CHUNK_OVERSAMPLE chunk rồi gộp điểm theo sách.
+        book_mask: mảng bool theo label sách (None = mọi sách còn sống).
+        cache_key: nếu khác None, selector tính từ book_mask được cache theo key này.
+        """
+        n_chunks = k * config.CHUNK_OVERSAMPLE
+        sel = None
+        if book_mask is not None or len(self.dead_books):
+            if cache_key is not None and self._selector_cache and self._selector_cache[0] == cache_key:
+                _, sel, selectivity = self._selector_cache
+            else:
+                sel, selectivity = self._make_selector(book_mask)
+                if cache_key is not None:
+                    self._selector_cache = (cache_key, sel, selectivity)
+            if sel is None:
+                n_queries = len(query_vectors)
+                return np.full((n_queries, k), np.inf, dtype='float32'), np.full((n_queries, k), -1, dtype='int64')
+            nprobe, ef_search = scale_search_knobs(self.index, selectivity, n_chunks, nprobe, ef_search)
+
+        params = make_search_params(self.index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        D, I = self.index.search(query_vectors, n_chunks, params=params)
+        return aggregate_chunk_hits(D, I, self.chunk_book, k, config.CHUNK_AGGREGATION)
+
+    def _make_selector(self, book_mask):
+        mask = np.ones(self.n_books, dtype=bool)
+        if book_mask is not None:
+            m = min(len(book_mask), self.n_books)
+            mask[:m] = book_mask[:m]
+            mask[m:] = False
+        mask[self.dead_books[self.dead_books < self.n_books]] = False
+        chunk_mask = mask[self.chunk_book]
+        n_eligible = int(chunk_mask.sum())
+        if n_eligible == 0:
+            return None, 0.0
+        bitmap = np.packbits(chunk_mask, bitorder='little')
+        sel = faiss.IDSelectorBitmap(bitmap)
+        # IDSelectorBitmap chỉ giữ con trỏ tới bitmap
+        sel.referenced_objects = [bitmap]
+        return sel, n_eligible / len(chunk_mask)
+
+    def add(self, labels, chunk_counts, vectors):
+        """
+        Thêm chunk cho các sách mới. labels phải tăng dần và lớn hơn mọi label đã có
+        (label mới luôn được cấp ở cuối id map); vectors xếp theo đúng thứ tự đó.
+        """
+        labels = np.asarray(labels, dtype='int64')
+        chunk_counts = np.asarray(chunk_counts, dtype='int64')
+        if len(labels) == 0:
+            return
+        if labels[0] < self.n_books or np.any(np.diff(labels) <= 0):
+            raise ValueError("Label của chunk mới phải tăng dần và lớn hơn các label đã có.")
+        counts = np.zeros(int(labels[-1]) + 1 - self.n_books, dtype='int64')
+        counts[labels - self.n_books] = chunk_counts
+
+        embeddings_path = os.path.join(self.chunk_dir, "embeddings.npy")
+        if os.path.exists(embeddings_path):
+            append_npy_rows(embeddings_path, vectors)
+        self.index.add(vectors)
+        self.book_offsets = np.concatenate([self.book_offsets, self.book_offsets[-1] + np.cumsum(counts)])
+        self.chunk_book = np.concatenate([self.chunk_book, np.repeat(labels.astype('int32'), chunk_counts)])
+        self._selector_cache = None
+
+    def mark_dead(self, labels):
+        self.dead_books = np.union1d(self.dead_books, np.asarray(labels, dtype='int64'))
+        self._selector_cache = None
+
+    def save(self):
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        index_path = os.path.join(self.chunk_dir, "index.faiss")
+        faiss.write_index(self.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        np.save(os.path.join(self.chunk_dir, "book_offsets.npy"), self.book_offsets)
+        np.save(os.path.join(self.chunk_dir, "dead_books.npy"), self.dead_books)
+
 
 class BookVectorStore:
     def __init__(self, device='cpu'):
+        # Nhiều search chạy song song, upsert/delete/compact giữ khóa ghi
+        self.lock = ReadWriteLock()
+        self.tombstones = np.empty(0, dtype='int64')
+        self._live_selector = None
+        self._version = 0
+        # Tăng mỗi khi có sách được thêm / xóa; các cache phụ thuộc catalogue dùng để tự làm mới
+        self.catalog_version = 0
+        self._label_map = None
+        self._label_map_version = -1
+        self._raw_embeddings = None
+
         print(f"[VectorStore] Đang khởi tạo...")
         print(f"[VectorStore] Đang tải Model Embedding: {config.EMBEDDING_MODEL}")
-        self.model = SentenceTransformer(config.EMBEDDING_MODEL, device=device)
+        self.model = load_encoder(
+            config.EMBEDDING_MODEL, config.ENCODER_BACKEND, device=device,
+            cache_dir=config.ONNX_CACHE_DIR, quantize=config.ONNX_QUANTIZE,
+        )
+        self.encoder_key = encoder_cache_key(
+            config.EMBEDDING_MODEL, config.ENCODER_BACKEND, config.ONNX_QUANTIZE, encoder=self.model
+        )
+        self.embedding_cache = EmbeddingCache(config.EMBEDDING_CACHE_SIZE, config.EMBEDDING_CACHE_PATH)
+
+        if config.VS_LOAD_MODE == "mmap":
+            self.index, self.unique_ids_list = load_mmap_artefacts()
+        else:
+            print(f"[VectorStore] Đang tải FAISS index từ: {config.FAISS_INDEX_PATH}")
+            self.index = faiss.read_index(config.FAISS_INDEX_PATH)
 
-        print(f"[VectorStore] Đang tải FAISS index từ: {config.FAISS_INDEX_PATH}")
-        self.index = faiss.read_index(config.FAISS_INDEX_PATH)
+            print(f"[VectorStore] Đang tải metadata từ: {config.META_PATH}")
+            with open(config.META_PATH, 'rb') as f:
+                self.unique_ids_list = pickle.load(f)
+        apply_query_defaults(self.index)
 
-        print(f"[VectorStore] Đang tải metadata từ: {config.META_PATH}")
-        with open(config.META_PATH, 'rb') as f:
-            self.unique_ids_list = pickle.load(f)
+        # Index nén: giữ embeddings.npy dạng mmap để rerank chính xác top ứng viên
+        self.embeddings = None
+        if config.EXACT_RERANK and is_compressed_index(self.index):
+            print(f"[VectorStore] Index nén -> memory-map embeddings gốc để rerank: {config.EMBEDDINGS_PATH}")
+            self.embeddings = np.load(config.EMBEDDINGS_PATH, mmap_mode='r')
+
+        # Index mức chunk (nếu đã build): kết quả được gộp theo sách trước khi trả về
+        self.chunks = None
+        if config.USE_CHUNK_INDEX:
+            self.chunks = ChunkIndex.load(config.CHUNK_DIR, mmap=config.VS_LOAD_MODE == "mmap")
 
         print(f" [VectorStore] Khởi tạo hoàn tất. Sẵn sàng tìm kiếm.")
 
-    def search(self, query_text, k=5):
+    def search(self, query_text, k=5, nprobe=None, ef_search=None, id_filter=None):
         """
         Thực hiện tìm kiếm vector cơ bản.
+        nprobe / ef_search: knob cho từng truy vấn với index IVF / HNSW
+        (None = dùng giá trị mặc định trong config).
+        id_filter: mảng bool theo label, chỉ những vector True mới được chấm điểm.
         Trả về: (list_of_unique_ids, list_of_positions, list_of_distances)
         """
+        return self.search_many([query_text], k=k, nprobe=nprobe, ef_search=ef_search, id_filter=id_filter)[0]
+
+    def search_many(self, queries, k=5, nprobe=None, ef_search=None, id_filter=None):
+        """
+        Tìm kiếm nhiều câu hỏi cùng lúc: encode tất cả trong MỘT lần forward (batch)
+        và chạy MỘT lần index.search trên ma trận truy vấn.
+        Embedding của các câu đã gặp được lấy từ cache, không encode lại.
+        Trả về: list các tuple (unique_ids, positions, distances), cùng thứ tự với queries.
+        """
+        if not queries:
+            return []
+        query_vectors = self.encode_queries(queries)
+        D, I = self.search_vectors(query_vectors, k=k, nprobe=nprobe, ef_search=ef_search, id_filter=id_filter)
+        return self.format_results(D, I)
+
+    def encode_queries(self, queries):
+        """Encode list câu hỏi (có instruction "query: " của BGE), dùng cache embedding."""
         # Model BGE cần instruction "query: "
-        query_with_instruction = f"query: {query_text}"
+        queries_with_instruction = [f"query: {q}" for q in queries]
+
+        # Chỉ những câu chưa có trong cache mới đi qua model (một batch duy nhất)
+        with span("encode", n_queries=len(queries)):
+            return self.embedding_cache.encode(
+                self.model, self.encoder_key, queries_with_instruction, normalize_embeddings=True
+            )
+
+    def search_vectors(self, query_vectors, k=5, nprobe=None, ef_search=None, id_filter=None):
+        """Tìm kiếm trên ma trận query đã encode. Trả về (D, I) như faiss, -1 ở ô trống."""
+        with span("index_search", n_queries=len(query_vectors), k=k, filtered=id_filter is not None), \
+                self.lock.read():
+            if self.chunks is not None:
+                if id_filter is None:
+                    book_mask = self._live_mask() if len(self.tombstones) else None
+                    return self.chunks.search(query_vectors, k, book_mask, nprobe, ef_search,
+                                              cache_key=self.catalog_version)
+                return self.chunks.search(query_vectors, k, self._eligible_mask(id_filter), nprobe, ef_search)
+            if id_filter is not None:
+                return self._search_filtered(query_vectors, k, nprobe, ef_search, id_filter)
+            # Loại các label đã bị xóa / thay thế nhưng chưa compact khỏi index
+            params = make_search_params(self.index, nprobe=nprobe, ef_search=ef_search, sel=self._live_selector)
+            return self._search_index(query_vectors, k, params)
+
+    def format_results(self, D, I):
+        results = []
+        for row_I, row_D in zip(I, D):
+            # IVF/HNSW có thể trả về -1 khi không đủ k láng giềng
+            valid = row_I >= 0
+            retrieved_indices = row_I[valid]
+            retrieved_distances = row_D[valid]
+            retrieved_unique_ids = self.ids_for_positions(retrieved_indices)
+            results.append((retrieved_unique_ids, retrieved_indices, retrieved_distances))
+        return results
 
-        query_vector = self.model.encode([query_with_instruction], normalize_embeddings=True)
-        query_vector = np.array(query_vector).astype('float32')
+    def _search_index(self, query_vectors, k, params):
+        if self.embeddings is not None:
+            _, I = self.index.search(query_vectors, k * config.RERANK_FACTOR, params=params)
+            return exact_rerank(self.embeddings, query_vectors, I, k)
+        return self.index.search(query_vectors, k, params=params)
 
-        D, I = self.index.search(query_vector, k)
+    def _search_filtered(self, query_vectors, k, nprobe, ef_search, id_filter):
+        """
+        Chỉ chấm điểm các label thỏa bộ lọc (không lọc sau khi search):
+        - tập nhỏ: tính khoảng cách chính xác trên embeddings của đúng các label đó
+        - tập lớn: truyền IDSelectorBitmap vào FAISS, tăng nprobe / efSearch theo độ chọn lọc
+          để không trả về trang rỗng
+        """
+        mask = self._eligible_mask(id_filter)
+        eligible = np.flatnonzero(mask)
+
+        if len(eligible) == 0:
+            n_queries = len(query_vectors)
+            return np.full((n_queries, k), np.inf, dtype='float32'), np.full((n_queries, k), -1, dtype='int64')
+
+        raw_vectors = self._raw_vectors()
+        if len(eligible) <= config.FILTER_BRUTE_FORCE_MAX and raw_vectors is not None:
+            return exact_search_subset(raw_vectors, query_vectors, eligible, k)
+
+        bitmap = np.packbits(mask, bitorder='little')
+        sel = faiss.IDSelectorBitmap(bitmap)
+        nprobe, ef_search = scale_search_knobs(self.index, len(eligible) / len(mask), k, nprobe, ef_search)
+        params = make_search_params(self.index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        return self._search_index(query_vectors, k, params)
+
+    def _eligible_mask(self, id_filter):
+        """Mảng bool theo label: thỏa id_filter và chưa bị xóa."""
+        mask = self._live_mask()
+        m = min(len(id_filter), len(mask))
+        mask[:m] &= np.asarray(id_filter[:m], dtype=bool)
+        mask[m:] = False
+        return mask
+
+    def _live_mask(self):
+        mask = np.ones(len(self.unique_ids_list), dtype=bool)
+        if len(self.tombstones):
+            mask[self.tombstones[self.tombstones < len(mask)]] = False
+        return mask
+
+    def _raw_vectors(self):
+        """Embeddings float32 gốc theo label (mmap), None nếu không có embeddings.npy."""
+        if self.embeddings is not None:
+            return self.embeddings
+        if self._raw_embeddings is None and os.path.exists(config.EMBEDDINGS_PATH):
+            raw = np.load(config.EMBEDDINGS_PATH, mmap_mode='r')
+            if len(raw) >= len(self.unique_ids_list):
+                self._raw_embeddings = raw
+        return self._raw_embeddings
+
+    def labels_for_ids(self, unique_ids):
+        """Đổi unique_id sang label FAISS (bản mới nhất nếu sách đã được upsert), -1 nếu không có."""
+        if self._label_map is None or self._label_map_version != self.catalog_version:
+            all_ids = self.ids_for_positions(range(len(self.unique_ids_list)))
+            # Sách được upsert lại có label mới hơn ở cuối, dict giữ giá trị sau cùng
+            self._label_map = {uid: label for label, uid in enumerate(all_ids)}
+            self._label_map_version = self.catalog_version
+        label_map = self._label_map
+        return np.fromiter((label_map.get(str(u), -1) for u in unique_ids), dtype='int64', count=len(unique_ids))
+
+    def ids_for_positions(self, positions):
+        """Đổi list vị trí FAISS sang list unique_id (str), chạy được cả với list và mảng mmap."""
+        if isinstance(self.unique_ids_list, np.ndarray):
+            picked = self.unique_ids_list[np.asarray(positions, dtype='int64')]
+            if picked.dtype.kind == 'S':
+                return [u.decode('ascii') for u in picked]
+            return [str(u) for u in picked]
+        return [self.unique_ids_list[i] for i in positions]
+
+    # -------------------------------------------------------------------------
+    # CẬP NHẬT TĂNG DẦN (dùng bởi catalog.CatalogUpdater)
+    # -------------------------------------------------------------------------
+    def ensure_id_map(self):
+        """
+        Bọc index trong IndexIDMap2 (label = vị trí trong id map) để có thể
+        thêm / xóa từng vector. Chỉ cần làm một lần với index cũ build từ notebook.
+        """
+        if isinstance(faiss.downcast_index(self.index), faiss.IndexIDMap2):
+            return
+        if config.VS_LOAD_MODE == "mmap":
+            raise RuntimeError('Index đang memory-map read-only; cập nhật catalogue cần VS_LOAD_MODE = "heap".')
+
+        n = self.index.ntotal
+        print(f"[VectorStore] Đang chuyển index ({n} vectors) sang IndexIDMap2...")
+        if os.path.exists(config.EMBEDDINGS_PATH):
+            vectors = np.load(config.EMBEDDINGS_PATH, mmap_mode='r')[:n]
+        else:
+            vectors = self.index.reconstruct_n(0, n)
+        base = faiss.clone_index(self.index)
+        base.reset()
+        id_map = faiss.IndexIDMap2(base)
+        id_map.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), np.arange(n, dtype='int64'))
+        apply_query_defaults(id_map)
+        with self.lock.write():
+            self.index = id_map
+            self._version += 1
+
+    def embed_documents(self, documents, batch_size=64):
+        """Embed các document sách (không có instruction "query: ")."""
+        vectors = self.model.encode(documents, batch_size=batch_size, normalize_embeddings=True)
+        return np.ascontiguousarray(vectors, dtype='float32')
+
+    def add_vectors(self, unique_ids, vectors):
+        """Thêm vectors với label mới (nối tiếp id map). Trả về mảng label."""
+        with self.lock.write():
+            start = len(self.unique_ids_list)
+            labels = np.arange(start, start + len(unique_ids), dtype='int64')
+            # embeddings.npy phải có dòng mới TRƯỚC khi label xuất hiện trong index (rerank đọc theo label)
+            if os.path.exists(config.EMBEDDINGS_PATH):
+                append_npy_rows(config.EMBEDDINGS_PATH, vectors)
+                if self.embeddings is not None:
+                    self.embeddings = np.load(config.EMBEDDINGS_PATH, mmap_mode='r')
+            if isinstance(self.unique_ids_list, np.ndarray):
+                self.unique_ids_list = np.concatenate([self.unique_ids_list, ids_to_array(unique_ids)])
+            else:
+                self.unique_ids_list.extend(str(u) for u in unique_ids)
+            self.index.add_with_ids(vectors, labels)
+            self._raw_embeddings = None
+            self._version += 1
+            self.catalog_version += 1
+        return labels
+
+    def add_chunks(self, labels, chunk_counts, vectors):
+        """Thêm vector chunk cho các sách vừa add_vectors (chunk_counts[i] chunk cho labels[i])."""
+        if self.chunks is None:
+            return
+        with self.lock.write():
+            self.chunks.add(labels, chunk_counts, vectors)
+
+    def remove_labels(self, labels):
+        """Đánh dấu xóa (tombstone); vector thật sự bị loại khỏi index khi compact()."""
+        with self.lock.write():
+            self.set_tombstones(np.union1d(self.tombstones, np.asarray(labels, dtype='int64')))
+            self.catalog_version += 1
+
+    def set_tombstones(self, labels):
+        self.tombstones = np.asarray(labels, dtype='int64')
+        if len(self.tombstones) == 0:
+            self._live_selector = None
+            return
+        excluded = faiss.IDSelectorBatch(self.tombstones)
+        live_selector = faiss.IDSelectorNot(excluded)
+        # IDSelectorNot chỉ giữ con trỏ, phải giữ tham chiếu để không bị GC
+        live_selector.referenced_objects = [excluded]
+        self._live_selector = live_selector
+
+    def compact(self):
+        """
+        Loại vật lý các vector tombstone khỏi index. Thực hiện trên bản sao
+        rồi đổi con trỏ, nên các truy vấn đang chạy không bị chặn lâu.
+        """
+        dead = self.tombstones.copy()
+        if len(dead) == 0:
+            return 0
+        with self.lock.read():
+            source_version = self._version
+            compacted = faiss.clone_index(self.index)
+        try:
+            compacted.remove_ids(faiss.IDSelectorBatch(dead))
+        except RuntimeError:
+            # HNSW không hỗ trợ remove_ids: dựng lại index từ các vector còn sống
+            id_map = faiss.downcast_index(compacted)
+            live = np.setdiff1d(faiss.vector_to_array(id_map.id_map), dead)
+            vectors = np.vstack([id_map.reconstruct(int(label)) for label in live])
+            base = faiss.clone_index(faiss.downcast_index(id_map.index))
+            base.reset()
+            compacted = faiss.IndexIDMap2(base)
+            compacted.add_with_ids(vectors, live)
+        apply_query_defaults(compacted)
+        with self.lock.write():
+            if self._version != source_version:
+                # Có upsert chen vào trong lúc compact: bỏ kết quả, lần sau compact lại
+                return 0
+            self.index = compacted
+            if self.chunks is not None:
+                self.chunks.mark_dead(dead)
+            # Tombstone mới phát sinh trong lúc compact vẫn được giữ lại
+            self.set_tombstones(np.setdiff1d(self.tombstones, dead))
+        print(f"[VectorStore] Đã compact {len(dead)} vectors khỏi index.")
+        return len(dead)
 
-        retrieved_indices = I[0]
-        retrieved_distances = D[0]
+    def save(self):
+        """Ghi index và id map ra đĩa (ghi file tạm rồi rename)."""
+        with self.lock.read():
+            tmp_index = config.FAISS_INDEX_PATH + ".tmp"
+            faiss.write_index(self.index, tmp_index)
+            os.replace(tmp_index, config.FAISS_INDEX_PATH)
 
-        retrieved_unique_ids = [self.unique_ids_list[i] for i in retrieved_indices]
+            all_ids = self.ids_for_positions(range(len(self.unique_ids_list)))
+            tmp_meta = config.META_PATH + ".tmp"
+            with open(tmp_meta, 'wb') as f:
+                pickle.dump(all_ids, f)
+            os.replace(tmp_meta, config.META_PATH)
 
-        return retrieved_unique_ids, retrieved_indices, retrieved_distances
\ No newline at end of file
+            if os.path.exists(config.UNIQUE_IDS_NPY_PATH):
+                n_saved = len(np.load(config.UNIQUE_IDS_NPY_PATH, mmap_mode='r'))
+                append_npy_rows(config.UNIQUE_IDS_NPY_PATH, ids_to_array(all_ids[n_saved:]))
+            if self.chunks is not None:
+                self.chunks.save()
+        print(f"[VectorStore] Đã lưu index ({self.index.ntotal} vectors) và id map.")
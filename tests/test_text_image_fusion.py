@@ -0,0 +1,31 @@
+import unittest
+
+from src.retriever.text_image_retriever import TextImageRetriever
+
+
+def _hit(uid, distance, rank):
+    return {"id": rank, "score": distance, "rank": rank, "metadata": {"unique_id": uid, "title": uid}}
+
+
+class FuseResultsOrderTest(unittest.TestCase):
+    """FaissStore trả về khoảng cách L2: sách gần nhất phải đứng đầu với mọi fusion method."""
+
+    def setUp(self):
+        # fuse_results không dùng state của retriever
+        self.retriever = TextImageRetriever.__new__(TextImageRetriever)
+        self.text = [_hit("near", 0.1, 1), _hit("mid", 0.8, 2), _hit("far", 1.9, 3)]
+        self.image = [_hit("near", 0.2, 1), _hit("mid", 0.9, 2), _hit("far", 1.7, 3)]
+
+    def test_combsum_and_combmnz_rank_closest_first(self):
+        for method in ("weighted", "combsum", "combmnz"):
+            with self.subTest(method=method):
+                fused = self.retriever.fuse_results(self.text, self.image, method=method, k=3)
+                self.assertEqual([r["id"] for r in fused], ["near", "mid", "far"])
+
+    def test_rrf_ranks_closest_first(self):
+        fused = self.retriever.fuse_results(self.text, self.image, method="rrf", k=3)
+        self.assertEqual([r["id"] for r in fused], ["near", "mid", "far"])
+
+
+if __name__ == "__main__":
+    unittest.main()